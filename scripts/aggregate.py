@@ -3,17 +3,57 @@ import re
 import csv
 import json
 import time
+import hashlib
+import heapq
+import bisect
+import random
 import asyncio
+import collections
 import socket
+import ssl
+import base64
+import errno
+import struct
+import array
+import mmap
+import sqlite3
+import multiprocessing
+import queue as queue_module
+import sys
+import io
+import threading
+import signal
+import cProfile
+import pstats
+import tracemalloc
+import itertools
 from pathlib import Path
+from contextlib import contextmanager, nullcontext, ExitStack
 from datetime import datetime, timezone
-from typing import Set, Dict, List, Optional, Tuple, Any
-from dataclasses import dataclass, field
-from urllib.parse import urlparse
+from typing import Set, Dict, List, Optional, Tuple, Any, Callable, Iterator
+from operator import attrgetter
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from email.utils import formatdate
+from html.parser import HTMLParser
 import logging
 
 import requests
-from bs4 import BeautifulSoup
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:  # 未安装时只能使用流式 HTML 解析
+    BeautifulSoup = None
+
+try:
+    import aiohttp
+except ImportError:  # 未安装时回退到串行 requests
+    aiohttp = None
+
+try:
+    import resource
+except ImportError:  # Windows 无 rlimit，自动并发不读取 fd 上限
+    resource = None
 
 # ============================================================
 # 配置
@@ -30,8 +70,101 @@ logger = logging.getLogger(__name__)
 SKIP_VALIDATION = os.environ.get('SKIP_VALIDATION', 'false').lower() == 'true'
 VALIDATION_TIMEOUT = float(os.environ.get('VALIDATION_TIMEOUT', '3'))
 VALIDATION_CONCURRENCY = int(os.environ.get('VALIDATION_CONCURRENCY', '100'))
+# 自动并发（AIMD）: 以 VALIDATION_CONCURRENCY 为初始值，健康时加性增长，资源错误或超时突增时乘性回退
+AUTO_CONCURRENCY = os.environ.get('AUTO_CONCURRENCY', 'false').lower() == 'true'
+AUTO_CONCURRENCY_MAX = int(os.environ.get('AUTO_CONCURRENCY_MAX', '4096'))
+VALIDATION_WORKERS = int(os.environ.get('VALIDATION_WORKERS', '1'))  # >1 时启用多进程分片验证
+PROBE_ENGINE = os.environ.get('PROBE_ENGINE', 'streams').lower()     # streams / raw（非阻塞 socket）
+
+# 协议级验证: SOCKS5 握手 / HTTP CONNECT / TLS ClientHello（按协议或分类选择）
+PROTOCOL_CHECK = os.environ.get('PROTOCOL_CHECK', 'true').lower() == 'true'
+PROTOCOL_CHECK_TARGET = os.environ.get('PROTOCOL_CHECK_TARGET', '1.1.1.1:80')  # 代理中转测试目标
+TLS_CHECK_SNI = os.environ.get('TLS_CHECK_SNI', 'www.cloudflare.com')
+
+# 公平调度: 各 /24 轮询出队，每个 /24、每个运营商（ISP，未知时按 /16）的在途探测数上限，全局每秒连接数上限（0 不限）
+SUBNET_CONCURRENCY = int(os.environ.get('SUBNET_CONCURRENCY', '8'))
+PROVIDER_CONCURRENCY = int(os.environ.get('PROVIDER_CONCURRENCY', '32'))
+PROBE_RATE = float(os.environ.get('PROBE_RATE', '0'))
+
+# 延迟多次采样: 首轮通过的条目再测 K 次（0 关闭），相邻采样间隔约 LATENCY_SAMPLE_INTERVAL 秒
+LATENCY_SAMPLES = int(os.environ.get('LATENCY_SAMPLES', '0'))
+LATENCY_SAMPLE_INTERVAL = float(os.environ.get('LATENCY_SAMPLE_INTERVAL', '0.5'))
 OUTPUT_DIR = os.environ.get('OUTPUT_DIR', 'output')
 
+# 增量导出: 内容（不含时间戳）未变化的文件不重写，并输出 delta/ 增量文件
+INCREMENTAL_EXPORT = os.environ.get('INCREMENTAL_EXPORT', 'true').lower() == 'true'
+# 运行指标: METRICS_DIR/metrics.prom（Prometheus textfile）与 metrics.json
+METRICS_ENABLED = os.environ.get('METRICS', 'true').lower() == 'true'
+# 性能剖析（默认关闭）: PROFILE=cpu,memory,asyncio 或 all，输出到 OUTPUT_DIR/profile/
+PROFILE = os.environ.get('PROFILE', '').strip().lower()
+PROFILE_TOP = int(os.environ.get('PROFILE_TOP', '25'))
+PROFILE_SLOW_CALLBACK_MS = float(os.environ.get('PROFILE_SLOW_CALLBACK_MS', '100'))
+# JSON_COMPACT=true 时 all.json 不缩进
+JSON_COMPACT = os.environ.get('JSON_COMPACT', 'false').lower() == 'true'
+
+# 自适应超时: 按本次及历史观测到的延迟为每个端点 / 每个 /24 计算超时（VALIDATION_TIMEOUT 为上限）
+ADAPTIVE_TIMEOUT = os.environ.get('ADAPTIVE_TIMEOUT', 'false').lower() == 'true'
+ADAPTIVE_TIMEOUT_FLOOR = float(os.environ.get('ADAPTIVE_TIMEOUT_FLOOR', '0.3'))
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.environ.get('ADAPTIVE_TIMEOUT_MULTIPLIER', '3'))
+
+# 远程采集配置
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', '30'))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', '3'))
+FETCH_CONCURRENCY = int(os.environ.get('FETCH_CONCURRENCY', '8'))
+FETCH_BACKOFF = float(os.environ.get('FETCH_BACKOFF', '1'))
+
+# 远程源 HTTP 缓存配置
+CACHE_DIR = os.environ.get('CACHE_DIR', '.cache')
+HTTP_CACHE_ENABLED = os.environ.get('HTTP_CACHE', 'true').lower() == 'true'
+HTTP_CACHE_TTL_DAYS = float(os.environ.get('HTTP_CACHE_TTL_DAYS', '7'))
+HTTP_CACHE_MAX_MB = float(os.environ.get('HTTP_CACHE_MAX_MB', '64'))
+# 运行指标目录: 每次运行内容都会变化，默认放在不提交的缓存目录下，避免定时任务每次都产生提交
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(CACHE_DIR, 'metrics'))
+# 指标历史: 每次运行向 METRICS_DIR/metrics-history.ndjson 追加一行，只保留最近 N 次（0 为关闭）
+METRICS_HISTORY_RUNS = int(os.environ.get('METRICS_HISTORY_RUNS', '500'))
+# 增量导出状态（各输出文件与条目的摘要）: 同样放在缓存目录，不随 output/ 提交
+EXPORT_STATE_FILE = os.environ.get('EXPORT_STATE_FILE', os.path.join(CACHE_DIR, 'export_state.json'))
+
+# 探测结果持久化（跨运行复用近期结果，失败端点指数退避）
+PROBE_STORE_ENABLED = os.environ.get('PROBE_STORE', 'true').lower() == 'true'
+PROBE_DB = os.environ.get('PROBE_DB', os.path.join(CACHE_DIR, 'probes.sqlite3'))
+# 有效结果复用期需短于定时任务周期（6 小时），保证每次运行都会重新探测上一轮有效的端点
+PROBE_VALID_TTL_HOURS = float(os.environ.get('PROBE_VALID_TTL_HOURS', '5'))
+PROBE_FAIL_BACKOFF_HOURS = float(os.environ.get('PROBE_FAIL_BACKOFF_HOURS', '3'))
+PROBE_FAIL_MAX_HOURS = float(os.environ.get('PROBE_FAIL_MAX_HOURS', '168'))
+
+# 常驻模式（DAEMON=true）: 条目常驻内存，数据源按周期刷新、端点按优先级重新探测，有效集合变化时重新发布
+DAEMON_MODE = os.environ.get('DAEMON', 'false').lower() == 'true'
+DAEMON_SOURCE_INTERVAL = float(os.environ.get('DAEMON_SOURCE_INTERVAL', '1800'))   # 数据源默认刷新周期（秒）
+# 重新探测间隔（秒）: 有效且延迟不超过 DAEMON_FAST_MS 的端点 / 其余有效端点 / 失败端点（按连续失败次数翻倍，上限 DEAD）
+DAEMON_FAST_MS = float(os.environ.get('DAEMON_FAST_MS', '300'))
+DAEMON_PROBE_FAST_INTERVAL = float(os.environ.get('DAEMON_PROBE_FAST_INTERVAL', '300'))
+DAEMON_PROBE_VALID_INTERVAL = float(os.environ.get('DAEMON_PROBE_VALID_INTERVAL', '900'))
+DAEMON_PROBE_FAIL_INTERVAL = float(os.environ.get('DAEMON_PROBE_FAIL_INTERVAL', '1800'))
+DAEMON_PROBE_DEAD_INTERVAL = float(os.environ.get('DAEMON_PROBE_DEAD_INTERVAL', '86400'))
+DAEMON_PROBE_RATE = float(os.environ.get('DAEMON_PROBE_RATE', '20'))              # 每秒新建探测数上限
+DAEMON_HISTORY = int(os.environ.get('DAEMON_HISTORY', '8'))                        # 每个端点保留的探测延迟数
+# 重新发布: 有效集合变化数达到 max(MIN_CHANGES, CHANGE_RATIO × 有效数) 时发布，两次发布至少间隔 MIN_INTERVAL 秒；
+# 有任何变化且距上次发布超过 MAX_INTERVAL 秒时也发布
+DAEMON_PUBLISH_MIN_CHANGES = int(os.environ.get('DAEMON_PUBLISH_MIN_CHANGES', '10'))
+DAEMON_PUBLISH_CHANGE_RATIO = float(os.environ.get('DAEMON_PUBLISH_CHANGE_RATIO', '0.02'))
+DAEMON_PUBLISH_MIN_INTERVAL = float(os.environ.get('DAEMON_PUBLISH_MIN_INTERVAL', '60'))
+DAEMON_PUBLISH_MAX_INTERVAL = float(os.environ.get('DAEMON_PUBLISH_MAX_INTERVAL', '1800'))
+# 内置查询 API（常驻模式，API_PORT=0 关闭）: 每次发布后原子替换内存中的数据集
+API_PORT = int(os.environ.get('API_PORT', '0'))
+API_HOST = os.environ.get('API_HOST', '127.0.0.1')
+API_MAX_LIMIT = int(os.environ.get('API_MAX_LIMIT', '1000'))
+# 供下游流式读取的 all.ndjson（每行一条记录）与二进制快照 all.bin（定长记录，可 mmap）:
+# 默认只在常驻模式下导出，定时任务不把这两个大文件提交进仓库
+EXPORT_NDJSON = os.environ.get('EXPORT_NDJSON', str(DAEMON_MODE)).lower() == 'true'
+EXPORT_SNAPSHOT = os.environ.get('EXPORT_SNAPSHOT', str(DAEMON_MODE)).lower() == 'true'
+
+# HTML 解析方式: stream（单趟流式）/ soup（BeautifulSoup 三遍遍历）
+HTML_PARSER = os.environ.get('HTML_PARSER', 'stream').lower()
+
+# 解析器版本（解析逻辑变化时递增，使解析结果缓存失效）
+PARSER_VERSION = 4
+
 # 脚本目录
 SCRIPT_DIR = Path(__file__).parent.resolve()
 
@@ -40,6 +173,9 @@ SCRIPT_DIR = Path(__file__).parent.resolve()
 # ============================================================
 
 # 远程数据源
+# 可选字段: timeout / retries 覆盖全局 FETCH_TIMEOUT / FETCH_RETRIES
+#          max_age 缓存新鲜期（秒），期内直接使用缓存不发请求
+#          refresh 常驻模式下的刷新周期（秒），默认 DAEMON_SOURCE_INTERVAL（本地源同样适用）
 REMOTE_SOURCES = [
     {
         "name": "ipTop10.html",
@@ -105,34 +241,252 @@ LOCAL_SOURCES = [
     }
 ]
 
+# 无端口条目的候选端口（按数据源分类，未列出的分类使用 default）
+# 环境变量 DISCOVERY_PORTS 可覆盖，格式: "default=443,80;cloudflare=443,2053,8443"
+DISCOVERY_PORTS: Dict[str, List[int]] = {
+    "default": [443, 80, 8080, 1080],
+}
+for _item in filter(None, os.environ.get('DISCOVERY_PORTS', '').split(';')):
+    _category, _, _ports = _item.partition('=')
+    DISCOVERY_PORTS[_category.strip()] = [int(p) for p in _ports.split(',') if p.strip()]
+
+# 端口发现方式: first（首个成功即取消其余）/ all（等待全部候选，记录所有开放端口）
+DISCOVERY_MODE = os.environ.get('DISCOVERY_MODE', 'first').lower()
+
 
 # ============================================================
 # 数据结构
 # ============================================================
 
-@dataclass
+_intern = sys.intern
+
+
+def pack_ipv4(ip: str) -> int:
+    """IPv4 字符串 → 32 位整数（兼容带前导零的十进制写法）"""
+    try:
+        return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except OSError:
+        a, b, c, d = (int(x) for x in ip.split('.'))
+        if not all(0 <= x <= 255 for x in (a, b, c, d)):
+            raise ValueError(f"invalid IPv4 address: {ip}")
+        return (a << 24) | (b << 16) | (c << 8) | d
+
+
+def unpack_ipv4(value: int) -> str:
+    """32 位整数 → IPv4 字符串"""
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+
+def _intern_str(value: str) -> str:
+    """驻留非空字符串（空串本身就是单例）"""
+    return _intern(value) if value else value
+
+
+def _valid_flag(value: Optional[bool]) -> Optional[bool]:
+    """is_valid 统一为 None / True / False（共享元组表中 1 与 True 视为同一键）"""
+    return value if value is None else bool(value)
+
+
+class EntryExtra:
+    """IPEntry 中只有少数条目会设置的字段（代理协议、端口发现、握手及多次采样统计）"""
+    
+    __slots__ = (
+        'open_ports', 'protocol', 'proxy_auth', 'handshake_ms',
+        'latency_min', 'latency_p50', 'latency_p90', 'jitter_ms', 'loss_rate'
+    )
+    DEFAULTS = ((), '', '', None, None, None, None, None, None)
+    
+    def __init__(self):
+        for name, default in zip(self.__slots__, self.DEFAULTS):
+            setattr(self, name, default)
+    
+    def copy(self) -> 'EntryExtra':
+        clone = EntryExtra.__new__(EntryExtra)
+        for name in self.__slots__:
+            setattr(clone, name, getattr(self, name))
+        return clone
+
+
+# 共享元组表: 字段组合相同的条目引用同一个元组对象
+# 表满时整体清空（已有条目不受影响，只是之后的条目不再与之前的共享），常驻进程不会无限增长
+SHARED_TUPLES_MAX = 1 << 16
+_shared_tuples: Dict[tuple, tuple] = {}
+
+
+def _share(values: tuple) -> tuple:
+    """返回与 values 相等的共享元组"""
+    shared = _shared_tuples.get(values)
+    if shared is None:
+        if len(_shared_tuples) >= SHARED_TUPLES_MAX:
+            _shared_tuples.clear()
+        shared = _shared_tuples[values] = values
+    return shared
+
+
+def _shared_field(slot: str, index: int, normalize: Callable[[Any], Any]) -> property:
+    """IPEntry 上保存在共享元组中的字段: 写入时替换为新组合对应的共享元组"""
+    def get(self):
+        return getattr(self, slot)[index]
+    
+    def set(self, value):
+        values = getattr(self, slot)
+        setattr(self, slot, _share(values[:index] + (normalize(value),) + values[index + 1:]))
+    
+    return property(get, set)
+
+
+def _extra_field(name: str, default: Any) -> property:
+    """IPEntry 上的 EntryExtra 字段: 未分配时读到默认值，首次写入非默认值时才分配"""
+    def get(self):
+        extra = self._extra
+        return default if extra is None else getattr(extra, name)
+    
+    def set(self, value):
+        extra = self._extra
+        if extra is None:
+            if value == default and value.__class__ is default.__class__:
+                return
+            extra = self._extra = EntryExtra()
+        setattr(extra, name, value)
+    
+    return property(get, set)
+
+
 class IPEntry:
-    """IP 条目数据结构"""
-    ip: str
-    port: Optional[int] = None
+    """
+    IP 条目数据结构（紧凑存储）
+    - IP 与端口打包为一个整数 key = (ip_int << 16) | port，端口 0 表示无端口
+    - 来源 / 分类 / 地理 / 网络类型存为一个共享元组（INFO_FIELDS 顺序），同一组合的条目共用一个对象，
+      条目本身只占一个引用；验证状态 (is_valid, validation_error) 同理
+    - 少数条目才有的字段集中在可选的 EntryExtra 中，大多数条目只多占一个空槽位
+    - ip / port / address / location 及上述共享字段均为按需读取的属性
+    """
+    
+    # 字段顺序即构造参数顺序
+    FIELDS = (
+        'ip', 'port',
+        'source', 'category',                        # 来源信息
+        'country', 'region', 'city', 'isp',          # 地理信息
+        'net_type',                                  # 网络类型: 机房 / 家宽 / unknown
+        'is_valid', 'latency_ms', 'validation_error',# 验证结果
+        'open_ports',                                # 端口发现找到的全部开放端口
+        'protocol', 'proxy_auth',                    # 代理协议（socks5 / http / tls）及 user:pass
+        'handshake_ms',                              # 协议握手耗时（latency_ms 为 TCP 连接耗时）
+        'latency_min', 'latency_p50', 'latency_p90', # 多次采样统计（毫秒）
+        'jitter_ms', 'loss_rate'
+    )
+    
+    INFO_FIELDS = ('source', 'category', 'country', 'region', 'city', 'isp', 'net_type')
+    STATUS_FIELDS = ('is_valid', 'validation_error')
+    NO_STATUS = (None, '')
+    
+    __slots__ = ('key', '_info', '_status', 'latency_ms', '_extra')
+    
+    def __init__(
+        self,
+        ip,
+        port: Optional[int] = None,
+        source: str = "",
+        category: str = "",
+        country: str = "",
+        region: str = "",
+        city: str = "",
+        isp: str = "",
+        net_type: str = "",
+        is_valid: Optional[bool] = None,
+        latency_ms: Optional[float] = None,
+        validation_error: str = "",
+        open_ports: Tuple[int, ...] = (),
+        protocol: str = "",
+        proxy_auth: str = "",
+        handshake_ms: Optional[float] = None,
+        latency_min: Optional[float] = None,
+        latency_p50: Optional[float] = None,
+        latency_p90: Optional[float] = None,
+        jitter_ms: Optional[float] = None,
+        loss_rate: Optional[float] = None
+    ):
+        ip_int = pack_ipv4(ip) if ip.__class__ is str else ip
+        self.key = (ip_int << 16) | (port or 0)
+        self._info = self.shared_info(source, category, country, region, city, isp, net_type)
+        self._status = _share((_valid_flag(is_valid), _intern_str(validation_error)))
+        self.latency_ms = latency_ms
+        self._extra = None
+        if open_ports or protocol or proxy_auth or handshake_ms is not None or loss_rate is not None or (
+                latency_min is not None or latency_p50 is not None or latency_p90 is not None or jitter_ms is not None):
+            extra = self._extra = EntryExtra()
+            extra.open_ports = tuple(open_ports)
+            extra.protocol = _intern(protocol) if protocol else protocol
+            extra.proxy_auth = _intern(proxy_auth) if proxy_auth else proxy_auth
+            extra.handshake_ms = handshake_ms
+            extra.latency_min = latency_min
+            extra.latency_p50 = latency_p50
+            extra.latency_p90 = latency_p90
+            extra.jitter_ms = jitter_ms
+            extra.loss_rate = loss_rate
     
-    # 来源信息
-    source: str = ""
-    category: str = ""
+    @staticmethod
+    def shared_info(source: str = "", category: str = "", country: str = "", region: str = "",
+                    city: str = "", isp: str = "", net_type: str = "") -> tuple:
+        """INFO_FIELDS 各字段组成的共享元组（字符串驻留）"""
+        return _share(tuple(map(_intern_str, (source, category, country, region, city, isp, net_type))))
     
-    # 地理信息
-    country: str = ""
-    region: str = ""
-    city: str = ""
-    isp: str = ""
+    @classmethod
+    def from_key(cls, key: int, info: tuple) -> 'IPEntry':
+        """解析热路径用的快速构造: 已打包的 key 与 shared_info() 返回的元组，其余字段取默认值"""
+        self = cls.__new__(cls)
+        self.key = key
+        self._info = info
+        self._status = cls.NO_STATUS
+        self.latency_ms = self._extra = None
+        return self
     
-    # 网络类型: 机房 / 家宽 / unknown
-    net_type: str = ""
+    @property
+    def ip_int(self) -> int:
+        return self.key >> 16
+    
+    @property
+    def ip(self) -> str:
+        return unpack_ipv4(self.key >> 16)
+    
+    @ip.setter
+    def ip(self, value: str):
+        self.key = (pack_ipv4(value) << 16) | (self.key & 0xFFFF)
+    
+    @property
+    def port(self) -> Optional[int]:
+        return (self.key & 0xFFFF) or None
+    
+    @port.setter
+    def port(self, value: Optional[int]):
+        self.key = (self.key & ~0xFFFF) | (value or 0)
+    
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.FIELDS)
     
-    # 验证结果
-    is_valid: Optional[bool] = None
-    latency_ms: Optional[float] = None
-    validation_error: str = ""
+    def copy(self) -> 'IPEntry':
+        """拷贝（EntryExtra 一并复制，其余字段均为不可变值）"""
+        clone = IPEntry.__new__(IPEntry)
+        for name in self.__slots__:
+            setattr(clone, name, getattr(self, name))
+        if clone._extra is not None:
+            clone._extra = clone._extra.copy()
+        return clone
+    
+    def to_record(self) -> Dict[str, Any]:
+        """非空字段组成的字典，可用 IPEntry(**record) 还原"""
+        return {k: v for k, v in zip(self.FIELDS, self.as_tuple()) if v not in (None, "", ())}
+    
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return self.as_tuple() == other.as_tuple()
+    
+    __hash__ = None
+    
+    def __repr__(self):
+        args = ', '.join(f"{name}={value!r}" for name, value in zip(self.FIELDS, self.as_tuple()))
+        return f"IPEntry({args})"
     
     @property
     def address(self) -> str:
@@ -151,6 +505,33 @@ class IPEntry:
             parts.append(self.region)
         return " ".join(parts) if parts else ""
     
+    @property
+    def rank_latency(self) -> Optional[float]:
+        """
+        排序用延迟: 有多次采样时取 p50 / (1 - 丢包率)（每次成功连接的期望耗时），否则取单次延迟
+        全部丢包时返回 None
+        """
+        if self.loss_rate is None:
+            return self.latency_ms
+        if self.latency_p50 is None or self.loss_rate >= 1:
+            return None
+        return round(self.latency_p50 / (1 - self.loss_rate), 2)
+    
+    def set_latency_samples(self, samples: List[Optional[float]]):
+        """写入多次采样统计（None 表示该次失败）"""
+        ok = sorted(x for x in samples if x is not None)
+        self.loss_rate = round(1 - len(ok) / len(samples), 3) if samples else None
+        if not ok:
+            self.latency_min = self.latency_p50 = self.latency_p90 = self.jitter_ms = None
+            return
+        self.latency_min = ok[0]
+        self.latency_p50 = ok[(len(ok) - 1) // 2]
+        self.latency_p90 = ok[min(len(ok) - 1, -(-len(ok) * 9 // 10) - 1)]
+        # 抖动: 相邻成功采样之差的平均绝对值
+        ordered = [x for x in samples if x is not None]
+        diffs = [abs(b - a) for a, b in zip(ordered, ordered[1:])]
+        self.jitter_ms = round(sum(diffs) / len(diffs), 2) if diffs else 0.0
+    
     @property
     def net_type_en(self) -> str:
         mapping = {"机房": "datacenter", "家宽": "residential"}
@@ -172,10 +553,26 @@ class IPEntry:
             "location": self.location,
             "is_valid": self.is_valid,
             "latency_ms": self.latency_ms,
-            "validation_error": self.validation_error
+            "validation_error": self.validation_error,
+            "open_ports": list(self.open_ports),
+            "protocol": self.protocol,
+            "handshake_ms": self.handshake_ms,
+            "latency_min": self.latency_min,
+            "latency_p50": self.latency_p50,
+            "latency_p90": self.latency_p90,
+            "jitter_ms": self.jitter_ms,
+            "loss_rate": self.loss_rate
         }
 
 
+for _index, _name in enumerate(IPEntry.INFO_FIELDS):
+    setattr(IPEntry, _name, _shared_field('_info', _index, _intern_str))
+setattr(IPEntry, 'is_valid', _shared_field('_status', 0, _valid_flag))
+setattr(IPEntry, 'validation_error', _shared_field('_status', 1, _intern_str))
+for _name, _default in zip(EntryExtra.__slots__, EntryExtra.DEFAULTS):
+    setattr(IPEntry, _name, _extra_field(_name, _default))
+
+
 # ============================================================
 # 正则表达式
 # ============================================================
@@ -190,6 +587,20 @@ PROXY_URL_PATTERN = re.compile(
     re.IGNORECASE
 )
 
+# 代理协议及认证信息
+# - URL: scheme://[user:pass@]IP:PORT
+# - 扫描结果行: IP:PORT[:scheme] | user:pass | ...
+PROXY_SCHEME_URL_PATTERN = re.compile(
+    r'\b(socks[45]?|https?)://'
+    r'(?:([^:@\s]+:[^:@\s]+)@)?'
+    rf'({IPV4_PATTERN}):(\d{{1,5}})',
+    re.IGNORECASE
+)
+PROXY_RESULT_LINE_PATTERN = re.compile(
+    rf'^[ \t]*({IPV4_PATTERN}):(\d{{1,5}})(?::([a-z0-9]+))?[ \t]*\|[ \t]*([^|\s]*)[ \t]*\|',
+    re.IGNORECASE | re.MULTILINE
+)
+
 # 富信息 SOCKS5: socks5://IP:PORT [[类型] 国家 省 城市 [ISP]]
 SOCKS5_RICH_PATTERN = re.compile(
     rf'socks[45]?://({IPV4_PATTERN}):(\d{{1,5}})'
@@ -206,24 +617,240 @@ LOOSE_IP_PORT_PATTERN = re.compile(rf'\b({IPV4_PATTERN})[:#](\d{{1,5}})\b')
 # 纯 IP
 PURE_IP_PATTERN = re.compile(rf'\b({IPV4_PATTERN})\b')
 
+# 单趟扫描（bytes）: IP:PORT / IP#PORT / 纯 IP 合并为一个正则
+# 第一段按首位数字展开成字面量分支，正则引擎可按首字符快速跳过非数字位置；
+# 首字符后的 (?<!\w.) 等价于原来的前置 \b
+_SCAN_FIRST_OCTET = (
+    rb'(?:0(?<!\w.)[0-9]{0,2}|1(?<!\w.)[0-9]{0,2}|2(?<!\w.)(?:[0-4][0-9]|5[0-5]|[0-9])?'
+    rb'|3(?<!\w.)[0-9]?|4(?<!\w.)[0-9]?|5(?<!\w.)[0-9]?|6(?<!\w.)[0-9]?'
+    rb'|7(?<!\w.)[0-9]?|8(?<!\w.)[0-9]?|9(?<!\w.)[0-9]?)'
+)
+CONTENT_SCAN_PATTERN = re.compile(
+    rb'(' + _SCAN_FIRST_OCTET + rb'(?:\.(?:25[0-5]|2[0-4][0-9]|[01]?[0-9][0-9]?)){3})'
+    rb'(?:[:#](\d{1,5})\b|\b)'
+)
+
+# 代理 URL（bytes 版，只用于含 :// 的行）
+PROXY_URL_BYTES_PATTERN = re.compile(PROXY_URL_PATTERN.pattern.encode(), re.IGNORECASE)
+
+# bytes 与 str 正则语义可能不同的字符（\s 含 \x1c-\x1f、非 ASCII 的 \b / \d / 大小写折叠）
+SCAN_AMBIGUOUS_PATTERN = re.compile(rb'[\x1c-\x1f\x80-\xff]')
+
 
 # ============================================================
 # 网络工具
 # ============================================================
 
-def fetch_url(url: str, timeout: int = 30, retries: int = 3) -> str:
+HTTP_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+
+
+def backoff_delay(attempt: int, base: float = FETCH_BACKOFF) -> float:
+    """指数退避 + 随机抖动"""
+    return base * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+
+class HTTPCache:
+    """
+    远程源磁盘缓存
+    - http/: 响应体 + ETag / Last-Modified，用于条件请求
+    - parsed/: 按响应体哈希缓存解析结果，内容未变时跳过解析
+    - 淘汰: 超过 TTL 未访问的文件删除，总大小超限时按最近访问时间 (LRU) 删除
+    """
+    
+    def __init__(self, cache_dir: str, ttl_days: float = 7, max_mb: float = 64):
+        self.http_dir = Path(cache_dir) / "http"
+        self.parsed_dir = Path(cache_dir) / "parsed"
+        self.ttl = ttl_days * 86400
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.http_dir.mkdir(parents=True, exist_ok=True)
+        self.parsed_dir.mkdir(parents=True, exist_ok=True)
+    
+    @staticmethod
+    def _write_atomic(path: Path, data: str):
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    
+    def _paths(self, url: str) -> Tuple[Path, Path]:
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.http_dir / f"{key}.json", self.http_dir / f"{key}.body"
+    
+    def _load_meta(self, url: str) -> Optional[Dict]:
+        meta_path, body_path = self._paths(url)
+        if not meta_path.exists() or not body_path.exists():
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def _read_body(self, url: str) -> Optional[str]:
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(body_path, 'r', encoding='utf-8') as f:
+                body = f.read()
+        except OSError:
+            return None
+        os.utime(meta_path)
+        os.utime(body_path)
+        return body
+    
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """构造 If-None-Match / If-Modified-Since 请求头"""
+        meta = self._load_meta(url)
+        headers = {}
+        if meta:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        return headers
+    
+    def fresh_body(self, url: str, max_age: Optional[float]) -> Optional[str]:
+        """新鲜期内直接返回缓存内容"""
+        if not max_age:
+            return None
+        meta = self._load_meta(url)
+        if meta and time.time() - meta.get('fetched_at', 0) < max_age:
+            return self._read_body(url)
+        return None
+    
+    def revalidated(self, url: str) -> Optional[str]:
+        """304 后返回缓存内容并刷新抓取时间"""
+        meta = self._load_meta(url)
+        if not meta:
+            return None
+        logger.info(f"   ♻️ Not modified: {url}")
+        meta['fetched_at'] = time.time()
+        meta_path, _ = self._paths(url)
+        self._write_atomic(meta_path, json.dumps(meta))
+        return self._read_body(url)
+    
+    def store(self, url: str, body: str, etag: Optional[str], last_modified: Optional[str]):
+        """保存响应体和校验头"""
+        meta_path, body_path = self._paths(url)
+        self._write_atomic(body_path, body)
+        self._write_atomic(meta_path, json.dumps({
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time()
+        }))
+    
+    def _parsed_path(self, content: str, source: Dict) -> Path:
+        body_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()[:32]
+        parser_key = f"{PARSER_VERSION}|{source['name']}|{source['type']}|{source.get('category', '')}"
+        parser_hash = hashlib.sha1(parser_key.encode('utf-8')).hexdigest()[:12]
+        return self.parsed_dir / f"{body_hash}-{parser_hash}.json"
+    
+    def load_entries(self, content: str, source: Dict) -> Optional[List["IPEntry"]]:
+        """读取该内容的已解析条目"""
+        path = self._parsed_path(content, source)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+            os.utime(path)
+            return [IPEntry(**r) for r in records]
+        except (OSError, ValueError, TypeError):
+            return None
+    
+    def store_entries(self, content: str, source: Dict, entries: List["IPEntry"]):
+        """保存解析结果（仅非空字段）"""
+        records = [e.to_record() for e in entries]
+        self._write_atomic(self._parsed_path(content, source), json.dumps(records, ensure_ascii=False))
+    
+    def evict(self):
+        """TTL + LRU 淘汰"""
+        now = time.time()
+        files = []
+        for directory in (self.http_dir, self.parsed_dir):
+            for path in directory.iterdir():
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    path.unlink(missing_ok=True)
+                else:
+                    files.append((st.st_mtime, st.st_size, path))
+        
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        if removed:
+            logger.info(f"   🧹 Cache evicted {removed} files")
+
+
+def fetch_url(url: str, timeout: int = 30, retries: int = 3, cache: Optional[HTTPCache] = None) -> str:
     """获取 URL 内容"""
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
+    conditional = cache.conditional_headers(url) if cache else {}
+    headers = {**HTTP_HEADERS, **conditional}
     
-    for attempt in range(retries):
+    attempt = 0
+    while attempt < retries:
         try:
             response = requests.get(url, headers=headers, timeout=timeout)
+            if response.status_code == 304 and cache:
+                body = cache.revalidated(url)
+                if body is not None:
+                    return body
+                if conditional:
+                    # 缓存正文已丢失: 去掉条件请求头立即重新获取（不计入重试次数）
+                    conditional, headers = {}, dict(HTTP_HEADERS)
+                    continue
             response.raise_for_status()
+            if cache:
+                cache.store(url, response.text, response.headers.get('ETag'), response.headers.get('Last-Modified'))
             return response.text
         except requests.RequestException as e:
             logger.warning(f"Attempt {attempt + 1}/{retries} failed: {e}")
             if attempt < retries - 1:
-                time.sleep(1)
+                time.sleep(backoff_delay(attempt))
+            attempt += 1
+    return ""
+
+
+async def fetch_url_async(
+    session: "aiohttp.ClientSession",
+    url: str,
+    timeout: float = 30,
+    retries: int = 3,
+    cache: Optional[HTTPCache] = None
+) -> str:
+    """异步获取 URL 内容（共享连接池，非阻塞退避）"""
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    headers = cache.conditional_headers(url) if cache else {}
+    
+    attempt = 0
+    while attempt < retries:
+        try:
+            async with session.get(url, headers=headers, timeout=client_timeout) as response:
+                if response.status == 304 and cache:
+                    body = cache.revalidated(url)
+                    if body is not None:
+                        return body
+                    if headers:
+                        # 缓存正文已丢失: 去掉条件请求头立即重新获取（不计入重试次数）
+                        headers = {}
+                        continue
+                response.raise_for_status()
+                raw = await response.read()
+                body = raw.decode(response.charset or 'utf-8', errors='replace')
+                if cache:
+                    cache.store(url, body, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+                return body
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Attempt {attempt + 1}/{retries} failed: {url}: {e}")
+            if attempt < retries - 1:
+                await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
     return ""
 
 
@@ -241,6 +868,474 @@ def read_local_file(filepath: Path) -> str:
         return ""
 
 
+class ProbeStore:
+    """
+    持久化探测结果（SQLite），以打包地址 key 为主键
+    - 近期验证通过的端点在 valid_ttl 内直接复用结果
+    - 连续失败 n 次的端点等待 fail_backoff * 2^(n-1)（上限 fail_max）后才重新探测
+    - 写入先缓冲，flush() / close() 时批量提交
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS probes (
+            key INTEGER PRIMARY KEY,
+            port INTEGER,
+            is_valid INTEGER NOT NULL,
+            latency_ms REAL,
+            error TEXT NOT NULL DEFAULT '',
+            fail_streak INTEGER NOT NULL DEFAULT 0,
+            last_checked REAL NOT NULL,
+            last_success REAL,
+            open_ports TEXT NOT NULL DEFAULT '',
+            handshake_ms REAL
+        )
+    """
+    COLUMNS = (
+        'key', 'port', 'is_valid', 'latency_ms', 'error', 'fail_streak', 'last_checked', 'last_success',
+        'open_ports', 'handshake_ms'
+    )
+    # 早期版本的库缺少的列
+    MIGRATIONS = {
+        'open_ports': "TEXT NOT NULL DEFAULT ''",
+        'handshake_ms': "REAL",
+    }
+    
+    def __init__(
+        self,
+        path: str,
+        valid_ttl_hours: float = 12,
+        fail_backoff_hours: float = 3,
+        fail_max_hours: float = 168
+    ):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(self.SCHEMA)
+        existing = {row[1] for row in self.db.execute("PRAGMA table_info(probes)")}
+        for column, definition in self.MIGRATIONS.items():
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE probes ADD COLUMN {column} {definition}")
+        self.valid_ttl = valid_ttl_hours * 3600
+        self.fail_backoff = fail_backoff_hours * 3600
+        self.fail_max = fail_max_hours * 3600
+        self.reused = 0
+        self._pending: List[tuple] = []
+    
+    def _row(self, key: int) -> Optional[tuple]:
+        return self.db.execute(
+            "SELECT port, is_valid, latency_ms, error, fail_streak, last_checked, last_success, "
+            "open_ports, handshake_ms FROM probes WHERE key = ?",
+            (key,)
+        ).fetchone()
+    
+    def last_latency(self, key: int) -> Optional[float]:
+        """最近一次成功探测的延迟（毫秒）"""
+        row = self.db.execute("SELECT latency_ms FROM probes WHERE key = ? AND is_valid = 1", (key,)).fetchone()
+        return row[0] if row else None
+    
+    def apply_recent(self, entry: IPEntry, now: Optional[float] = None) -> bool:
+        """结果仍然新鲜时写入条目并返回 True，否则需要重新探测"""
+        row = self._row(entry.key)
+        if row is None:
+            return False
+        port, is_valid, latency_ms, error, fail_streak, last_checked, _, open_ports, handshake_ms = row
+        age = (now or time.time()) - last_checked
+        if is_valid:
+            if age >= self.valid_ttl:
+                return False
+        elif age >= min(self.fail_backoff * 2 ** max(fail_streak - 1, 0), self.fail_max):
+            return False
+        
+        if port and not entry.port:
+            entry.port = port
+            entry.open_ports = tuple(int(p) for p in open_ports.split(',') if p)
+        entry.is_valid = bool(is_valid)
+        entry.latency_ms = latency_ms
+        entry.handshake_ms = handshake_ms
+        entry.validation_error = error
+        self.reused += 1
+        return True
+    
+    def record(self, key: int, entry: IPEntry, now: Optional[float] = None):
+        """
+        记录一次探测结果（key 为探测前的地址 key，无端口条目探测后端口会变化）
+        本机原因的失败不记录，避免端点被错误退避
+        """
+        if not entry.is_valid and is_local_failure(entry.validation_error):
+            return
+        now = now or time.time()
+        row = self._row(key)
+        if entry.is_valid:
+            fail_streak, last_success = 0, now
+        else:
+            fail_streak = (row[4] if row else 0) + 1
+            last_success = row[6] if row else None
+        self._pending.append((
+            key, entry.port, int(bool(entry.is_valid)), entry.latency_ms, entry.validation_error,
+            fail_streak, now, last_success, ','.join(map(str, entry.open_ports)), entry.handshake_ms
+        ))
+        if len(self._pending) >= 1000:
+            self.flush()
+    
+    def flush(self):
+        if not self._pending:
+            return
+        with self.db:
+            self.db.executemany(
+                f"INSERT OR REPLACE INTO probes ({', '.join(self.COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                self._pending
+            )
+        self._pending = []
+    
+    def prune(self, max_age_days: float = 30):
+        """删除长期未出现的端点"""
+        with self.db:
+            self.db.execute("DELETE FROM probes WHERE last_checked < ?", (time.time() - max_age_days * 86400,))
+    
+    def close(self):
+        self.flush()
+        self.prune()
+        self.db.close()
+
+
+class AdaptiveTimeout:
+    """
+    自适应连接超时
+    - 端点有历史延迟时按历史延迟；/24 内已有成功时按该网段最大延迟；否则按本次全局 p99
+    - 以上基准 × multiplier，限制在 [floor, ceiling]；没有任何观测时使用 ceiling
+    - /24 内连续超时且从未成功时，没有历史延迟的端点直接使用 floor，尽早放弃
+    """
+    
+    MIN_SAMPLES = 50       # 全局分布至少这么多样本后才使用
+    DEAD_SUBNET_TIMEOUTS = 3
+    
+    def __init__(
+        self,
+        floor: float = 0.3,
+        ceiling: float = 3.0,
+        multiplier: float = 3.0,
+        prior: Optional[Callable[[int], Optional[float]]] = None
+    ):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.multiplier = multiplier
+        self.prior = prior
+        # 1 ms 分桶的延迟直方图，超出上限的计入最后一桶
+        self._histogram = [0] * (int(ceiling * 1000) + 1)
+        self._samples = 0
+        self._global_ms: Optional[float] = None
+        self._subnet_max: Dict[int, float] = {}
+        self._subnet_timeouts: Dict[int, int] = {}
+        self.early_giveups = 0
+    
+    def _clamp(self, seconds: float) -> float:
+        return min(self.ceiling, max(self.floor, seconds))
+    
+    def timeout_for(self, entry: IPEntry) -> float:
+        subnet = entry.key >> 24
+        latency = self._subnet_max.get(subnet)
+        prior = self.prior(entry.key) if self.prior is not None and entry.port else None
+        if prior is not None:
+            # 端点自身的历史优先，避免同网段的超时拖累已知可用的慢端点
+            latency = max(latency or 0.0, prior)
+        elif latency is None and self._subnet_timeouts.get(subnet, 0) >= self.DEAD_SUBNET_TIMEOUTS:
+            self.early_giveups += 1
+            return self.floor
+        
+        if latency is None:
+            latency = self._global_ms
+        if latency is None:
+            return self.ceiling
+        return self._clamp(latency * self.multiplier / 1000)
+    
+    def observe(self, entry: IPEntry):
+        """记录一次探测结果"""
+        subnet = entry.key >> 24
+        if entry.is_valid and entry.latency_ms is not None:
+            latency = entry.latency_ms
+            self._subnet_max[subnet] = max(self._subnet_max.get(subnet, 0.0), latency)
+            self._histogram[min(int(latency), len(self._histogram) - 1)] += 1
+            self._samples += 1
+            if self._samples >= self.MIN_SAMPLES and self._samples % 25 == 0:
+                self._global_ms = self.percentile(99)
+        elif entry.validation_error == "Timeout":
+            self._subnet_timeouts[subnet] = self._subnet_timeouts.get(subnet, 0) + 1
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """本次成功延迟的 q 分位（毫秒）"""
+        if not self._samples:
+            return None
+        target = self._samples * q / 100
+        total = 0
+        for ms, count in enumerate(self._histogram):
+            total += count
+            if total >= target:
+                return float(ms + 1)
+        return float(len(self._histogram))
+
+
+def raise_fd_limit() -> Optional[int]:
+    """把 RLIMIT_NOFILE 软上限提到硬上限（最多 65536），返回当前软上限；不支持时返回 None"""
+    if resource is None:
+        return None
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+    if soft != resource.RLIM_INFINITY and soft < target:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+            soft = target
+        except (ValueError, OSError):
+            pass
+    return None if soft == resource.RLIM_INFINITY else soft
+
+
+# 本机资源耗尽类错误（并非目标不可达），出现时应降低并发并重试该条目
+LOCAL_RESOURCE_ERRORS = tuple(
+    f"[Errno {code}]" for code in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.EADDRNOTAVAIL)
+)
+
+
+# 工作进程意外退出时在途条目的错误
+WORKER_DIED = "Worker died"
+
+
+def is_local_resource_error(error: str) -> bool:
+    return error.startswith(LOCAL_RESOURCE_ERRORS)
+
+
+def is_local_failure(error: str) -> bool:
+    """本机原因导致的失败（资源耗尽、工作进程退出），不代表端点不可用"""
+    return error == WORKER_DIED or is_local_resource_error(error)
+
+
+class AIMDConcurrency:
+    """
+    AIMD 并发控制（可调上限的信号量）
+    - 每完成约 limit 个探测为一个窗口；窗口内健康则上限 + increase
+    - 出现本机资源错误（EMFILE / ENOBUFS 等）立即 × decrease
+    - 窗口超时率明显高于历史基线（EWMA）时 × decrease
+    """
+    
+    def __init__(
+        self,
+        initial: int,
+        minimum: int = 10,
+        maximum: int = 4096,
+        increase: int = 10,
+        decrease: float = 0.5
+    ):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.peak = self.limit
+        self.backoffs = 0
+        self._inflight = 0
+        self._waiters: collections.deque = collections.deque()
+        self._done = 0
+        self._timeouts = 0
+        self._timeout_baseline: Optional[float] = None
+    
+    async def acquire(self):
+        while self._inflight >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self._inflight += 1
+    
+    def release(self, error: str = ""):
+        self._inflight -= 1
+        if is_local_resource_error(error):
+            self._backoff(f"local resource error {error}")
+        else:
+            self._done += 1
+            self._timeouts += error in ("Timeout", "Handshake timeout")
+            if self._done >= max(20, int(self.limit)):
+                self._end_window()
+        self._wake()
+    
+    def _end_window(self):
+        rate = self._timeouts / self._done
+        baseline = self._timeout_baseline
+        self._done = self._timeouts = 0
+        if baseline is not None and rate > baseline * 1.5 + 0.05:
+            self._backoff(f"timeout rate {rate:.0%} vs baseline {baseline:.0%}")
+        else:
+            self.limit = min(self.maximum, self.limit + self.increase)
+            self.peak = max(self.peak, self.limit)
+        # 基线只缓慢跟随，突增窗口不会立刻抬高基线
+        self._timeout_baseline = rate if baseline is None else baseline * 0.7 + min(rate, baseline * 1.5 + 0.05) * 0.3
+    
+    def _backoff(self, reason: str):
+        new_limit = max(self.minimum, self.limit * self.decrease)
+        if int(new_limit) < int(self.limit):
+            logger.debug(f"   Concurrency {self.limit:.0f} → {new_limit:.0f} ({reason})")
+            self.backoffs += 1
+        self.limit = new_limit
+        self._done = self._timeouts = 0
+    
+    def _wake(self):
+        free = int(self.limit) - self._inflight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+
+class TokenBucket:
+    """令牌桶限速（预约式: 令牌可透支，透支者按顺序等待）"""
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate / 10)
+        self._tokens = self.burst
+        self._last = time.monotonic()
+    
+    async def acquire(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class FairScheduler:
+    """
+    验证队列（接口同 asyncio.Queue，task_done 需传入条目）
+    - 按 /24 分桶，各桶轮询出队，打散同网段的连续地址
+    - 每个 /24、每个运营商的在途条目数不超过上限；均已满时等待其他条目完成，
+      名额释放后可出队的条目直接交给等待者（一次释放可能放开多个网段）
+    - rate > 0 时 throttle() 按令牌桶限制全局每秒探测数（即新建连接速率）
+    """
+    
+    def __init__(self, subnet_cap: int = 8, provider_cap: int = 32, rate: float = 0):
+        self.subnet_cap = subnet_cap
+        self.provider_cap = provider_cap
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        self._buckets: Dict[int, collections.deque] = {}
+        self._rotation: collections.deque = collections.deque()
+        self._subnet_inflight: Dict[int, int] = {}
+        self._provider_inflight: Dict[Any, int] = {}
+        self._inflight: Dict[int, Tuple[int, Any]] = {}   # id(条目) → (网段, 运营商)
+        self._pending = 0
+        self._unfinished = 0
+        self._waiters: collections.deque = collections.deque()
+        self._finished = asyncio.Event()
+        self._finished.set()
+    
+    @staticmethod
+    def _provider(entry: IPEntry):
+        return entry.isp or (entry.key >> 32)
+    
+    def qsize(self) -> int:
+        return self._pending
+    
+    def _dispatch(self):
+        """
+        把可出队的条目直接交给等待者，直到没有等待者或没有可出队的条目
+        （一次释放可能同时放开多个网段：运营商名额满时被挡住的各网段）
+        """
+        while self._waiters:
+            waiter = self._waiters[0]
+            if waiter.done():    # 等待者已取消
+                self._waiters.popleft()
+                continue
+            entry = self._take()
+            if entry is None:
+                return
+            self._waiters.popleft()
+            waiter.set_result(entry)
+    
+    def put_nowait(self, entry: IPEntry):
+        subnet = entry.key >> 24
+        bucket = self._buckets.get(subnet)
+        if bucket is None:
+            bucket = self._buckets[subnet] = collections.deque()
+            self._rotation.append(subnet)
+        bucket.append(entry)
+        self._pending += 1
+        self._unfinished += 1
+        self._finished.clear()
+        self._dispatch()
+    
+    def _take(self) -> Optional[IPEntry]:
+        """按轮询顺序取第一个未达上限的网段的条目"""
+        for _ in range(len(self._rotation)):
+            subnet = self._rotation[0]
+            self._rotation.rotate(-1)
+            if self._subnet_inflight.get(subnet, 0) >= self.subnet_cap:
+                continue
+            bucket = self._buckets[subnet]
+            provider = self._provider(bucket[0])
+            if self._provider_inflight.get(provider, 0) >= self.provider_cap:
+                continue
+            
+            entry = bucket.popleft()
+            if not bucket:
+                del self._buckets[subnet]
+                self._rotation.pop()  # 刚轮转到队尾
+            self._pending -= 1
+            self._subnet_inflight[subnet] = self._subnet_inflight.get(subnet, 0) + 1
+            self._provider_inflight[provider] = self._provider_inflight.get(provider, 0) + 1
+            self._inflight[id(entry)] = (subnet, provider)
+            return entry
+        return None
+    
+    async def get(self) -> IPEntry:
+        entry = self._take()
+        if entry is None:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                entry = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # 条目已交付但等待者随即被取消: 放回队首
+                    self._untake(waiter.result())
+                raise
+        return entry
+    
+    def _untake(self, entry: IPEntry):
+        subnet, _ = self._release(entry)
+        bucket = self._buckets.get(subnet)
+        if bucket is None:
+            bucket = self._buckets[subnet] = collections.deque()
+            self._rotation.appendleft(subnet)
+        bucket.appendleft(entry)
+        self._pending += 1
+        self._dispatch()
+    
+    async def throttle(self):
+        """实际发起探测前调用，受全局连接速率限制"""
+        if self.bucket is not None:
+            await self.bucket.acquire()
+    
+    def _release(self, entry: IPEntry) -> Tuple[int, Any]:
+        """释放条目出队时占用的网段及运营商名额"""
+        subnet, provider = self._inflight.pop(id(entry))
+        for counts, key in ((self._subnet_inflight, subnet), (self._provider_inflight, provider)):
+            remaining = counts.get(key, 0) - 1
+            if remaining > 0:
+                counts[key] = remaining
+            else:
+                counts.pop(key, None)
+        return subnet, provider
+    
+    def task_done(self, entry: IPEntry):
+        """条目处理完成，释放其名额并把因此可出队的条目交给等待者"""
+        self._release(entry)
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._finished.set()
+        self._dispatch()
+    
+    async def join(self):
+        await self._finished.wait()
+
+
 async def async_tcp_ping(ip: str, port: int, timeout: float = 3.0) -> Tuple[bool, Optional[float], str]:
     """异步 TCP 测试"""
     try:
@@ -263,6 +1358,284 @@ async def async_tcp_ping(ip: str, port: int, timeout: float = 3.0) -> Tuple[bool
         return False, None, str(e)[:20]
 
 
+_LINGER_RST = struct.pack('ii', 1, 0)
+
+
+def _resolve_waiter(waiter: asyncio.Future, timed_out: bool):
+    if not waiter.done():
+        waiter.set_result(timed_out)
+
+
+def _connect_error(err: int) -> str:
+    if err == errno.ECONNREFUSED:
+        return "Refused"
+    return str(OSError(err, os.strerror(err)))[:20]
+
+
+async def raw_tcp_ping(ip: str, port: int, timeout: float = 3.0) -> Tuple[bool, Optional[float], str]:
+    """
+    非阻塞 socket TCP 测试
+    - connect_ex + 事件循环写就绪回调，每次探测只分配一个 future 和一个定时器
+    - perf_counter 单调高精度计时
+    - SO_LINGER 0 关闭（发送 RST），不留 TIME_WAIT
+    """
+    loop = asyncio.get_running_loop()
+    sock = None
+    try:
+        # 创建 socket 也可能因 EMFILE / ENFILE 失败，需作为错误串返回供资源错误重试识别
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _LINGER_RST)
+        start = time.perf_counter()
+        err = sock.connect_ex((ip, port))
+        if err == errno.EINPROGRESS:
+            fd = sock.fileno()
+            waiter = loop.create_future()
+            loop.add_writer(fd, _resolve_waiter, waiter, False)
+            timer = loop.call_later(timeout, _resolve_waiter, waiter, True)
+            try:
+                timed_out = await waiter
+            finally:
+                loop.remove_writer(fd)
+                timer.cancel()
+            if timed_out:
+                return False, None, "Timeout"
+            err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            return False, None, _connect_error(err)
+        return True, round((time.perf_counter() - start) * 1000, 2), ""
+    except OSError as e:
+        return False, None, str(e)[:20]
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+# 可选探测引擎（PROBE_ENGINE）
+PROBERS = {
+    'streams': async_tcp_ping,
+    'raw': raw_tcp_ping,
+}
+
+
+def _split_target(target: str) -> Tuple[str, int]:
+    host, _, port = target.rpartition(':')
+    return host, int(port)
+
+
+def _socks5_address(host: str) -> bytes:
+    """SOCKS5 目标地址: IPv4 / IPv6 字面量用 ATYP 0x01 / 0x04，主机名用 ATYP 0x03（长度前缀的域名）"""
+    for family, atyp in ((socket.AF_INET, b'\x01'), (socket.AF_INET6, b'\x04')):
+        try:
+            return atyp + socket.inet_pton(family, host.strip('[]'))
+        except OSError:
+            pass
+    name = host.encode('idna')
+    if not 0 < len(name) < 256:
+        raise ValueError(f"SOCKS5 target host too long: {host[:20]}")
+    return b'\x03' + bytes([len(name)]) + name
+
+
+async def socks5_handshake(reader, writer, entry: IPEntry) -> str:
+    """SOCKS5 问候 → 用户名密码认证（有凭据时）→ CONNECT 测试目标；成功返回空串"""
+    username, _, password = entry.proxy_auth.partition(':')
+    user, pwd = username.encode(), password.encode()
+    # RFC 1929 的用户名、密码各不超过 255 字节，超长的凭据无法发送，按无凭据问候
+    auth = bool(entry.proxy_auth) and len(user) < 256 and len(pwd) < 256
+    writer.write(b'\x05\x02\x00\x02' if auth else b'\x05\x01\x00')
+    version, method = await reader.readexactly(2)
+    if version != 5:
+        return "Not SOCKS5"
+    if method == 0x02 and auth:
+        writer.write(b'\x01' + bytes([len(user)]) + user + bytes([len(pwd)]) + pwd)
+        _, status = await reader.readexactly(2)
+        if status != 0:
+            return "Auth failed"
+    elif method != 0x00:
+        return "No auth method"
+    
+    host, port = _split_target(PROTOCOL_CHECK_TARGET)
+    writer.write(b'\x05\x01\x00' + _socks5_address(host) + port.to_bytes(2, 'big'))
+    _, reply, _, atyp = await reader.readexactly(4)
+    if reply != 0:
+        return f"Relay failed ({reply})"
+    # 读完绑定地址
+    if atyp == 0x01:
+        await reader.readexactly(4 + 2)
+    elif atyp == 0x04:
+        await reader.readexactly(16 + 2)
+    elif atyp == 0x03:
+        await reader.readexactly((await reader.readexactly(1))[0] + 2)
+    return ""
+
+
+async def http_connect_handshake(reader, writer, entry: IPEntry) -> str:
+    """HTTP CONNECT 测试目标，2xx 视为成功"""
+    lines = [f"CONNECT {PROTOCOL_CHECK_TARGET} HTTP/1.1", f"Host: {PROTOCOL_CHECK_TARGET}"]
+    if entry.proxy_auth:
+        lines.append(f"Proxy-Authorization: Basic {base64.b64encode(entry.proxy_auth.encode()).decode()}")
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+    status_line = await reader.readline()
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        return "Not HTTP proxy"
+    if not parts[1].startswith(b'2'):
+        return f"HTTP {parts[1].decode(errors='replace')[:3]}"
+    return ""
+
+
+def _tls_client_hello() -> bytes:
+    """用内存 BIO 生成一个真实的 ClientHello"""
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+    tls = context.wrap_bio(incoming, outgoing, server_hostname=TLS_CHECK_SNI)
+    try:
+        tls.do_handshake()
+    except ssl.SSLWantReadError:
+        pass
+    return outgoing.read()
+
+
+async def tls_hello_handshake(reader, writer, entry: IPEntry) -> str:
+    """发送 ClientHello，收到 ServerHello 即成功（不完成完整握手）"""
+    writer.write(_tls_client_hello())
+    content_type, _, _, _, _, handshake_type = await reader.readexactly(6)
+    if content_type == 0x15:
+        return "TLS alert"
+    if content_type != 0x16 or handshake_type != 0x02:
+        return "Not TLS"
+    return ""
+
+
+# 协议握手（entry.protocol 优先，其次按分类）
+PROTOCOL_HANDSHAKES = {
+    'socks5': socks5_handshake,
+    'http': http_connect_handshake,
+    'tls': tls_hello_handshake,
+}
+# 未标注协议的条目按分类推断；CATEGORY_PROTOCOL_PORTS 中的分类只在所列端口上推断
+# （Cloudflare 80 / 8080 / 2052 / 2082 / 2086 / 2095 / 8880 为明文 HTTP 端口，只做 TCP 检测）
+CATEGORY_PROTOCOLS = {
+    'socks5': 'socks5',
+    'cloudflare': 'tls',
+}
+CLOUDFLARE_TLS_PORTS = frozenset((443, 2053, 2083, 2087, 2096, 8443))
+CATEGORY_PROTOCOL_PORTS = {
+    'cloudflare': CLOUDFLARE_TLS_PORTS,
+}
+
+
+def probe_protocol(entry: IPEntry) -> str:
+    """
+    探测所用握手协议，空串表示只做 TCP 连接
+    条目已标注协议时以标注为准，没有握手实现的协议（如 socks4）不再按分类推断
+    """
+    if entry.protocol:
+        return entry.protocol if entry.protocol in PROTOCOL_HANDSHAKES else ''
+    ports = CATEGORY_PROTOCOL_PORTS.get(entry.category)
+    if ports is not None and entry.port not in ports:
+        return ''
+    return CATEGORY_PROTOCOLS.get(entry.category, '')
+
+
+async def protocol_ping(
+    entry: IPEntry,
+    protocol: str,
+    timeout: float = 3.0
+) -> Tuple[bool, Optional[float], Optional[float], str]:
+    """
+    协议级测试: 连接后完成协议握手
+    返回 (成功, TCP 连接耗时, 握手耗时, 错误)，连接与握手各自使用 timeout
+    """
+    connect_ms = None
+    try:
+        start = time.perf_counter()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(entry.ip, entry.port), timeout=timeout)
+        connected = time.perf_counter()
+        connect_ms = round((connected - start) * 1000, 2)
+        try:
+            error = await asyncio.wait_for(PROTOCOL_HANDSHAKES[protocol](reader, writer, entry), timeout=timeout)
+            handshake_ms = round((time.perf_counter() - connected) * 1000, 2)
+        finally:
+            writer.close()
+        if error:
+            return False, connect_ms, None, error
+        return True, connect_ms, handshake_ms, ""
+    except asyncio.TimeoutError:
+        return False, connect_ms, None, "Timeout" if connect_ms is None else "Handshake timeout"
+    except asyncio.IncompleteReadError:
+        return False, connect_ms, None, "Closed"
+    except ConnectionRefusedError:
+        return False, connect_ms, None, "Refused"
+    except ConnectionResetError:
+        return False, connect_ms, None, "Reset"
+    except Exception as e:
+        return False, connect_ms, None, str(e)[:20]
+
+
+async def discover_ports(
+    ip: str,
+    ports: List[int],
+    timeout: float = 3.0,
+    collect_all: bool = False
+) -> Tuple[List[Tuple[int, float]], str]:
+    """
+    并行连接全部候选端口
+    - 默认首个成功即取消其余；collect_all 时等待全部完成
+    返回 ([(端口, 延迟)] 按完成顺序, 最后一个失败原因)
+    """
+    tcp_ping = PROBERS[PROBE_ENGINE]
+    tasks = {asyncio.create_task(tcp_ping(ip, port, timeout)): port for port in ports}
+    pending = set(tasks)
+    found: List[Tuple[int, float]] = []
+    error = "No port"
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                success, latency, task_error = task.result()
+                if success:
+                    found.append((tasks[task], latency))
+                else:
+                    error = task_error
+            if found and not collect_all:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    return found, error
+
+
+async def validate_entry(entry: IPEntry, timeout: float = 3.0) -> None:
+    """验证单个条目（原地修改）"""
+    protocol = probe_protocol(entry) if PROTOCOL_CHECK else ''
+    if entry.port and protocol:
+        success, latency, entry.handshake_ms, error = await protocol_ping(entry, protocol, timeout)
+    elif entry.port:
+        success, latency, error = await PROBERS[PROBE_ENGINE](entry.ip, entry.port, timeout)
+    else:
+        # 无端口时并行探测候选端口，最快成功的作为条目端口
+        ports = DISCOVERY_PORTS.get(entry.category) or DISCOVERY_PORTS["default"]
+        found, error = await discover_ports(entry.ip, ports, timeout, DISCOVERY_MODE == 'all')
+        success, latency = bool(found), None
+        if found:
+            entry.port, latency = found[0]
+            entry.open_ports = tuple(sorted(port for port, _ in found))
+            error = ""
+            # 协议按发现的端口确定
+            protocol = probe_protocol(entry) if PROTOCOL_CHECK else ''
+            if protocol:
+                success, latency, entry.handshake_ms, error = await protocol_ping(entry, protocol, timeout)
+    
+    entry.is_valid = success
+    entry.latency_ms = latency
+    entry.validation_error = error
+
+
 async def validate_entries_async(
     entries: List[IPEntry],
     timeout: float = 3.0,
@@ -277,20 +1650,7 @@ async def validate_entries_async(
     async def validate_one(entry: IPEntry):
         nonlocal completed
         async with semaphore:
-            if entry.port:
-                success, latency, error = await async_tcp_ping(entry.ip, entry.port, timeout)
-            else:
-                # 无端口时测试常用端口
-                success, latency, error = False, None, "No port"
-                for test_port in [443, 80, 8080, 1080]:
-                    success, latency, error = await async_tcp_ping(entry.ip, test_port, timeout / 4)
-                    if success:
-                        entry.port = test_port  # 记录有效端口
-                        break
-            
-            entry.is_valid = success
-            entry.latency_ms = latency
-            entry.validation_error = error
+            await validate_entry(entry, timeout)
             
             completed += 1
             if completed % 100 == 0 or completed == total:
@@ -302,14 +1662,188 @@ async def validate_entries_async(
     await asyncio.gather(*tasks, return_exceptions=True)
 
 
-# ============================================================
-# 解析器
-# ============================================================
-
-def is_valid_ip(ip: str) -> bool:
-    """验证 IPv4"""
-    try:
-        parts = ip.split('.')
+async def _shard_main(shard: int, in_q, out_q, concurrency: int):
+    """
+    分片工作进程的事件循环
+    接收 (seq, ip_int, port, category, protocol, proxy_auth, timeout) 批次，批量回传 (seq, *RESULT_FIELDS)
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    results: List[tuple] = []
+    tasks: Set[asyncio.Task] = set()
+    
+    def flush():
+        if results:
+            out_q.put(results[:])
+            results.clear()
+    
+    async def probe(seq, ip_int, port, category, protocol, proxy_auth, timeout):
+        async with semaphore:
+            entry = IPEntry(ip_int, port, category=category, protocol=protocol, proxy_auth=proxy_auth)
+            try:
+                await validate_entry(entry, timeout)
+            except Exception as e:
+                entry.is_valid, entry.validation_error = False, str(e)[:20]
+        results.append((seq,) + tuple(getattr(entry, name) for name in ShardedValidator.RESULT_FIELDS))
+        if len(results) >= 64:
+            flush()
+    
+    async def flusher():
+        while True:
+            await asyncio.sleep(0.05)
+            flush()
+    
+    flush_task = asyncio.create_task(flusher())
+    while True:
+        batch = await loop.run_in_executor(None, in_q.get)
+        if batch is None:
+            break
+        for item in batch:
+            task = asyncio.create_task(probe(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    
+    if tasks:
+        await asyncio.gather(*tasks)
+    flush_task.cancel()
+    flush()
+    out_q.put(shard)  # 结束标记
+
+
+def _shard_worker(shard: int, in_q, out_q, concurrency: int):
+    """分片工作进程入口"""
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(_shard_main(shard, in_q, out_q, concurrency))
+
+
+class ShardedValidator:
+    """
+    多进程分片验证
+    - 启动 workers 个进程，各自运行事件循环，平分并发预算
+    - submit() 按轮询分配条目，同一轮事件循环内提交的条目合并为一批发送
+    - results() 异步迭代返回 (条目, 探测前 key)，结果已写回条目字段
+    - 父进程在途条目数上限为 2 × concurrency，超出时 submit() 等待
+    - 工作进程意外退出时，其在途条目以 WORKER_DIED 失败返回，之后只向存活的进程分配；
+      全部退出后 submit() 直接抛出 RuntimeError
+    """
+    
+    # 工作进程回传、写回条目的验证结果字段
+    RESULT_FIELDS = ('port', 'is_valid', 'latency_ms', 'validation_error', 'open_ports', 'handshake_ms')
+    
+    def __init__(self, workers: int, concurrency: int):
+        self.workers = workers
+        self.live: List[int] = list(range(workers))   # 存活且未结束的分片，submit() 在其中轮询
+        self.share = max(1, -(-concurrency // workers))
+        self._credit = asyncio.Semaphore(concurrency * 2)
+        ctx = multiprocessing.get_context('spawn')
+        self._in_queues = [ctx.Queue() for _ in range(workers)]
+        self._out_q = ctx.Queue()
+        self._processes = [
+            ctx.Process(target=_shard_worker, args=(shard, q, self._out_q, self.share), daemon=True)
+            for shard, q in enumerate(self._in_queues)
+        ]
+        self._inflight: Dict[int, Tuple[IPEntry, int, int]] = {}
+        self._buffers: List[List[tuple]] = [[] for _ in range(workers)]
+        self._flush_scheduled = False
+        self._seq = 0
+        self._closed = False
+        self._last_check = 0.0
+    
+    def start(self):
+        for process in self._processes:
+            process.start()
+    
+    def _flush(self):
+        self._flush_scheduled = False
+        for shard, buffer in enumerate(self._buffers):
+            if buffer:
+                self._in_queues[shard].put(buffer)
+                self._buffers[shard] = []
+    
+    async def submit(self, entry: IPEntry, timeout: float):
+        if not self.live:
+            raise RuntimeError("No live validation workers")
+        await self._credit.acquire()
+        if not self.live:
+            self._credit.release()
+            raise RuntimeError("No live validation workers")
+        seq = self._seq
+        self._seq += 1
+        shard = self.live[seq % len(self.live)]
+        self._inflight[seq] = (entry, entry.key, shard)
+        self._buffers[shard].append(
+            (seq, entry.ip_int, entry.port, entry.category, entry.protocol, entry.proxy_auth, timeout)
+        )
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self._flush)
+    
+    def close(self):
+        """不再提交；工作进程处理完已提交条目后退出"""
+        self._flush()
+        self._closed = True
+        for q in self._in_queues:
+            q.put(None)
+    
+    def _fail_shard(self, shard: int) -> List[Tuple[IPEntry, int]]:
+        failed = []
+        for seq, (entry, key, entry_shard) in list(self._inflight.items()):
+            if entry_shard == shard:
+                del self._inflight[seq]
+                entry.is_valid, entry.latency_ms, entry.validation_error = False, None, WORKER_DIED
+                self._credit.release()
+                failed.append((entry, key))
+        return failed
+    
+    def _get_batch(self):
+        try:
+            return self._out_q.get(timeout=1)
+        except queue_module.Empty:
+            return queue_module.Empty
+    
+    def _dead_shards(self) -> List[int]:
+        """已退出但未发送结束标记的分片（从 live 中移除）"""
+        self._last_check = time.monotonic()
+        dead = [shard for shard in self.live if not self._processes[shard].is_alive()]
+        for shard in dead:
+            logger.error(f"   ❌ Validation worker {shard} exited unexpectedly")
+            self.live.remove(shard)
+        return dead
+    
+    async def results(self):
+        loop = asyncio.get_running_loop()
+        while self.live:
+            batch = await loop.run_in_executor(None, self._get_batch)
+            # 其他分片持续回传结果时也定期检查，避免死亡分片的条目无人处理
+            if batch is queue_module.Empty or time.monotonic() - self._last_check >= 1:
+                for shard in self._dead_shards():
+                    for item in self._fail_shard(shard):
+                        yield item
+            if batch is queue_module.Empty:
+                continue
+            if isinstance(batch, int):
+                if batch in self.live:
+                    self.live.remove(batch)
+                continue
+            for seq, *values in batch:
+                entry, key, _ = self._inflight.pop(seq)
+                for name, value in zip(self.RESULT_FIELDS, values):
+                    setattr(entry, name, value)
+                self._credit.release()
+                yield entry, key
+        
+        for process in self._processes:
+            process.join(timeout=5)
+
+
+# ============================================================
+# 解析器
+# ============================================================
+
+def is_valid_ip(ip: str) -> bool:
+    """验证 IPv4"""
+    try:
+        parts = ip.split('.')
         if len(parts) != 4:
             return False
         for part in parts:
@@ -415,11 +1949,174 @@ def parse_simple_line(line: str, source_name: str, category: str, region_hint: s
     return results
 
 
-def parse_text_content(content: str, source_name: str, category: str, region_hint: str = "") -> List[IPEntry]:
-    """解析纯文本内容"""
-    entries = []
-    for line in content.split('\n'):
-        entries.extend(parse_simple_line(line, source_name, category, region_hint))
+# str.strip() 会去掉的 ASCII 空白
+_STRIP_BYTES = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+
+def _scan_fallback(data: bytes, start: int, end: int, source_name: str, category: str, region_hint: str) -> List[IPEntry]:
+    """单趟扫描无法确定时，对该行使用逐行解析"""
+    line = data[start:end].decode('utf-8', 'surrogatepass')
+    return parse_simple_line(line, source_name, category, region_hint)
+
+
+def scan_text_content(data: bytes, source_name: str, category: str, region_hint: str = "") -> List[IPEntry]:
+    """
+    单趟扫描整块 bytes 内容，结果与逐行 parse_simple_line 完全一致
+    - 整块内容只跑一次 CONTENT_SCAN_PATTERN，空行和不含 IP 的行没有 Python 层开销
+    - 只对有命中的行做注释判断和 代理 URL > IP:PORT > 纯 IP 的优先级处理
+    - 少见的歧义情况（命中旁有非 ASCII 字符、IP 后接 .数字、IP:PORT 全部无效等）该行回退到 parse_simple_line
+    - 命中直接由 bytes 打包为 key，经 IPEntry.from_key 构造（整段内容共用一个 shared_info 元组）
+    """
+    data += b'\n\n'    # 哨兵，省去越界判断
+    entries: List[IPEntry] = []
+    append = entries.append
+    find, rfind = data.find, data.rfind
+    has_url = b'://' in data
+    line_start = line_end = -1
+    line_done = False    # 当前行已处理完（注释 / 代理 URL / 回退）
+    pending = False      # 当前行需要在行尾收尾（有纯 IP 或无效的 IP:PORT）
+    has_loose = False
+    mark = 0             # 当前行在 entries 中的起始位置
+    pure: List[IPEntry] = []
+    args = (source_name, category, region_hint)
+    
+    from_key = IPEntry.from_key
+    info = IPEntry.shared_info(source_name, category, region_hint)
+    inet_pton, from_bytes, AF_INET = socket.inet_pton, int.from_bytes, socket.AF_INET
+    ip_keys: Dict[bytes, int] = {}    # 命中的 IP bytes → ip_int << 16，列表中同一 IP 常带多个端口
+    
+    def key_of(ip: bytes, port: int) -> int:
+        base = ip_keys.get(ip)
+        if base is None:
+            try:
+                base = from_bytes(inet_pton(AF_INET, ip.decode()), 'big') << 16
+            except OSError:
+                base = pack_ipv4(ip.decode()) << 16   # 带前导零的写法
+            ip_keys[ip] = base
+        return base | port
+    
+    for m in CONTENT_SCAN_PATTERN.finditer(data):
+        start, end = m.span()
+        
+        if start < line_end:
+            if line_done:
+                continue
+        else:
+            # 进入新行，先收尾上一行
+            if pending:
+                if not has_loose:
+                    entries.extend(pure)
+                elif len(entries) == mark:
+                    # IP:PORT 全部无效时原逻辑会对整行重新找纯 IP
+                    entries.extend(_scan_fallback(data, line_start, line_end, *args))
+            line_end = find(b'\n', start)
+            mark = len(entries)
+            if pure:
+                pure = []
+            line_done = pending = has_loose = False
+            
+            if start and data[start - 1] != 0x0a:
+                line_start = rfind(b'\n', 0, start) + 1
+                prefix = data[line_start:start].lstrip(_STRIP_BYTES)
+                if prefix[:1] == b'#':
+                    line_done = True
+                    continue
+                if prefix[:1] >= b'\x80' and b'#' in prefix:
+                    entries.extend(_scan_fallback(data, line_start, line_end, *args))
+                    line_done = True
+                    continue
+            else:
+                line_start = start
+            
+            if has_url:
+                line = data[line_start:line_end]
+                if b'://' in line:
+                    line_done = True
+                    if SCAN_AMBIGUOUS_PATTERN.search(line):
+                        entries.extend(_scan_fallback(data, line_start, line_end, *args))
+                        continue
+                    url_match = PROXY_URL_BYTES_PATTERN.search(line)
+                    if url_match:
+                        # 代理 URL 优先，每行只取第一个
+                        ip, port_str = url_match.groups()
+                        port = int(port_str)
+                        if ip[:2] != b'0.' and ip != b'255.255.255.255' and 1 <= port <= 65535:
+                            append(from_key(key_of(ip, port), info))
+                        continue
+                    line_done = False
+        
+        if data[end] >= 0x80 or (start > line_start and data[start - 1] >= 0x80):
+            del entries[mark:]
+            entries.extend(_scan_fallback(data, line_start, line_end, *args))
+            line_done = True
+            pending = False
+            continue
+        
+        ip, port_str = m.groups()
+        valid_ip = (ip[0] != 0x30 or ip[1] != 0x2e) and ip != b'255.255.255.255'
+        if port_str is not None:
+            has_loose = True
+            port = int(port_str)
+            if valid_ip and 1 <= port <= 65535:
+                base = ip_keys.get(ip)
+                append(from_key((base if base is not None else key_of(ip, 0)) | port, info))
+            else:
+                pending = True
+            continue
+        
+        c0, c1 = data[end], data[end + 1]
+        # 1.2.3.4.5:80 这类 IP 链，或 IP: 后接非 ASCII 数字
+        if (c0 == 0x2e and 0x30 <= c1 <= 0x39) or (c1 >= 0x80 and c0 in (0x3a, 0x23)):
+            del entries[mark:]
+            entries.extend(_scan_fallback(data, line_start, line_end, *args))
+            line_done = True
+            pending = False
+            continue
+        if valid_ip:
+            pure.append(from_key(key_of(ip, 0), info))
+            pending = True
+    
+    if pending:
+        if not has_loose:
+            entries.extend(pure)
+        elif len(entries) == mark:
+            entries.extend(_scan_fallback(data, line_start, line_end, *args))
+    return entries
+
+
+def parse_text_content(content, source_name: str, category: str, region_hint: str = "") -> List[IPEntry]:
+    """解析纯文本内容（str 或 bytes）"""
+    if isinstance(content, str):
+        content = content.encode('utf-8', 'surrogatepass')
+    return scan_text_content(content, source_name, category, region_hint)
+
+
+_SCHEME_PROTOCOLS = {'socks': 'socks5', 'socks5': 'socks5', 'socks4': 'socks4', 'http': 'http', 'https': 'http'}
+
+
+def annotate_proxy_protocols(content: str, entries: List[IPEntry]) -> List[IPEntry]:
+    """
+    从代理 URL 或扫描结果行补充协议及认证信息（原地修改）
+    扫描结果行带账号密码但未写协议时按 SOCKS5 处理
+    """
+    if '://' not in content and '|' not in content:
+        return entries
+    
+    found: Dict[int, Tuple[str, str]] = {}
+    for scheme, auth, ip, port in PROXY_SCHEME_URL_PATTERN.findall(content):
+        if is_valid_ip(ip) and is_valid_port(port):
+            found.setdefault((pack_ipv4(ip) << 16) | int(port), (_SCHEME_PROTOCOLS[scheme.lower()], auth))
+    for ip, port, scheme, auth in PROXY_RESULT_LINE_PATTERN.findall(content):
+        auth = auth if ':' in auth and auth != ':' else ''
+        protocol = _SCHEME_PROTOCOLS.get(scheme.lower(), '') if scheme else ('socks5' if auth else '')
+        if protocol and is_valid_ip(ip) and is_valid_port(port):
+            found.setdefault((pack_ipv4(ip) << 16) | int(port), (protocol, auth))
+    
+    if found:
+        for entry in entries:
+            hit = found.get(entry.key)
+            if hit and not entry.protocol:
+                entry.protocol, entry.proxy_auth = hit
     return entries
 
 
@@ -433,8 +2130,126 @@ def parse_socks5_rich_content(content: str, source_name: str) -> List[IPEntry]:
     return entries
 
 
+class HTMLAddressExtractor(HTMLParser):
+    """
+    单趟流式 HTML 地址提取
+    - 每个文本节点按行解析一次（对应 get_text('\\n') 路径）
+    - 单元格 / span / div 等元素内被内联标签切开的文本（如 <td><span>IP</span>:<b>PORT</b></td>）
+      去空白后拼接再整体解析一次（对应 get_text(strip=True) 路径）；块级标签作为分隔
+    - 每个地址只输出一次；只保留当前文本节点和当前内联片段，内存与页面大小无关
+    """
+    
+    SKIP_TAGS = {'script', 'style'}
+    GROUP_TAGS = {'td', 'th', 'span', 'div', 'p', 'li', 'code', 'pre'}
+    INLINE_TAGS = {
+        'a', 'abbr', 'b', 'bdi', 'bdo', 'cite', 'code', 'data', 'dfn', 'em', 'font', 'i', 'kbd',
+        'label', 'mark', 'q', 's', 'samp', 'small', 'span', 'strong', 'sub', 'sup', 'time', 'u', 'var'
+    }
+    MAX_TEXT = 1 << 20     # 超大文本节点按整行分批解析
+    MAX_RUN = 4096         # 内联拼接片段上限
+    
+    def __init__(self, source_name: str, category: str):
+        super().__init__(convert_charrefs=True)
+        self.source_name = source_name
+        self.category = category
+        self.entries: List[IPEntry] = []
+        self._seen: Set[int] = set()    # 已输出地址的打包 key
+        self._text: List[str] = []
+        self._text_len = 0
+        self._run: List[str] = []
+        self._run_len = 0
+        self._group_depth = 0
+        self._skip_depth = 0
+    
+    def _emit(self, entries: List[IPEntry]):
+        for entry in entries:
+            key = entry.key
+            if key not in self._seen:
+                self._seen.add(key)
+                self.entries.append(entry)
+    
+    def _flush_text(self):
+        if not self._text:
+            return
+        text = ''.join(self._text)
+        self._text = []
+        self._text_len = 0
+        self._emit(parse_text_content(text, self.source_name, self.category))
+        
+        stripped = text.strip()
+        if stripped and self._group_depth:
+            self._run.append(stripped)
+            self._run_len += len(stripped)
+            if self._run_len > self.MAX_RUN:
+                self._flush_run()
+    
+    def _flush_run(self):
+        if len(self._run) > 1:
+            # 单个文本节点的整体解析结果是按行解析的子集，只有多段拼接才需要再解析
+            self._emit(parse_simple_line(''.join(self._run), self.source_name, self.category))
+        self._run = []
+        self._run_len = 0
+    
+    def _on_tag(self, tag: str):
+        self._flush_text()
+        if tag not in self.INLINE_TAGS:
+            self._flush_run()
+    
+    def handle_starttag(self, tag, attrs):
+        self._on_tag(tag)
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in self.GROUP_TAGS:
+            self._group_depth += 1
+    
+    def handle_endtag(self, tag):
+        self._on_tag(tag)
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in self.GROUP_TAGS and self._group_depth:
+            self._group_depth -= 1
+            if not self._group_depth:
+                self._flush_run()
+    
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        self._text.append(data)
+        self._text_len += len(data)
+        if self._text_len > self.MAX_TEXT:
+            text = ''.join(self._text)
+            cut = text.rfind('\n') + 1
+            if cut:
+                self._emit(parse_text_content(text[:cut], self.source_name, self.category))
+                self._flush_run()
+                text = text[cut:]
+            self._text = [text]
+            self._text_len = len(text)
+    
+    def close(self):
+        super().close()
+        self._flush_text()
+        self._flush_run()
+
+
 def parse_html_content(content: str, source_name: str, category: str) -> List[IPEntry]:
     """解析 HTML 内容"""
+    if HTML_PARSER == 'soup' and BeautifulSoup is not None:
+        return parse_html_content_soup(content, source_name, category)
+    
+    try:
+        extractor = HTMLAddressExtractor(source_name, category)
+        for i in range(0, len(content), 65536):
+            extractor.feed(content[i:i + 65536])
+        extractor.close()
+        return extractor.entries
+    except Exception as e:
+        logger.error(f"HTML parsing error: {e}")
+        return parse_text_content(content, source_name, category)
+
+
+def parse_html_content_soup(content: str, source_name: str, category: str) -> List[IPEntry]:
+    """解析 HTML 内容（BeautifulSoup 三遍遍历，同一地址可能重复输出）"""
     entries = []
     
     try:
@@ -461,39 +2276,497 @@ def parse_html_content(content: str, source_name: str, category: str) -> List[IP
 
 
 # ============================================================
-# 数据源处理
+# 运行指标
 # ============================================================
 
-def process_remote_source(source: Dict) -> List[IPEntry]:
-    """处理远程数据源"""
-    logger.info(f"📥 Remote: {source['name']}")
+class SourceMetrics:
+    """单个数据源的采集 / 解析指标"""
     
-    content = fetch_url(source['url'])
-    if not content:
-        logger.warning(f"   ⚠️ Empty content")
-        return []
+    __slots__ = ('status', 'cached', 'fetch_seconds', 'fetch_bytes', 'parse_seconds', 'lines', 'entries')
+    
+    def __init__(self):
+        self.status = "pending"
+        self.cached = False
+        self.fetch_seconds = 0.0
+        self.fetch_bytes = 0
+        self.parse_seconds = 0.0
+        self.lines = 0
+        self.entries = 0
+    
+    def fetched(self, content: Optional[str], seconds: float, cached: bool = False):
+        self.fetch_seconds = seconds
+        self.cached = cached
+        if content:
+            self.fetch_bytes = len(content.encode('utf-8'))
+            self.lines = content.count('\n') + 1
+        else:
+            self.status = "empty"
+    
+    def parsed(self, entries: int, seconds: float):
+        self.status = "ok"
+        self.entries = entries
+        self.parse_seconds = seconds
+    
+    def to_dict(self) -> Dict[str, Any]:
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['fetch_seconds'] = round(self.fetch_seconds, 4)
+        data['parse_seconds'] = round(self.parse_seconds, 4)
+        data['lines_per_second'] = round(self.lines / self.parse_seconds, 1) if self.parse_seconds > 0 else None
+        return data
+
+
+class Metrics:
+    """
+    运行指标: 各阶段耗时、各数据源采集 / 解析、去重率、探测吞吐、错误分类与连接延迟直方图
+    写出 METRICS_DIR/metrics.prom（node_exporter textfile collector 格式）与 metrics.json，
+    并向 metrics-history.ndjson 追加本次运行（保留最近 METRICS_HISTORY_RUNS 次）
+    """
+    
+    PREFIX = "ipagg"
+    # 连接延迟直方图分桶上界（毫秒）
+    LATENCY_BUCKETS_MS = (10, 25, 50, 100, 200, 300, 500, 1000, 2000, 5000)
+    _ERRNO_PATTERN = re.compile(r'\[Errno (\d+)\]')
+    
+    def __init__(self):
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.sources: Dict[str, SourceMetrics] = {}
+        self.raw_entries = 0
+        self.unique_entries = 0
+        self.probes = 0
+        self.probes_valid = 0
+        self.probes_reused = 0
+        self.errors: Dict[str, int] = {}
+        self.latency_buckets = [0] * (len(self.LATENCY_BUCKETS_MS) + 1)
+        self.latency_sum = 0.0
+        self.latency_count = 0
+    
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+    
+    def source(self, name: str) -> SourceMetrics:
+        metrics = self.sources.get(name)
+        if metrics is None:
+            metrics = self.sources[name] = SourceMetrics()
+        return metrics
+    
+    @classmethod
+    def error_class(cls, error: str) -> str:
+        """错误归类: [Errno N] 归为 errno 名（ECONNRESET 等），其余按错误文本（Timeout / Refused / Reset …）"""
+        match = cls._ERRNO_PATTERN.match(error)
+        if match:
+            return errno.errorcode.get(int(match.group(1)), f"errno{match.group(1)}")
+        return error or "Unknown"
+    
+    def observe_probe(self, entry: IPEntry):
+        """记录一次实际探测的结果"""
+        self.probes += 1
+        if entry.is_valid:
+            self.probes_valid += 1
+        else:
+            name = self.error_class(entry.validation_error)
+            self.errors[name] = self.errors.get(name, 0) + 1
+        if entry.latency_ms is not None:
+            self.latency_buckets[bisect.bisect_left(self.LATENCY_BUCKETS_MS, entry.latency_ms)] += 1
+            self.latency_sum += entry.latency_ms
+            self.latency_count += 1
+    
+    def to_dict(self) -> Dict[str, Any]:
+        validate_seconds = self.phases.get('validate', 0.0)
+        return {
+            "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec='seconds'),
+            "phases_seconds": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "sources": {name: source.to_dict() for name, source in self.sources.items()},
+            "dedup": {
+                "raw_entries": self.raw_entries,
+                "unique_entries": self.unique_entries,
+                "duplicate_ratio": round(1 - self.unique_entries / self.raw_entries, 4) if self.raw_entries else 0.0
+            },
+            "probes": {
+                "probed": self.probes,
+                "valid": self.probes_valid,
+                "reused": self.probes_reused,
+                "per_second": round(self.probes / validate_seconds, 1) if validate_seconds > 0 else None,
+                "errors": dict(sorted(self.errors.items(), key=lambda x: x[1], reverse=True)),
+                "connect_latency_ms": {
+                    "buckets": dict(zip(
+                        [str(bound) for bound in self.LATENCY_BUCKETS_MS] + ["+Inf"], self.latency_buckets
+                    )),
+                    "sum": round(self.latency_sum, 2),
+                    "count": self.latency_count
+                }
+            }
+        }
+    
+    @staticmethod
+    def _label(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    
+    def prometheus(self) -> str:
+        """Prometheus 文本格式（每次运行的快照值，均为 gauge；连接延迟为 histogram）"""
+        p = self.PREFIX
+        lines = []
+        
+        def metric(name: str, help_text: str, samples, kind: str = "gauge"):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{self._label(str(v))}"' for k, v in labels.items())
+                lines.append(f"{p}_{name}{{{label_text}}} {value}" if label_text else f"{p}_{name} {value}")
+        
+        sources = sorted(self.sources.items())
+        metric("last_run_timestamp_seconds", "Start time of the last run", [({}, round(self.started))])
+        metric("phase_seconds", "Wall time per pipeline phase",
+               [({'phase': name}, round(seconds, 4)) for name, seconds in self.phases.items()])
+        metric("source_up", "Whether the source produced content (1) or failed / was empty (0)",
+               [({'source': name}, int(s.status == "ok")) for name, s in sources])
+        metric("source_fetch_seconds", "Time spent fetching or reading the source",
+               [({'source': name}, round(s.fetch_seconds, 4)) for name, s in sources])
+        metric("source_fetch_bytes", "Size of the fetched source content",
+               [({'source': name}, s.fetch_bytes) for name, s in sources])
+        metric("source_parse_seconds", "Time spent parsing the source",
+               [({'source': name}, round(s.parse_seconds, 4)) for name, s in sources])
+        metric("source_lines", "Lines in the source content", [({'source': name}, s.lines) for name, s in sources])
+        metric("source_entries", "Entries parsed from the source",
+               [({'source': name}, s.entries) for name, s in sources])
+        metric("entries_raw", "Entries before deduplication", [({}, self.raw_entries)])
+        metric("entries_unique", "Entries after deduplication", [({}, self.unique_entries)])
+        metric("probes", "Endpoints actually probed", [({}, self.probes)])
+        metric("probes_valid", "Probed endpoints that passed", [({}, self.probes_valid)])
+        metric("probes_reused", "Endpoints answered from the probe store", [({}, self.probes_reused)])
+        metric("probe_errors", "Failed probes by error class",
+               [({'class': name}, count) for name, count in sorted(self.errors.items())])
+        
+        cumulative = 0
+        buckets = []
+        for bound, count in zip(list(self.LATENCY_BUCKETS_MS) + ["+Inf"], self.latency_buckets):
+            cumulative += count
+            buckets.append(({'le': bound}, cumulative))
+        lines.append(f"# HELP {p}_connect_latency_ms TCP connect latency of probed endpoints")
+        lines.append(f"# TYPE {p}_connect_latency_ms histogram")
+        for labels, value in buckets:
+            lines.append(f'{p}_connect_latency_ms_bucket{{le="{labels["le"]}"}} {value}')
+        lines.append(f"{p}_connect_latency_ms_sum {round(self.latency_sum, 2)}")
+        lines.append(f"{p}_connect_latency_ms_count {self.latency_count}")
+        return '\n'.join(lines) + '\n'
+    
+    def write(self, output_dir: str, history_runs: int = METRICS_HISTORY_RUNS):
+        """原子写出 metrics.prom / metrics.json / metrics-history.ndjson（textfile collector 不会读到半个文件）"""
+        os.makedirs(output_dir, exist_ok=True)
+        data = self.to_dict()
+        files = [
+            ("metrics.prom", self.prometheus()),
+            ("metrics.json", json.dumps(data, indent=2, ensure_ascii=False) + "\n")
+        ]
+        if history_runs > 0:
+            history = []
+            try:
+                with open(os.path.join(output_dir, "metrics-history.ndjson"), encoding='utf-8') as f:
+                    history = f.readlines()
+            except FileNotFoundError:
+                pass
+            history = history[-(history_runs - 1):] if history_runs > 1 else []
+            history.append(json.dumps(data, ensure_ascii=False, separators=(',', ':')) + "\n")
+            files.append(("metrics-history.ndjson", ''.join(history)))
+        for name, content in files:
+            path = os.path.join(output_dir, name)
+            with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+
+
+class Profiler:
+    """
+    按需开启的性能剖析（PROFILE 环境变量，逗号分隔；未开启时 create 返回 None，调用处不做任何事）
+    - cpu: cProfile 分段剖析 CPU 密集步骤（parse / dedup / export），同名分段跨线程累加，
+      输出 profile/cpu_<name>.pstats 与按累计耗时排序的 cpu_<name>.txt
+    - memory: tracemalloc 记录 main() 各阶段的峰值内存与新增分配最多的代码行，输出 profile/memory_<phase>.txt
+    - asyncio: 验证期间打开事件循环调试模式，记录超过 PROFILE_SLOW_CALLBACK_MS 的回调，
+      并用定时任务测量事件循环延迟，输出 profile/asyncio_slow_callbacks.txt 与 asyncio_lag.json
+    分片验证（VALIDATION_WORKERS > 1）时工作进程内的探测不在剖析范围内
+    """
+    
+    MODES = ('cpu', 'memory', 'asyncio')
+    LAG_INTERVAL = 0.05
+    
+    def __init__(self, output_dir: str, modes: Set[str], top: int = 25, slow_callback_ms: float = 100):
+        self.output_dir = os.path.join(output_dir, "profile")
+        self.modes = modes
+        self.top = top
+        self.slow_callback_ms = slow_callback_ms
+        self._cpu: Dict[str, pstats.Stats] = {}
+        self._cpu_lock = threading.Lock()
+        self._memory: Dict[str, Tuple[int, int, List[Any]]] = {}
+        self._slow_callbacks: List[Tuple[float, str]] = []
+        self._lags = array.array('d')
+        if 'memory' in modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+    
+    @classmethod
+    def create(cls, output_dir: str, spec: str, top: int = 25, slow_callback_ms: float = 100) -> Optional['Profiler']:
+        """按 PROFILE 取值创建；关闭时返回 None"""
+        if not spec or spec in ('0', 'false', 'off'):
+            return None
+        modes = set(cls.MODES) if spec in ('1', 'true', 'all') else {m.strip() for m in spec.split(',')}
+        unknown = modes - set(cls.MODES)
+        if unknown:
+            logger.warning(f"⚠️ Unknown PROFILE modes ignored: {', '.join(sorted(unknown))}")
+        modes &= set(cls.MODES)
+        if not modes:
+            return None
+        return cls(output_dir, modes, top, slow_callback_ms)
+    
+    @contextmanager
+    def section(self, name: str):
+        """CPU 分段（可在工作线程中使用）；分段内不能有 await"""
+        if 'cpu' not in self.modes:
+            yield
+            return
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._cpu_lock:
+                stats = self._cpu.get(name)
+                if stats is None:
+                    self._cpu[name] = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+    
+    @contextmanager
+    def phase(self, name: str):
+        """main() 的阶段: 记录阶段内峰值内存和新增分配"""
+        if 'memory' not in self.modes:
+            yield
+            return
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            top = after.compare_to(before, 'lineno')[:self.top]
+            self._memory[name] = (current, peak, top)
+    
+    def watch_loop(self, coro):
+        """包装验证阶段的协程: 开启慢回调记录与事件循环延迟测量"""
+        if 'asyncio' not in self.modes:
+            return coro
+        return self._watch_loop(coro)
+    
+    async def _watch_loop(self, coro):
+        loop = asyncio.get_running_loop()
+        debug, slow = loop.get_debug(), loop.slow_callback_duration
+        loop.set_debug(True)
+        loop.slow_callback_duration = self.slow_callback_ms / 1000
+        handler = _SlowCallbackHandler(self._slow_callbacks)
+        asyncio_logger = logging.getLogger('asyncio')
+        asyncio_logger.addHandler(handler)
+        monitor = asyncio.create_task(self._measure_lag())
+        try:
+            return await coro
+        finally:
+            monitor.cancel()
+            await asyncio.gather(monitor, return_exceptions=True)
+            asyncio_logger.removeHandler(handler)
+            loop.set_debug(debug)
+            loop.slow_callback_duration = slow
+    
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.LAG_INTERVAL
+            await asyncio.sleep(self.LAG_INTERVAL)
+            self._lags.append(max(0.0, loop.time() - expected))
+    
+    def write(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        written = []
+        
+        for name, stats in self._cpu.items():
+            stats.dump_stats(os.path.join(self.output_dir, f"cpu_{name}.pstats"))
+            text = io.StringIO()
+            stats.stream = text
+            stats.sort_stats('cumulative').print_stats(self.top)
+            self._write_text(f"cpu_{name}.txt", text.getvalue())
+            written.append(f"cpu_{name}")
+        
+        for name, (current, peak, top) in self._memory.items():
+            lines = [
+                f"# phase: {name}",
+                f"# peak traced memory: {peak / 1e6:.1f} MB, at phase end: {current / 1e6:.1f} MB",
+                f"# top {len(top)} allocation sites by growth during the phase",
+                ""
+            ]
+            lines.extend(str(stat) for stat in top)
+            self._write_text(f"memory_{name}.txt", '\n'.join(lines) + '\n')
+            written.append(f"memory_{name}")
+        
+        if 'asyncio' in self.modes:
+            slow = sorted(self._slow_callbacks, key=lambda x: x[0], reverse=True)
+            lines = [f"# {len(slow)} callbacks slower than {self.slow_callback_ms:.0f}ms (slowest first)", ""]
+            lines.extend(f"{seconds * 1000:8.1f}ms  {message}" for seconds, message in slow[:self.top * 4])
+            self._write_text("asyncio_slow_callbacks.txt", '\n'.join(lines) + '\n')
+            
+            lags = sorted(self._lags)
+            lag = {"interval_ms": self.LAG_INTERVAL * 1000, "samples": len(lags)}
+            if lags:
+                lag.update({
+                    "p50_ms": round(lags[len(lags) // 2] * 1000, 2),
+                    "p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000, 2),
+                    "max_ms": round(lags[-1] * 1000, 2),
+                    "over_slow_callback_threshold": sum(1 for x in lags if x * 1000 > self.slow_callback_ms)
+                })
+            self._write_text("asyncio_lag.json", json.dumps(lag, indent=2) + '\n')
+            written.append("asyncio")
+        
+        logger.info(f"🔬 Profiling output ({', '.join(written) or 'nothing recorded'}) in {self.output_dir}/")
+    
+    def _write_text(self, name: str, content: str):
+        with open(os.path.join(self.output_dir, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """收集 asyncio 调试模式的慢回调警告（Executing <Handle …> took N seconds）"""
+    
+    def __init__(self, sink: List[Tuple[float, str]]):
+        super().__init__(logging.WARNING)
+        self.sink = sink
+    
+    def emit(self, record: logging.LogRecord):
+        if isinstance(record.msg, str) and record.msg.startswith('Executing') and record.args:
+            self.sink.append((record.args[-1], record.getMessage()))
+
+
+# ============================================================
+# 数据源处理
+# ============================================================
+
+def parse_remote_content(content: str, source: Dict, cache: Optional[HTTPCache] = None) -> List[IPEntry]:
+    """按数据源类型解析远程内容（内容未变时复用缓存的解析结果）"""
+    if cache:
+        entries = cache.load_entries(content, source)
+        if entries is not None:
+            return entries
+        entries = parse_remote_content(content, source)
+        cache.store_entries(content, source, entries)
+        return entries
     
     source_type = source['type']
     source_name = source['name']
     category = source.get('category', 'unknown')
     
     if source_type == 'html':
-        entries = parse_html_content(content, source_name, category)
+        return parse_html_content(content, source_name, category)
     elif source_type == 'socks5_rich':
-        entries = parse_socks5_rich_content(content, source_name)
+        # socks4:// 等行需保留协议，否则会按 socks5 分类做 SOCKS5 握手
+        return annotate_proxy_protocols(content, parse_socks5_rich_content(content, source_name))
     else:
-        entries = parse_text_content(content, source_name, category)
+        return annotate_proxy_protocols(content, parse_text_content(content, source_name, category))
+
+
+def process_remote_source(
+    source: Dict,
+    cache: Optional[HTTPCache] = None,
+    metrics: Optional[SourceMetrics] = None,
+    profiler: Optional[Profiler] = None
+) -> List[IPEntry]:
+    """处理远程数据源"""
+    logger.info(f"📥 Remote: {source['name']}")
+    
+    start = time.perf_counter()
+    content = cache.fresh_body(source['url'], source.get('max_age')) if cache else None
+    cached = content is not None
+    if content is None:
+        content = fetch_url(
+            source['url'],
+            timeout=source.get('timeout', FETCH_TIMEOUT),
+            retries=source.get('retries', FETCH_RETRIES),
+            cache=cache
+        )
+    if metrics is not None:
+        metrics.fetched(content, time.perf_counter() - start, cached)
+    if not content:
+        logger.warning(f"   ⚠️ Empty content")
+        return []
+    
+    start = time.perf_counter()
+    with profiler.section('parse') if profiler is not None else nullcontext():
+        entries = parse_remote_content(content, source, cache)
+    if metrics is not None:
+        metrics.parsed(len(entries), time.perf_counter() - start)
     
     logger.info(f"   ✅ Found {len(entries)} entries")
     return entries
 
 
-def process_local_source(source: Dict) -> List[IPEntry]:
+async def process_remote_source_async(
+    session: "aiohttp.ClientSession",
+    source: Dict,
+    cache: Optional[HTTPCache] = None,
+    metrics: Optional[SourceMetrics] = None,
+    profiler: Optional[Profiler] = None
+) -> List[IPEntry]:
+    """异步处理远程数据源（下载完成即在线程中解析，解析不阻塞事件循环上的探测与下载）"""
+    start = time.monotonic()
+    content = cache.fresh_body(source['url'], source.get('max_age')) if cache else None
+    cached = content is not None
+    if content is None:
+        content = await fetch_url_async(
+            session,
+            source['url'],
+            timeout=source.get('timeout', FETCH_TIMEOUT),
+            retries=source.get('retries', FETCH_RETRIES),
+            cache=cache
+        )
+    fetched = time.monotonic()
+    if metrics is not None:
+        metrics.fetched(content, fetched - start, cached)
+    if not content:
+        logger.warning(f"   ⚠️ {source['name']}: Empty content")
+        return []
+    
+    def parse() -> List[IPEntry]:
+        with profiler.section('parse') if profiler is not None else nullcontext():
+            return parse_remote_content(content, source, cache)
+    
+    entries = await asyncio.to_thread(parse)
+    if metrics is not None:
+        metrics.parsed(len(entries), time.monotonic() - fetched)
+    
+    elapsed = time.monotonic() - start
+    logger.info(f"   ✅ {source['name']}: {len(entries)} entries ({elapsed:.1f}s)")
+    return entries
+
+
+def new_http_session() -> "aiohttp.ClientSession":
+    """共享 keep-alive 连接池的会话"""
+    connector = aiohttp.TCPConnector(limit=FETCH_CONCURRENCY, ttl_dns_cache=300)
+    return aiohttp.ClientSession(headers=HTTP_HEADERS, connector=connector)
+
+
+def process_local_source(
+    source: Dict,
+    metrics: Optional[SourceMetrics] = None,
+    profiler: Optional[Profiler] = None
+) -> List[IPEntry]:
     """处理本地数据源"""
     filepath = SCRIPT_DIR / source['file']
     logger.info(f"📂 Local: {source['name']} ({source['file']})")
     
+    start = time.perf_counter()
     content = read_local_file(filepath)
+    if metrics is not None:
+        metrics.fetched(content, time.perf_counter() - start)
     if not content:
         logger.warning(f"   ⚠️ Empty or not found")
         return []
@@ -502,183 +2775,1079 @@ def process_local_source(source: Dict) -> List[IPEntry]:
     category = source.get('category', 'local')
     region_hint = source.get('region_hint', '')
     
-    entries = parse_text_content(content, source_name, category, region_hint)
+    start = time.perf_counter()
+    with profiler.section('parse') if profiler is not None else nullcontext():
+        entries = parse_text_content(content, source_name, category, region_hint)
+        annotate_proxy_protocols(content, entries)
+    if metrics is not None:
+        metrics.parsed(len(entries), time.perf_counter() - start)
+    
+    logger.info(f"   ✅ {source_name}: {len(entries)} entries")
+    return entries
+
+
+DEDUP_INFO_FIELDS = ('source', 'category', 'country', 'region', 'city', 'isp', 'net_type')
+
+
+def merge_richest_info(existing: IPEntry, existing_rank: Any, entry: IPEntry, rank: int) -> Any:
+    """
+    默认合并策略: 各字段组分别保留最佳来源的取值，结果与条目到达顺序无关
+    - 来源 / 分类 / 地理信息为一组: 有国家、城市、地区信息的优先（依次比较），其次 rank（数据源顺序）小的优先
+    - 网络类型、ISP、代理协议及认证信息各自独立: 非空优先，其次 rank 小的优先
+    - 优先级完全相同（同一 rank）时保留先到的
+    existing_rank 为 int（各组来源相同）或各组来源 rank 的元组 (地理, 网络类型, ISP, 协议)，返回值同理
+    """
+    if existing_rank.__class__ is tuple:
+        geo_rank, net_rank, isp_rank, proto_rank = existing_rank
+    else:
+        geo_rank = net_rank = isp_rank = proto_rank = existing_rank
+    
+    # 直接在 INFO_FIELDS 共享元组上比较和拼接，最后只换一次元组
+    info = old = existing._info
+    new = entry._info
+    _, _, country, region, city, isp, net_type = new
+    if (bool(country), bool(city), bool(region), -rank) > (bool(old[2]), bool(old[4]), bool(old[3]), -geo_rank):
+        info = new[:5] + old[5:]
+        geo_rank = rank
+    if net_type and (not info[6] or rank < net_rank):
+        info = info[:6] + (net_type,)
+        net_rank = rank
+    if isp and (not info[5] or rank < isp_rank):
+        info = info[:5] + (isp,) + info[6:]
+        isp_rank = rank
+    if info is not old:
+        existing._info = _share(info)
+    if entry.protocol and (not existing.protocol or rank < proto_rank):
+        existing.protocol, existing.proxy_auth = entry.protocol, entry.proxy_auth
+        proto_rank = rank
+    
+    if geo_rank == net_rank == isp_rank == proto_rank:
+        return geo_rank
+    return geo_rank, net_rank, isp_rank, proto_rank
+
+
+class DedupIndex:
+    """
+    增量去重索引，以打包整数 key = (ip_int << 16) | port 为键
+    - 重复地址交给合并策略 merge(existing, existing_rank, entry, rank) -> rank 处理，
+      策略就地修改已有条目，已进入验证队列的对象保持不变
+    - 保存的 rank 由合并策略解释（默认策略为 int 或各字段组的 rank 元组），数据源乱序到达时结果不变
+    """
+    
+    def __init__(self, merge: Callable[[IPEntry, Any, IPEntry, int], Any] = merge_richest_info):
+        self.merge = merge
+        self._entries: Dict[int, IPEntry] = {}
+        self._ranks: Dict[int, Any] = {}
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def add(self, entry: IPEntry, rank: int = 0) -> Optional[IPEntry]:
+        """加入条目；新地址返回该条目，重复地址返回 None"""
+        key = entry.key
+        existing = self._entries.get(key)
+        
+        if existing is None:
+            self._entries[key] = entry
+            self._ranks[key] = rank
+            return entry
+        
+        self._ranks[key] = self.merge(existing, self._ranks[key], entry, rank)
+        return None
+    
+    def get(self, key: int) -> Optional[IPEntry]:
+        return self._entries.get(key)
+    
+    def discard(self, key: int) -> Optional[IPEntry]:
+        """移除地址并返回其条目（不存在时返回 None）"""
+        self._ranks.pop(key, None)
+        return self._entries.pop(key, None)
+    
+    def entries(self) -> List[IPEntry]:
+        return list(self._entries.values())
+
+
+def deduplicate_entries(
+    entries: List[IPEntry],
+    merge: Callable[[IPEntry, Any, IPEntry, int], Any] = merge_richest_info
+) -> List[IPEntry]:
+    """去重（默认保留信息最丰富的条目）"""
+    index = DedupIndex(merge)
+    add = index.add
+    for entry in entries:
+        add(entry)
+    return index.entries()
+
+
+def sort_entries(entries: List[IPEntry]) -> List[IPEntry]:
+    """按 IP、端口排序（打包 key 的整数序与按段比较一致）"""
+    return sorted(entries, key=attrgetter('key'))
+
+
+# ============================================================
+# 流水线
+# ============================================================
+
+async def run_pipeline(
+    exporter: "Exporter",
+    validate: bool = True,
+    timeout: float = 3.0,
+    concurrency: int = 100,
+    cache: Optional[HTTPCache] = None,
+    probe_store: Optional[ProbeStore] = None,
+    adaptive: Optional[AdaptiveTimeout] = None,
+    shards: int = 1,
+    samples: int = 0,
+    sample_interval: float = 0.5,
+    scheduler: Optional[FairScheduler] = None,
+    auto_concurrency: Optional[AIMDConcurrency] = None,
+    metrics: Optional[Metrics] = None,
+    profiler: Optional[Profiler] = None
+) -> Dict[str, int]:
+    """
+    流式流水线: 采集 → 增量去重 → 验证队列 → 导出器
+    - 每个数据源解析完成即去重入队，验证与采集并行
+    - 有探测结果库时，近期结果仍有效的条目不再探测
+    - 启用自适应超时时，每个条目的超时由 adaptive 给出
+    - shards > 1 时探测分散到多个工作进程（ShardedValidator），结果流式写回
+    - samples > 0 时，本次探测通过的条目再做 samples 次延迟采样（首轮结果计为第一个样本），
+      每次采样间隔随机化后重新入队，与其余条目的首轮验证并行，同样受网段 / 运营商上限、
+      全局连接速率、AIMD 并发与自适应超时约束
+    - 验证队列为 FairScheduler: 按 /24 轮询出队，限制网段 / 运营商在途数及全局连接速率
+    - auto_concurrency 存在时并发数由 AIMD 控制（单进程模式），本机资源错误的条目重新入队
+    - 验证结果直接交给导出器，排序只在写文件时进行
+    - metrics 存在时记录各数据源采集 / 解析、去重、探测结果与阶段耗时
+    - profiler 存在时对解析与去重分段做 CPU 剖析
+    返回各数据源条目数
+    """
+    index = DedupIndex()
+    queue = scheduler or FairScheduler()
+    source_stats: Dict[str, int] = {}
+    raw_total = 0
+    completed = 0
+    valid_count = 0
+    start_time = time.time()
+    
+    def ingest(rank: int, source: Dict, result: Any):
+        nonlocal raw_total
+        if isinstance(result, BaseException):
+            logger.error(f"   ❌ Error: {source['name']}: {result}")
+            source_stats[source['name']] = 0
+            if metrics is not None:
+                metrics.source(source['name']).status = "error"
+            return
+        
+        source_stats[source['name']] = len(result)
+        raw_total += len(result)
+        with profiler.section('dedup') if profiler is not None else nullcontext():
+            for entry in result:
+                new_entry = index.add(entry, rank)
+                if new_entry is None:
+                    continue
+                if validate:
+                    queue.put_nowait(new_entry)
+                else:
+                    exporter.add(new_entry)
+    
+    def source_metrics(source: Dict) -> Optional[SourceMetrics]:
+        return metrics.source(source['name']) if metrics is not None else None
+    
+    async def produce_remote(rank: int, source: Dict, session):
+        try:
+            if session is not None:
+                result = await process_remote_source_async(session, source, cache, source_metrics(source), profiler)
+            else:
+                result = await asyncio.to_thread(
+                    process_remote_source, source, cache, source_metrics(source), profiler
+                )
+        except Exception as e:
+            result = e
+        ingest(rank, source, result)
+    
+    async def produce_local(rank: int, source: Dict):
+        try:
+            result = await asyncio.to_thread(process_local_source, source, source_metrics(source), profiler)
+        except Exception as e:
+            result = e
+        ingest(rank, source, result)
+    
+    def needs_probe(entry: IPEntry) -> bool:
+        return probe_store is None or not probe_store.apply_recent(entry)
+    
+    def timeout_for(entry: IPEntry) -> float:
+        return adaptive.timeout_for(entry) if adaptive else timeout
+    
+    resource_retries: Dict[int, int] = {}
+    sampling: Dict[int, List[Optional[float]]] = {}   # id(条目) → 已有的延迟样本
+    sample_tasks: Set[asyncio.Task] = set()
+    
+    async def requeue_sample(entry: IPEntry):
+        await asyncio.sleep(sample_interval * random.uniform(0.5, 1.5))
+        queue.put_nowait(entry)
+    
+    def schedule_sample(entry: IPEntry):
+        """间隔随机化后重新入队，采样分散在时间上"""
+        task = asyncio.create_task(requeue_sample(entry))
+        sample_tasks.add(task)
+        task.add_done_callback(sample_tasks.discard)
+    
+    async def sample(entry: IPEntry) -> str:
+        """对重新入队的条目做一次 TCP 连接采样；本机资源错误（有限次）不计入样本"""
+        success, latency, error = await PROBERS[PROBE_ENGINE](entry.ip, entry.port, timeout_for(entry))
+        taken = sampling[id(entry)]
+        if is_local_resource_error(error) and resource_retries.get(id(entry), 0) < 3:
+            resource_retries[id(entry)] = resource_retries.get(id(entry), 0) + 1
+        else:
+            taken.append(latency if success else None)
+        if len(taken) > samples:
+            entry.set_latency_samples(sampling.pop(id(entry)))
+        else:
+            schedule_sample(entry)
+        return error
+    
+    def record(key: int, entry: IPEntry):
+        if metrics is not None:
+            metrics.observe_probe(entry)
+        if adaptive is not None:
+            adaptive.observe(entry)
+        if probe_store is not None:
+            probe_store.record(key, entry)
+        if samples and entry.is_valid and entry.port:
+            sampling[id(entry)] = [entry.latency_ms]
+            schedule_sample(entry)
+    
+    def complete(entry: IPEntry):
+        nonlocal completed, valid_count
+        exporter.add(entry)
+        completed += 1
+        if entry.is_valid:
+            valid_count += 1
+            if valid_count == 1:
+                logger.info(f"   ⚡ First valid result after {time.time() - start_time:.1f}s: {entry.address}")
+        if completed % 100 == 0:
+            elapsed = time.time() - start_time
+            rate = completed / elapsed if elapsed > 0 else 0
+            logger.info(f"   Progress: {completed}/{completed + queue.qsize()} ({rate:.0f}/s)")
+    
+    async def consume():
+        while True:
+            if auto_concurrency is not None:
+                await auto_concurrency.acquire()
+            entry = await queue.get()
+            error = ""
+            retry = False
+            sampled = id(entry) in sampling
+            try:
+                if sampled:
+                    await queue.throttle()
+                    error = await sample(entry)
+                elif needs_probe(entry):
+                    key = entry.key
+                    await queue.throttle()
+                    await validate_entry(entry, timeout_for(entry))
+                    error = entry.validation_error
+                    retry = is_local_resource_error(error) and resource_retries.get(id(entry), 0) < 3
+                    if retry:
+                        resource_retries[id(entry)] = resource_retries.get(id(entry), 0) + 1
+                        entry.is_valid, entry.latency_ms, entry.validation_error = None, None, ""
+                    else:
+                        record(key, entry)
+            except Exception as e:
+                logger.debug(f"Validation error {entry.address}: {e}")
+            finally:
+                if auto_concurrency is not None:
+                    auto_concurrency.release(error)
+                if retry:
+                    queue.put_nowait(entry)
+                queue.task_done(entry)
+            if not retry and not sampled:
+                complete(entry)
+    
+    async def sample_detached(entry: IPEntry):
+        try:
+            await sample(entry)
+        finally:
+            queue.task_done(entry)
+    
+    async def dispatch():
+        """分片模式: 需要探测的条目交给工作进程，延迟采样在本进程内进行"""
+        while True:
+            entry = await queue.get()
+            if id(entry) in sampling:
+                await queue.throttle()
+                task = asyncio.create_task(sample_detached(entry))
+                sample_tasks.add(task)
+                task.add_done_callback(sample_tasks.discard)
+                continue
+            if needs_probe(entry):
+                await queue.throttle()
+                try:
+                    await sharded.submit(entry, timeout_for(entry))
+                    continue
+                except RuntimeError:
+                    entry.is_valid, entry.latency_ms, entry.validation_error = False, None, WORKER_DIED
+            queue.task_done(entry)
+            complete(entry)
+    
+    async def collect():
+        """分片模式: 接收工作进程回传的结果"""
+        async for entry, key in sharded.results():
+            if entry.validation_error != WORKER_DIED:
+                record(key, entry)
+            queue.task_done(entry)
+            complete(entry)
+    
+    sharded = None
+    if validate and shards > 1:
+        sharded = ShardedValidator(shards, concurrency)
+        sharded.start()
+        logger.info(f"   Sharded validation: {shards} processes × {sharded.share} concurrent probes")
+        workers = [asyncio.create_task(dispatch()), asyncio.create_task(collect())]
+    elif validate and auto_concurrency is not None:
+        workers = [asyncio.create_task(consume()) for _ in range(auto_concurrency.maximum)]
+    elif validate:
+        workers = [asyncio.create_task(consume()) for _ in range(concurrency)]
+    else:
+        workers = []
+    session = new_http_session() if aiohttp is not None else None
+    if session is None:
+        logger.info("   aiohttp not installed, fetching remote sources in threads")
+    
+    try:
+        producers = [produce_remote(rank, s, session) for rank, s in enumerate(REMOTE_SOURCES)]
+        producers += [
+            produce_local(len(REMOTE_SOURCES) + rank, s)
+            for rank, s in enumerate(LOCAL_SOURCES)
+        ]
+        await asyncio.gather(*producers)
+    finally:
+        if session is not None:
+            await session.close()
+    
+    if cache:
+        cache.evict()
+    logger.info(f"\n📊 Raw total: {raw_total} entries | Unique: {len(index)}")
+    if metrics is not None:
+        metrics.phases['collect'] = time.time() - start_time
+        metrics.raw_entries = raw_total
+        metrics.unique_entries = len(index)
+    
+    if validate:
+        await queue.join()
+        if sample_tasks:
+            logger.info(f"   📏 Waiting for {len(sampling)} endpoints still being sampled")
+        while sample_tasks:
+            # 采样条目在间隔结束后才重新入队，队列清空不代表采样已完成
+            await asyncio.gather(*list(sample_tasks), return_exceptions=True)
+            await queue.join()
+        if sharded is not None:
+            # 结果已全部收回，等待工作进程收到结束标记后退出
+            sharded.close()
+            await workers.pop()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        
+        elapsed = time.time() - start_time
+        logger.info(f"   Progress: {completed}/{completed} ({completed / elapsed if elapsed > 0 else 0:.0f}/s)")
+        if auto_concurrency is not None and sharded is None:
+            logger.info(
+                f"   🎛️  Auto concurrency settled at {auto_concurrency.limit:.0f} "
+                f"(peak {auto_concurrency.peak:.0f}, max {auto_concurrency.maximum}, "
+                f"{auto_concurrency.backoffs} back-offs)"
+            )
+        if adaptive is not None:
+            p99 = adaptive.percentile(99)
+            logger.info(
+                f"   ⏱️  Adaptive timeout: p99 {p99 or 0:.0f}ms, {adaptive.early_giveups} early give-ups "
+                f"(floor {adaptive.floor}s, ceiling {adaptive.ceiling}s)"
+            )
+        if probe_store is not None:
+            logger.info(f"   ♻️  Reused {probe_store.reused} recent probe results, probed {completed - probe_store.reused}")
+        if metrics is not None:
+            metrics.phases['validate'] = elapsed
+            metrics.probes_reused = probe_store.reused if probe_store is not None else 0
+    
+    return source_stats
+
+
+# ============================================================
+# 导出器
+# ============================================================
+
+# 远程来源名集合（摘要中区分 Remote / Local）
+REMOTE_SOURCE_NAMES = frozenset(s['name'] for s in REMOTE_SOURCES)
+
+
+class EntryStats:
+    """
+    导出统计: 对最终条目单次遍历得到的计数、分组、延迟分布
+    所有导出器和最终日志共用这一份结果，不再各自遍历条目
+    """
+    
+    # 延迟直方图分桶上界（毫秒），最后一桶为 >= 最大上界
+    LATENCY_BUCKETS = (50, 100, 200, 300, 500, 1000, 2000)
+    TOP_FASTEST = 20
+    
+    __slots__ = (
+        'total', 'valid', 'invalid', 'untested',
+        'by_country', 'by_net_type', 'by_source', 'by_category',
+        'latencies', 'latency_histogram', 'fastest', 'fetched'
+    )
+    
+    def __init__(self, fetched: Optional[Dict[str, int]] = None):
+        self.total = 0
+        self.valid = 0
+        self.invalid = 0
+        self.untested = 0
+        self.by_country: Dict[str, int] = {}
+        self.by_net_type: Dict[str, int] = {"datacenter": 0, "residential": 0, "unknown": 0}
+        self.by_source: Dict[str, int] = {}
+        self.by_category: Dict[str, int] = {}
+        self.latencies: List[float] = []
+        self.latency_histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+        self.fastest: List[IPEntry] = []
+        # 各来源抓取到的原始条目数（去重前）
+        self.fetched = fetched or {}
+    
+    @classmethod
+    def collect(cls, entries: List[IPEntry], fetched: Optional[Dict[str, int]] = None) -> 'EntryStats':
+        stats = cls(fetched)
+        by_country = stats.by_country
+        by_net_type = stats.by_net_type
+        by_source = stats.by_source
+        by_category = stats.by_category
+        latencies = stats.latencies
+        histogram = stats.latency_histogram
+        buckets = cls.LATENCY_BUCKETS
+        # 最快 N 个: 以 (-延迟, -序号) 为键的有界堆，等价于稳定排序后取前 N
+        fastest: List[Tuple[float, int, IPEntry]] = []
+        valid = invalid = 0
+        
+        for seq, e in enumerate(entries):
+            if e.is_valid is True:
+                valid += 1
+            elif e.is_valid is False:
+                invalid += 1
+            
+            country = e.country or 'Unknown'
+            by_country[country] = by_country.get(country, 0) + 1
+            net_type = e.net_type_en
+            by_net_type[net_type] = by_net_type.get(net_type, 0) + 1
+            by_source[e.source] = by_source.get(e.source, 0) + 1
+            by_category[e.category] = by_category.get(e.category, 0) + 1
+            
+            if e.latency_ms:
+                latencies.append(e.latency_ms)
+                histogram[bisect.bisect_right(buckets, e.latency_ms)] += 1
+            if e.is_valid:
+                rank = e.rank_latency
+                if rank:
+                    if len(fastest) < cls.TOP_FASTEST:
+                        heapq.heappush(fastest, (-rank, -seq, e))
+                    elif (-rank, -seq) > fastest[0][:2]:
+                        heapq.heapreplace(fastest, (-rank, -seq, e))
+        
+        stats.total = len(entries)
+        stats.valid = valid
+        stats.invalid = invalid
+        stats.untested = stats.total - valid - invalid
+        latencies.sort()
+        stats.fastest = [e for _, _, e in sorted(fastest, key=lambda x: (-x[0], -x[1]))]
+        return stats
+    
+    def percentile(self, q: float) -> Optional[float]:
+        """最近秩百分位（q=0.5 即中位数）"""
+        if not self.latencies:
+            return None
+        return self.latencies[min(len(self.latencies) - 1, int(q * len(self.latencies)))]
+    
+    def histogram_labels(self) -> List[str]:
+        bounds = self.LATENCY_BUCKETS
+        labels = [f"<{bounds[0]}"]
+        labels.extend(f"{low}-{high}" for low, high in zip(bounds, bounds[1:]))
+        labels.append(f">={bounds[-1]}")
+        return labels
+    
+    def latency_summary(self) -> Dict[str, Any]:
+        latencies = self.latencies
+        if not latencies:
+            return {}
+        return {
+            "min": latencies[0],
+            "max": latencies[-1],
+            "avg": round(sum(latencies) / len(latencies), 2),
+            "median": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "histogram_ms": dict(zip(self.histogram_labels(), self.latency_histogram))
+        }
+    
+    def top_countries(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.by_country.items(), key=lambda x: x[1], reverse=True)[:n]
+
+
+class ChangeDetectingWriter:
+    """
+    分块写入临时文件并同时计算内容哈希（哈希前去掉时间戳等易变文本）
+    close() 时内容哈希与上次相同则丢弃临时文件，否则原子替换目标文件
+    binary=True 时写入 bytes，不做易变文本替换
+    """
+    
+    CHUNK_SIZE = 1 << 16
+    
+    def __init__(self, path: str, volatile: str = "", previous_hash: Optional[str] = None,
+                 binary: bool = False, **open_kwargs):
+        self.path = path
+        self.volatile = volatile
+        self.previous_hash = previous_hash
+        self.binary = binary
+        self._tmp = f"{path}.tmp"
+        if binary:
+            self._file = open(self._tmp, 'wb')
+        else:
+            self._file = open(self._tmp, 'w', encoding='utf-8', **open_kwargs)
+        self._hash = hashlib.sha256()
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self.digest: Optional[str] = None
+        self.changed = False
+    
+    def write(self, text: str):
+        # 小块写入先缓冲，攒够一块再落盘并更新哈希
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.CHUNK_SIZE:
+            self._flush()
+    
+    def _flush(self):
+        if not self._buffer:
+            return
+        self._buffered = 0
+        if self.binary:
+            chunk = b''.join(self._buffer)
+            self._buffer = []
+            self._file.write(chunk)
+            self._hash.update(chunk)
+            return
+        chunk = ''.join(self._buffer)
+        self._buffer = []
+        self._file.write(chunk)
+        self._hash.update((chunk.replace(self.volatile, '') if self.volatile else chunk).encode('utf-8'))
+    
+    def close(self):
+        self._flush()
+        self._file.close()
+        self.digest = self._hash.hexdigest()
+        self.changed = self.digest != self.previous_hash or not os.path.exists(self.path)
+        if self.changed:
+            os.replace(self._tmp, self.path)
+        else:
+            os.remove(self._tmp)
+    
+    def abort(self):
+        self._file.close()
+        os.remove(self._tmp)
+
+
+class JSONArrayWriter:
+    """
+    逐条写出 JSON 数组，不在内存中构建整个列表
+    indent=None 为紧凑格式；否则与 json.dump(indent=...) 在第 level 层嵌套时的输出一致
+    """
+    
+    def __init__(self, out, indent: Optional[int] = None, level: int = 0):
+        self.out = out
+        self.count = 0
+        if indent is None:
+            self._dumps = lambda item: json.dumps(item, ensure_ascii=False, separators=(',', ':'))
+            self._open, self._sep, self._close = '[', ',', ']'
+        else:
+            pad = '\n' + ' ' * (indent * (level + 1))
+            self._dumps = lambda item: json.dumps(item, indent=indent, ensure_ascii=False).replace('\n', pad)
+            self._open, self._sep, self._close = '[' + pad, ',' + pad, '\n' + ' ' * (indent * level) + ']'
     
-    logger.info(f"   ✅ Found {len(entries)} entries")
-    return entries
+    def write(self, item: Any):
+        self.out.write((self._sep if self.count else self._open) + self._dumps(item))
+        self.count += 1
+    
+    def close(self):
+        self.out.write(self._close if self.count else '[]')
+
+
+# ------------------------------------------------------------
+# 二进制快照（all.bin）
+#
+# 小端序，可直接 mmap 后按偏移读取，无需解析:
+#   头部      SNAPSHOT_HEADER（见下方字段）
+#   记录区    record_count 条定长记录，按 (ip, port) 升序，可二分查找
+#   延迟索引  latency_count 个 u32 记录下标，按排序延迟升序（无延迟的记录不在索引中）
+#   字符串表  (string_count + 1) 个 u32 偏移 + UTF-8 字节；0 号为空串
+# ------------------------------------------------------------
+
+SNAPSHOT_MAGIC = b'IPAGSNAP'
+SNAPSHOT_VERSION = 1
+# magic, version, record_size, flags, record_count, string_count, latency_count,
+# records_offset, latency_index_offset, strings_offset
+SNAPSHOT_HEADER = struct.Struct('<8sHHIIIIIII')
+# ip, port, status, net_type, latency_ms, country, source, isp, category, protocol
+SNAPSHOT_RECORD = struct.Struct('<IHBBfHHIHH')
+SNAPSHOT_KEY = struct.Struct('<IH')
+SNAPSHOT_STATUS = {None: 0, True: 1, False: 2}
+SNAPSHOT_STATUS_VALUES = (None, True, False)
+SNAPSHOT_NET_TYPES = ("", "机房", "家宽")
+SNAPSHOT_BATCH = 4096
+
+SnapshotRecord = collections.namedtuple(
+    'SnapshotRecord',
+    'ip port is_valid net_type latency_ms country source isp category protocol'
+)
 
 
-def deduplicate_entries(entries: List[IPEntry]) -> List[IPEntry]:
-    """去重（保留信息最丰富的条目）"""
-    seen: Dict[str, IPEntry] = {}
+def write_snapshot(out, entries: List[IPEntry]) -> int:
+    """
+    把已按 key 排序的条目写成二进制快照，返回写出的字节数
+    记录中的 latency_ms 为排序延迟（rank_latency），与 valid_only.txt 的排序一致
+    """
+    # 第一遍: 收集字符串与延迟；国家/来源/分类/协议用 u16 编号，排在 ISP 之前
+    small: Set[str] = set()
+    isps: Set[str] = set()
+    latencies = array.array('f')
+    for e in entries:
+        small.update((e.country, e.source, e.category, e.protocol))
+        isps.add(e.isp)
+        rank = e.rank_latency
+        latencies.append(float('nan') if rank is None else rank)
+    small.discard("")
+    isps.difference_update(small)
+    isps.discard("")
+    strings = [""] + sorted(small) + sorted(isps)
+    if len(small) >= 0xFFFF:
+        raise ValueError("too many distinct country/source/category values for snapshot")
+    string_ids = {s: i for i, s in enumerate(strings)}
     
-    for entry in entries:
-        key = entry.address
-        
-        if key not in seen:
-            seen[key] = entry
-        else:
-            existing = seen[key]
-            # 保留信息更丰富的
-            if entry.country and not existing.country:
-                seen[key] = entry
-            elif entry.net_type and not existing.net_type:
-                existing.net_type = entry.net_type
-                existing.country = entry.country or existing.country
-                existing.region = entry.region or existing.region
-                existing.city = entry.city or existing.city
-                existing.isp = entry.isp or existing.isp
+    latency_index = array.array('I', sorted(
+        (i for i, latency in enumerate(latencies) if latency == latency),
+        key=latencies.__getitem__
+    ))
+    del latencies
+    
+    encoded = [s.encode('utf-8') for s in strings]
+    string_offsets = array.array('I', [0])
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    
+    records_offset = SNAPSHOT_HEADER.size
+    latency_index_offset = records_offset + len(entries) * SNAPSHOT_RECORD.size
+    strings_offset = latency_index_offset + len(latency_index) * latency_index.itemsize
+    if sys.byteorder != 'little':
+        latency_index.byteswap()
+        string_offsets.byteswap()
+    
+    out.write(SNAPSHOT_HEADER.pack(
+        SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_RECORD.size, 0,
+        len(entries), len(strings), len(latency_index),
+        records_offset, latency_index_offset, strings_offset
+    ))
+    
+    # 第二遍: 按批打包定长记录
+    pack_into = SNAPSHOT_RECORD.pack_into
+    size = SNAPSHOT_RECORD.size
+    batch = bytearray(size * SNAPSHOT_BATCH)
+    filled = 0
+    for e in entries:
+        rank = e.rank_latency
+        pack_into(
+            batch, filled * size,
+            e.ip_int, e.port or 0, SNAPSHOT_STATUS[e.is_valid],
+            SNAPSHOT_NET_TYPES.index(e.net_type) if e.net_type in SNAPSHOT_NET_TYPES else 0,
+            float('nan') if rank is None else rank,
+            string_ids[e.country], string_ids[e.source], string_ids[e.isp],
+            string_ids[e.category], string_ids[e.protocol]
+        )
+        filled += 1
+        if filled == SNAPSHOT_BATCH:
+            out.write(bytes(batch))
+            filled = 0
+    if filled:
+        out.write(bytes(batch[:filled * size]))
     
-    return list(seen.values())
+    out.write(latency_index.tobytes())
+    out.write(string_offsets.tobytes())
+    for data in encoded:
+        out.write(data)
+    return strings_offset + string_offsets.itemsize * len(string_offsets) + string_offsets[-1]
 
 
-def sort_entries(entries: List[IPEntry]) -> List[IPEntry]:
-    """排序"""
-    def sort_key(entry: IPEntry):
+class SnapshotReader:
+    """
+    只读 mmap 二进制快照
+    - find(ip, port): 按地址二分查找
+    - fastest(n) / within_latency(max_ms): 走延迟索引
+    """
+    
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
         try:
-            octets = [int(x) for x in entry.ip.split('.')]
-            return (0, octets, entry.port or 0)
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
         except ValueError:
-            return (1, [0, 0, 0, 0], 0)
+            self._file.close()
+            raise ValueError(f"{path}: empty snapshot")
+        (magic, version, record_size, self.flags, self.record_count, self.string_count,
+         self.latency_count, self._records, self._latency_index, self._strings) = SNAPSHOT_HEADER.unpack_from(self._mm)
+        if magic != SNAPSHOT_MAGIC:
+            self.close()
+            raise ValueError(f"{path}: not an IP snapshot")
+        if version != SNAPSHOT_VERSION or record_size != SNAPSHOT_RECORD.size:
+            self.close()
+            raise ValueError(f"{path}: unsupported snapshot version {version} (record size {record_size})")
+        self.version = version
+        self._string_cache: Dict[int, str] = {}
     
-    return sorted(entries, key=sort_key)
-
+    def close(self):
+        self._mm.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def __len__(self) -> int:
+        return self.record_count
+    
+    def __iter__(self):
+        for i in range(self.record_count):
+            yield self[i]
+    
+    def string(self, index: int) -> str:
+        value = self._string_cache.get(index)
+        if value is None:
+            start, end = struct.unpack_from('<II', self._mm, self._strings + index * 4)
+            base = self._strings + (self.string_count + 1) * 4
+            value = self._string_cache[index] = self._mm[base + start:base + end].decode('utf-8')
+        return value
+    
+    def __getitem__(self, index: int) -> SnapshotRecord:
+        if not 0 <= index < self.record_count:
+            raise IndexError(index)
+        ip, port, status, net_type, latency, country, source, isp, category, protocol = \
+            SNAPSHOT_RECORD.unpack_from(self._mm, self._records + index * SNAPSHOT_RECORD.size)
+        return SnapshotRecord(
+            unpack_ipv4(ip), port or None, SNAPSHOT_STATUS_VALUES[status], SNAPSHOT_NET_TYPES[net_type],
+            None if latency != latency else round(latency, 2),
+            self.string(country), self.string(source), self.string(isp),
+            self.string(category), self.string(protocol)
+        )
+    
+    def _key(self, index: int) -> int:
+        ip, port = SNAPSHOT_KEY.unpack_from(self._mm, self._records + index * SNAPSHOT_RECORD.size)
+        return (ip << 16) | port
+    
+    def find(self, ip: str, port: Optional[int] = None) -> List[SnapshotRecord]:
+        """按地址查找；port 为空时返回该 IP 的全部记录"""
+        ip_int = pack_ipv4(ip)
+        target = (ip_int << 16) | (port or 0)
+        lo, hi = 0, self.record_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        
+        found = []
+        while lo < self.record_count:
+            key = self._key(lo)
+            if key >> 16 != ip_int or (port is not None and key != target):
+                break
+            found.append(self[lo])
+            lo += 1
+        return found
+    
+    def _latency_at(self, position: int) -> Tuple[int, float]:
+        index, = struct.unpack_from('<I', self._mm, self._latency_index + position * 4)
+        latency, = struct.unpack_from('<f', self._mm, self._records + index * SNAPSHOT_RECORD.size + 8)
+        return index, latency
+    
+    def fastest(self, n: int) -> List[SnapshotRecord]:
+        return [self[self._latency_at(i)[0]] for i in range(min(n, self.latency_count))]
+    
+    def within_latency(self, max_ms: float) -> List[SnapshotRecord]:
+        """排序延迟不超过 max_ms 的记录（升序）"""
+        lo, hi = 0, self.latency_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._latency_at(mid)[1] <= max_ms:
+                lo = mid + 1
+            else:
+                hi = mid
+        return self.fastest(lo)
 
-# ============================================================
-# 导出器
-# ============================================================
 
 class Exporter:
-    """多格式导出器"""
+    """
+    多格式导出器
+    - 流式导出: 条目逐条转换并分块写出，all.json / all.ndjson / all.csv 共用一次遍历，
+      导出时的峰值内存不随条目数增长
+    - 二进制快照: all.bin 定长记录 + 字符串表 + 延迟索引，供下游 mmap 读取（见 SnapshotReader）
+    - 增量模式: 读取上次导出状态（state_path，默认 output_dir/.export_state.json），只重写内容变化的文件，
+      并按条目比较输出 delta/added.json、removed.json、changed.json
+    """
     
-    def __init__(self, output_dir: str = "output"):
+    STATE_FILE = ".export_state.json"
+    # 每次测量都会变化的字段，不参与条目变化判断
+    DELTA_VOLATILE_FIELDS = (
+        'latency_ms', 'handshake_ms', 'latency_min', 'latency_p50', 'latency_p90', 'jitter_ms', 'loss_rate'
+    )
+    CSV_FIELDS = [
+        'address', 'ip', 'port', 'is_valid', 'latency_ms',
+        'net_type', 'net_type_en', 'country', 'region', 'city', 'isp',
+        'location', 'source', 'category', 'validation_error',
+        'latency_min', 'latency_p50', 'latency_p90', 'jitter_ms', 'loss_rate'
+    ]
+    
+    def __init__(self, output_dir: str = "output", incremental: bool = True,
+                 compact_json: bool = False, ndjson: bool = True, snapshot: bool = True,
+                 state_path: Optional[str] = None):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
+        self.legacy_state_path = os.path.join(output_dir, self.STATE_FILE)
+        self.state_path = state_path or self.legacy_state_path
         self.timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        self.incremental = incremental
+        self.compact_json = compact_json
+        self.ndjson = ndjson
+        self.snapshot = snapshot
+        self._pending: List[IPEntry] = []
+        self._state = self._load_state() if incremental else {}
+        self._file_hashes: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+        self.changed_files: List[str] = []
+        self.unchanged_files: List[str] = []
     
-    def export_all(self, entries: List[IPEntry], stats: Dict[str, Any]):
-        """导出所有格式"""
-        data = [e.to_dict() for e in entries]
-        
+    def _load_state(self) -> Dict[str, Any]:
+        # 状态文件移出 output_dir 后的第一次运行仍读取旧位置
+        for path in (self.state_path, self.legacy_state_path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                continue
+        return {}
+    
+    @contextmanager
+    def _output(self, filepath: str, **open_kwargs):
+        """打开输出文件；增量模式下内容未变时不覆盖"""
+        previous = self._state.get('files', {}).get(filepath) if self.incremental else None
+        writer = ChangeDetectingWriter(filepath, self.timestamp, previous, **open_kwargs)
+        try:
+            yield writer
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+        self._file_hashes[filepath] = writer.digest
+        (self.changed_files if writer.changed else self.unchanged_files).append(filepath)
+    
+    def _write_file(self, filepath: str, content: str):
+        with self._output(filepath) as f:
+            f.write(content)
+    
+    def _write_lines(self, filepath: str, lines):
+        """逐行写出（等价于 '\\n'.join(lines + [""])）"""
+        with self._output(filepath) as f:
+            for line in lines:
+                f.write(line + "\n")
+    
+    def _entry_digest(self, item: Dict[str, Any]) -> str:
+        stable = {k: v for k, v in item.items() if k not in self.DELTA_VOLATILE_FIELDS}
+        return hashlib.sha1(json.dumps(stable, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:12]
+    
+    def _save_state(self):
+        state = {'files': self._file_hashes, 'entries': self._digests}
+        path = self.state_path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp, path)
+        if path != self.legacy_state_path and os.path.exists(self.legacy_state_path):
+            os.remove(self.legacy_state_path)
+    
+    def add(self, entry: IPEntry):
+        """接收流水线产出的条目"""
+        self._pending.append(entry)
+    
+    def finish(self, fetched: Optional[Dict[str, int]] = None) -> EntryStats:
+        """排序并导出所有已接收条目，返回导出统计"""
+        entries = sort_entries(self._pending)
+        self._pending = []
+        self.timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S UTC')
+        stats = EntryStats.collect(entries, fetched)
+        self.export_all(entries, stats)
+        return stats
+    
+    def export_all(self, entries: List[IPEntry], stats: Optional[EntryStats] = None):
+        """导出所有格式（stats 为空时在此统计）"""
+        if stats is None:
+            stats = EntryStats.collect(entries)
         self._export_txt(entries, stats)
-        self._export_json(data, stats)
-        self._export_csv(data)
+        self._export_records(entries, stats)
+        if self.snapshot:
+            self._export_snapshot(entries)
         self._export_valid_only(entries)
         self._export_summary(entries, stats)
         self._export_root_txt(entries)
         
-        logger.info(f"📁 Exported to {self.output_dir}/")
+        if self.incremental:
+            self._save_state()
+            logger.info(
+                f"📁 Exported to {self.output_dir}/ "
+                f"({len(self.changed_files)} written, {len(self.unchanged_files)} unchanged)"
+            )
+        else:
+            logger.info(f"📁 Exported to {self.output_dir}/")
     
-    def _export_txt(self, entries: List[IPEntry], stats: Dict):
+    def _export_txt(self, entries: List[IPEntry], stats: EntryStats):
         """导出详细 TXT"""
         filepath = os.path.join(self.output_dir, "all.txt")
         
-        valid_count = sum(1 for e in entries if e.is_valid is True)
-        untested = sum(1 for e in entries if e.is_valid is None)
-        
-        lines = [
+        header = [
             "# " + "=" * 70,
             "# Aggregated IP/Proxy Addresses",
             f"# Generated: {self.timestamp}",
-            f"# Total: {len(entries)} | Valid: {valid_count} | Untested: {untested}",
+            f"# Total: {stats.total} | Valid: {stats.valid} | Untested: {stats.untested}",
             "# " + "=" * 70,
             "# Format: ADDRESS | STATUS | LATENCY | TYPE | LOCATION | ISP",
             "# " + "=" * 70,
             ""
         ]
         
-        for e in entries:
-            if e.is_valid is True:
-                status = "✓"
-            elif e.is_valid is False:
-                status = "✗"
-            else:
-                status = "?"
-            
-            latency = f"{e.latency_ms:.0f}ms" if e.latency_ms else "-"
-            net_type = e.net_type or "-"
-            location = e.location or "-"
-            isp = e.isp[:25] if e.isp else "-"
-            
-            lines.append(f"{e.address:<22} | {status} | {latency:<7} | {net_type:<4} | {location:<15} | {isp}")
-        
-        lines.append("")
+        def rows():
+            yield from header
+            for e in entries:
+                if e.is_valid is True:
+                    status = "✓"
+                elif e.is_valid is False:
+                    status = "✗"
+                else:
+                    status = "?"
+                
+                latency = f"{e.latency_ms:.0f}ms" if e.latency_ms else "-"
+                net_type = e.net_type or "-"
+                location = e.location or "-"
+                isp = e.isp[:25] if e.isp else "-"
+                
+                yield f"{e.address:<22} | {status} | {latency:<7} | {net_type:<4} | {location:<15} | {isp}"
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        self._write_lines(filepath, rows())
     
-    def _export_json(self, data: List[Dict], stats: Dict):
-        """导出 JSON"""
-        filepath = os.path.join(self.output_dir, "all.json")
-        
-        by_country = {}
-        by_net_type = {"datacenter": 0, "residential": 0, "unknown": 0}
-        by_source = {}
-        by_category = {}
-        
-        for item in data:
-            country = item.get('country') or 'Unknown'
-            by_country[country] = by_country.get(country, 0) + 1
-            
-            net_type = item.get('net_type_en', 'unknown')
-            by_net_type[net_type] = by_net_type.get(net_type, 0) + 1
-            
-            source = item.get('source', 'unknown')
-            by_source[source] = by_source.get(source, 0) + 1
-            
-            cat = item.get('category', 'unknown')
-            by_category[cat] = by_category.get(cat, 0) + 1
-        
-        latencies = [d['latency_ms'] for d in data if d.get('latency_ms')]
-        latency_stats = {}
-        if latencies:
-            latencies.sort()
-            latency_stats = {
-                "min": min(latencies),
-                "max": max(latencies),
-                "avg": round(sum(latencies) / len(latencies), 2),
-                "median": latencies[len(latencies) // 2]
-            }
-        
-        output = {
+    def _json_header(self, stats: EntryStats) -> Dict[str, Any]:
+        """all.json 的 metadata / statistics 部分"""
+        return {
             "metadata": {
                 "generated_at": self.timestamp,
-                "total_count": len(data),
-                "valid_count": sum(1 for d in data if d.get('is_valid') is True),
-                "invalid_count": sum(1 for d in data if d.get('is_valid') is False),
-                "untested_count": sum(1 for d in data if d.get('is_valid') is None),
+                "total_count": stats.total,
+                "valid_count": stats.valid,
+                "invalid_count": stats.invalid,
+                "untested_count": stats.untested,
                 "validated": not SKIP_VALIDATION
             },
             "statistics": {
-                "by_country": dict(sorted(by_country.items(), key=lambda x: x[1], reverse=True)),
-                "by_net_type": by_net_type,
-                "by_source": by_source,
-                "by_category": by_category,
-                "latency": latency_stats
+                "by_country": dict(sorted(stats.by_country.items(), key=lambda x: x[1], reverse=True)),
+                "by_net_type": stats.by_net_type,
+                "by_source": stats.by_source,
+                "by_category": stats.by_category,
+                "latency": stats.latency_summary()
             },
-            "data": data
+            "data": []
         }
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(output, f, indent=2, ensure_ascii=False)
     
-    def _export_csv(self, data: List[Dict]):
-        """导出 CSV"""
-        filepath = os.path.join(self.output_dir, "all.csv")
+    def _export_records(self, entries: List[IPEntry], stats: EntryStats):
+        """
+        一次遍历流式导出 all.json / all.ndjson / all.csv（以及增量模式下的 delta 文件）
+        每条记录的 dict 用完即弃，不整体物化
+        """
+        indent = None if self.compact_json else 2
+        if indent is None:
+            header = json.dumps(self._json_header(stats), ensure_ascii=False, separators=(',', ':'))
+        else:
+            header = json.dumps(self._json_header(stats), indent=indent, ensure_ascii=False)
+        # "data" 是最后一个键，在其空数组占位处切开，中间流式写入记录
+        head, tail = header.rsplit('[]', 1)
         
-        if not data:
-            return
+        previous = self._state.get('entries') if self.incremental else None
+        delta_dir = os.path.join(self.output_dir, "delta")
         
-        fieldnames = [
-            'address', 'ip', 'port', 'is_valid', 'latency_ms',
-            'net_type', 'net_type_en', 'country', 'region', 'city', 'isp',
-            'location', 'source', 'category', 'validation_error'
-        ]
+        with ExitStack() as stack:
+            json_out = stack.enter_context(self._output(os.path.join(self.output_dir, "all.json")))
+            json_out.write(head)
+            records = JSONArrayWriter(json_out, indent, level=1)
+            
+            ndjson_out = None
+            if self.ndjson:
+                ndjson_out = stack.enter_context(self._output(os.path.join(self.output_dir, "all.ndjson")))
+            
+            csv_writer = None
+            if entries:
+                csv_out = stack.enter_context(self._output(os.path.join(self.output_dir, "all.csv"), newline=''))
+                csv_writer = csv.DictWriter(csv_out, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+                csv_writer.writeheader()
+            
+            added = changed = None
+            if previous is not None:
+                os.makedirs(delta_dir, exist_ok=True)
+                added = JSONArrayWriter(stack.enter_context(self._output(os.path.join(delta_dir, "added.json"))))
+                changed = JSONArrayWriter(stack.enter_context(self._output(os.path.join(delta_dir, "changed.json"))))
+            
+            digests = {}
+            for e in entries:
+                item = e.to_dict()
+                records.write(item)
+                if ndjson_out is not None:
+                    ndjson_out.write(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + "\n")
+                if csv_writer is not None:
+                    csv_writer.writerow(item)
+                if self.incremental:
+                    address = item['address']
+                    digest = digests[address] = self._entry_digest(item)
+                    if previous is not None:
+                        old = previous.get(address)
+                        if old is None:
+                            added.write(item)
+                        elif old != digest:
+                            changed.write(item)
+            
+            records.close()
+            json_out.write(tail)
+            if previous is not None:
+                added.close()
+                added.out.write("\n")
+                changed.close()
+                changed.out.write("\n")
+        
+        self._digests = digests
+        if previous is None:
+            if self.incremental:
+                logger.info("   Δ No previous export state, delta files skipped")
+            return
         
-        with open(filepath, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
-            writer.writeheader()
-            writer.writerows(data)
+        removed = [address for address in previous if address not in digests]
+        self._write_file(
+            os.path.join(delta_dir, "removed.json"),
+            json.dumps(removed, separators=(',', ':')) + "\n"
+        )
+        logger.info(f"   Δ Delta: +{added.count} / -{len(removed)} / ~{changed.count}")
+    
+    def _export_snapshot(self, entries: List[IPEntry]):
+        """导出二进制快照 all.bin"""
+        filepath = os.path.join(self.output_dir, "all.bin")
+        with self._output(filepath, binary=True) as f:
+            size = write_snapshot(f, entries)
+        logger.info(f"   📦 all.bin: {len(entries)} records, {size:,} bytes")
     
     def _export_valid_only(self, entries: List[IPEntry]):
         """
@@ -695,10 +3864,10 @@ class Exporter:
             # 仅输出验证通过的
             valid = [e for e in entries if e.is_valid is True]
         
-        # 按延迟排序（有延迟的在前）
-        valid_sorted = sorted(valid, key=lambda x: (x.latency_ms is None, x.latency_ms or 9999))
+        # 按延迟排序（有延迟的在前；有多次采样时按 rank_latency）
+        valid_sorted = sorted(valid, key=lambda x: (x.rank_latency is None, x.rank_latency or 9999))
         
-        lines = [
+        header = [
             f"# ========================================",
             f"# Valid IP Addresses",
             f"# Generated: {self.timestamp}",
@@ -709,64 +3878,46 @@ class Exporter:
             ""
         ]
         
-        for e in valid_sorted:
-            # 格式: IP:PORT  # latency | location | isp
-            comment_parts = []
-            if e.latency_ms:
-                comment_parts.append(f"{e.latency_ms:.0f}ms")
-            if e.net_type:
-                comment_parts.append(e.net_type)
-            if e.location:
-                comment_parts.append(e.location)
-            if e.isp:
-                comment_parts.append(e.isp[:20])
-            
-            if comment_parts:
-                lines.append(f"{e.address}  # {' | '.join(comment_parts)}")
-            else:
-                lines.append(e.address)
-        
-        lines.append("")
+        def rows():
+            yield from header
+            for e in valid_sorted:
+                # 格式: IP:PORT  # latency | location | isp
+                comment_parts = []
+                if e.latency_p50 is not None:
+                    comment_parts.append(f"p50 {e.latency_p50:.0f}ms ±{e.jitter_ms:.0f}")
+                    if e.loss_rate:
+                        comment_parts.append(f"loss {e.loss_rate:.0%}")
+                elif e.latency_ms:
+                    comment_parts.append(f"{e.latency_ms:.0f}ms")
+                if e.net_type:
+                    comment_parts.append(e.net_type)
+                if e.location:
+                    comment_parts.append(e.location)
+                if e.isp:
+                    comment_parts.append(e.isp[:20])
+                
+                if comment_parts:
+                    yield f"{e.address}  # {' | '.join(comment_parts)}"
+                else:
+                    yield e.address
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        self._write_lines(filepath, rows())
         
         logger.info(f"   📄 valid_only.txt: {len(valid_sorted)} entries")
     
-    def _export_summary(self, entries: List[IPEntry], stats: Dict):
+    def _export_summary(self, entries: List[IPEntry], stats: EntryStats):
         """导出 Markdown 摘要"""
         filepath = os.path.join(self.output_dir, "summary.md")
         
-        total = len(entries)
-        valid = sum(1 for e in entries if e.is_valid is True)
-        invalid = sum(1 for e in entries if e.is_valid is False)
-        untested = sum(1 for e in entries if e.is_valid is None)
-        
-        # 按来源统计
-        source_counts = {}
-        for e in entries:
-            source_counts[e.source] = source_counts.get(e.source, 0) + 1
-        
-        # 国家统计
-        country_counts = {}
-        for e in entries:
-            c = e.country or 'Unknown'
-            country_counts[c] = country_counts.get(c, 0) + 1
-        top_countries = sorted(country_counts.items(), key=lambda x: x[1], reverse=True)[:15]
-        
-        # 网络类型统计
-        net_counts = {"机房": 0, "家宽": 0, "未知": 0}
-        for e in entries:
-            if e.net_type == "机房":
-                net_counts["机房"] += 1
-            elif e.net_type == "家宽":
-                net_counts["家宽"] += 1
-            else:
-                net_counts["未知"] += 1
-        
-        # 最快 IP
-        valid_with_latency = [e for e in entries if e.is_valid and e.latency_ms]
-        fastest = sorted(valid_with_latency, key=lambda x: x.latency_ms)[:20]
+        total = stats.total
+        valid, invalid, untested = stats.valid, stats.invalid, stats.untested
+        top_countries = stats.top_countries(15)
+        net_counts = {
+            "机房": stats.by_net_type["datacenter"],
+            "家宽": stats.by_net_type["residential"],
+            "未知": stats.by_net_type["unknown"]
+        }
+        fastest = stats.fastest
         
         md = f"""# 📊 IP Aggregation Report
 
@@ -786,8 +3937,8 @@ class Exporter:
 | Source | Count | Type |
 |--------|-------|------|
 """
-        for name, count in sorted(source_counts.items(), key=lambda x: x[1], reverse=True):
-            src_type = "🌐 Remote" if any(s['name'] == name for s in REMOTE_SOURCES) else "📂 Local"
+        for name, count in sorted(stats.by_source.items(), key=lambda x: x[1], reverse=True):
+            src_type = "🌐 Remote" if name in REMOTE_SOURCE_NAMES else "📂 Local"
             md += f"| {name} | {count} | {src_type} |\n"
         
         md += f"""
@@ -818,7 +3969,22 @@ class Exporter:
             net = e.net_type or "-"
             loc = e.location or "-"
             isp = (e.isp[:20] + "...") if e.isp and len(e.isp) > 20 else (e.isp or "-")
-            md += f"| {i} | `{e.address}` | {e.latency_ms:.0f}ms | {net} | {loc} | {isp} |\n"
+            md += f"| {i} | `{e.address}` | {e.rank_latency:.0f}ms | {net} | {loc} | {isp} |\n"
+        
+        latency = stats.latency_summary()
+        if latency:
+            md += f"""
+## ⏱️ Latency Distribution
+
+| min | median | p90 | p95 | p99 | max |
+|-----|--------|-----|-----|-----|-----|
+| {latency['min']:.0f}ms | {latency['median']:.0f}ms | {latency['p90']:.0f}ms | {latency['p95']:.0f}ms | {latency['p99']:.0f}ms | {latency['max']:.0f}ms |
+
+| Range (ms) | Count |
+|------------|-------|
+"""
+            for label, count in latency['histogram_ms'].items():
+                md += f"| {label} | {count} |\n"
         
         md += """
 ---
@@ -829,7 +3995,12 @@ class Exporter:
 |------|-------------|
 | `all.txt` | All entries with details |
 | `all.json` | Full data in JSON format |
-| `all.csv` | Spreadsheet format |
+"""
+        if self.ndjson:
+            md += "| `all.ndjson` | One JSON record per line (streaming consumers) |\n"
+        if self.snapshot:
+            md += "| `all.bin` | Binary snapshot (fixed-width records, mmap-able) |\n"
+        md += """| `all.csv` | Spreadsheet format |
 | `valid_only.txt` | Only valid IPs (fastest first) |
 | `summary.md` | This report |
 
@@ -837,23 +4008,698 @@ class Exporter:
 *Auto-generated by IP Aggregation System v5.0*
 """
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(md)
+        self._write_file(filepath, md)
     
     def _export_root_txt(self, entries: List[IPEntry]):
         """根目录简洁格式"""
         filepath = "all.txt"
         
-        lines = [
+        header = [
             f"# Aggregated IPs - {self.timestamp}",
             f"# Total: {len(entries)}",
             ""
         ]
-        lines.extend([e.address for e in entries])
-        lines.append("")
         
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        def rows():
+            yield from header
+            for e in entries:
+                yield e.address
+        
+        self._write_lines(filepath, rows())
+
+
+# ============================================================
+# 查询服务
+# ============================================================
+
+# 英文网络类型 → 内部取值
+NET_TYPE_ALIASES = {"datacenter": "机房", "residential": "家宽", "unknown": ""}
+
+
+class QueryIndex:
+    """
+    只读查询数据集（构建后不再修改，换新数据集即整体替换引用）
+    - 条目按 有效且有延迟（延迟升序）→ 有效无延迟 → 未验证 → 无效 排列，位置即排名
+    - 各维度倒排表: 取值 → 升序位置数组；延迟索引为前段有效条目的延迟数组，max_latency 二分得到截止位置
+    - 过滤时以最短的倒排表驱动，其余条件逐条检查，取前 N 条即可停止，无需扫描全集
+    - 随机抽样在单一维度的倒排表上直接按下标抽取，多维度时蓄水池抽样，不复制候选集
+    - 条目 JSON 按需序列化并缓存；确定性查询的响应按查询串缓存（随数据集一起替换）
+    """
+    
+    FIELDS: Dict[str, Callable[[IPEntry], str]] = {
+        'country': attrgetter('country'),
+        'net_type': attrgetter('net_type'),
+        'category': attrgetter('category'),
+        'source': attrgetter('source'),
+        'protocol': attrgetter('protocol'),
+        'port': lambda entry: str(entry.port or ''),
+        'valid': lambda entry: {True: 'true', False: 'false'}.get(entry.is_valid, 'unknown'),
+    }
+    RESPONSE_CACHE_SIZE = 256
+    
+    def __init__(self, entries: List[IPEntry], generated: Optional[datetime] = None):
+        def order(entry: IPEntry):
+            latency = entry.rank_latency
+            if entry.is_valid:
+                return (0, latency, entry.key) if latency is not None else (1, 0, entry.key)
+            return (2 if entry.is_valid is None else 3, 0, entry.key)
+        
+        self.entries = sorted(entries, key=order)
+        self.generated = generated or datetime.now(timezone.utc)
+        self.indexes: Dict[str, Dict[str, array.array]] = {field: {} for field in self.FIELDS}
+        for position, entry in enumerate(self.entries):
+            for field, value_of in self.FIELDS.items():
+                postings = self.indexes[field].get(value_of(entry))
+                if postings is None:
+                    postings = self.indexes[field][value_of(entry)] = array.array('I')
+                postings.append(position)
+        
+        self.latencies = array.array('d')
+        for entry in self.entries:
+            if not entry.is_valid or entry.rank_latency is None:
+                break
+            self.latencies.append(entry.rank_latency)
+        
+        self._records: List[Optional[str]] = [None] * len(self.entries)
+        self._responses: collections.OrderedDict = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = json.dumps({
+            "total": len(self.entries),
+            "valid": len(self.indexes['valid'].get('true', ())),
+            "facets": {
+                field: {value: len(postings) for value, postings in sorted(index.items())}
+                for field, index in self.indexes.items()
+            }
+        }, ensure_ascii=False).encode('utf-8')
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def record(self, position: int) -> str:
+        record = self._records[position]
+        if record is None:
+            record = self._records[position] = json.dumps(
+                self.entries[position].to_dict(), ensure_ascii=False, separators=(',', ':')
+            )
+        return record
+    
+    def _plan(self, filters: Dict[str, List[str]], max_latency: Optional[float]) -> Optional[tuple]:
+        """
+        过滤计划 (截止位置, 驱动倒排表列表, 其余条件)；无过滤条件时驱动为 None（全集）
+        某维度的取值均不存在时返回 None
+        """
+        end = len(self.entries) if max_latency is None else bisect.bisect_right(self.latencies, max_latency)
+        postings = []
+        for field, values in filters.items():
+            index = self.indexes[field]
+            lists = [index[value] for value in values if value in index]
+            if not lists:
+                return None
+            postings.append((sum(map(len, lists)), field, lists))
+        if not postings:
+            return end, None, []
+        
+        postings.sort(key=lambda item: item[0])
+        checks = [(self.FIELDS[field], set(filters[field])) for _, field, _ in postings[1:]]
+        return end, postings[0][2], checks
+    
+    def select(self, filters: Dict[str, List[str]], max_latency: Optional[float] = None) -> Iterator[int]:
+        """按排名顺序产出满足全部条件的位置（同一维度多个取值为或）"""
+        plan = self._plan(filters, max_latency)
+        if plan is None:
+            return
+        end, lists, checks = plan
+        if lists is None:
+            yield from range(end)
+            return
+        
+        driver = lists[0] if len(lists) == 1 else heapq.merge(*lists)
+        entries = self.entries
+        for position in driver:
+            if position >= end:
+                return
+            entry = entries[position]
+            if all(value_of(entry) in allowed for value_of, allowed in checks):
+                yield position
+    
+    def sample(self, filters: Dict[str, List[str]], max_latency: Optional[float], k: int) -> List[int]:
+        """
+        随机抽取至多 k 个满足条件的位置
+        - 只有一个维度的条件时，在其倒排表（升序，按截止位置二分截断）上直接按下标抽样，不遍历候选
+        - 多个维度时对 select() 的候选流做蓄水池抽样，只保留 k 个位置
+        """
+        plan = self._plan(filters, max_latency)
+        if plan is None or k <= 0:
+            return []
+        end, lists, checks = plan
+        if lists is None:
+            return random.sample(range(end), min(k, end))
+        if not checks:
+            # 同一维度的不同取值倒排表互不相交，按截断后的长度拼接成一个下标空间
+            cuts = [bisect.bisect_left(postings, end) for postings in lists]
+            positions = []
+            for pick in random.sample(range(sum(cuts)), min(k, sum(cuts))):
+                for postings, cut in zip(lists, cuts):
+                    if pick < cut:
+                        positions.append(postings[pick])
+                        break
+                    pick -= cut
+            return positions
+        
+        reservoir: List[int] = []
+        for seen, position in enumerate(self.select(filters, max_latency)):
+            if seen < k:
+                reservoir.append(position)
+            else:
+                slot = random.randrange(seen + 1)
+                if slot < k:
+                    reservoir[slot] = position
+        random.shuffle(reservoir)
+        return reservoir
+    
+    def cached(self, key: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            response = self._responses.get(key)
+            if response is not None:
+                self._responses.move_to_end(key)
+            return response
+    
+    def remember(self, key: str, response: Tuple[bytes, str]):
+        with self._lock:
+            self._responses[key] = response
+            while len(self._responses) > self.RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+
+
+class QueryError(ValueError):
+    """查询参数错误（HTTP 400）"""
+
+
+class QueryServer:
+    """
+    内置 HTTP 查询服务（标准库 ThreadingHTTPServer，后台线程运行）
+    - GET /entries?country=&net_type=&category=&source=&protocol=&port=&valid=&max_latency=&limit=&offset=&order=&format=
+      同一参数可重复或逗号分隔表示多个取值；order=latency（默认，最快在前）/ random（随机抽样）；
+      format=json（默认）/ txt（每行一个地址）
+    - GET /stats: 总数、有效数及各维度取值计数
+    - 确定性查询返回 ETag（响应体哈希），If-None-Match 命中时返回 304；随机查询不缓存
+    - swap() 整体替换数据集引用，进行中的请求继续使用旧数据集
+    """
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 8080, max_limit: int = 1000):
+        self.max_limit = max_limit
+        self.dataset: Optional[QueryIndex] = None
+        self.httpd = ThreadingHTTPServer((host, port), _QueryHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.query_server = self
+        self.address = self.httpd.server_address
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='query-server', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+        logger.info(f"🌐 Query API listening on http://{self.address[0]}:{self.address[1]}/")
+    
+    def swap(self, dataset: QueryIndex):
+        self.dataset = dataset
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def query(self, dataset: QueryIndex, params: Dict[str, List[str]]) -> Tuple[bytes, str, bool]:
+        """执行 /entries 查询，返回 (响应体, Content-Type, 是否确定性)"""
+        filters: Dict[str, List[str]] = {}
+        max_latency = None
+        limit, offset, order, fmt = 100, 0, 'latency', 'json'
+        try:
+            for name, raw in params.items():
+                values = [v.strip() for item in raw for v in item.split(',')]
+                if name in QueryIndex.FIELDS:
+                    if name == 'net_type':
+                        values = [NET_TYPE_ALIASES.get(v.lower(), v) for v in values]
+                    elif name == 'valid':
+                        values = [v.lower() for v in values]
+                    filters[name] = values
+                elif name == 'max_latency':
+                    max_latency = float(values[-1])
+                elif name == 'limit':
+                    limit = min(int(values[-1]), self.max_limit)
+                elif name == 'offset':
+                    offset = max(int(values[-1]), 0)
+                elif name == 'order' and values[-1] in ('latency', 'random'):
+                    order = values[-1]
+                elif name == 'format' and values[-1] in ('json', 'txt'):
+                    fmt = values[-1]
+                else:
+                    raise QueryError(f"unsupported parameter: {name}={','.join(values)}")
+        except ValueError as e:
+            raise QueryError(str(e)) from e
+        limit = max(limit, 0)
+        
+        if order == 'random':
+            positions = dataset.sample(filters, max_latency, limit)
+        else:
+            positions = list(itertools.islice(dataset.select(filters, max_latency), offset, offset + limit))
+        
+        if fmt == 'txt':
+            body = ''.join(dataset.entries[p].address + '\n' for p in positions)
+            return body.encode('utf-8'), 'text/plain; charset=utf-8', order != 'random'
+        body = '{"count":%d,"entries":[%s]}' % (len(positions), ','.join(dataset.record(p) for p in positions))
+        return body.encode('utf-8'), 'application/json; charset=utf-8', order != 'random'
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    server_version = "ipagg"
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        logger.debug("API %s - %s", self.address_string(), format % args)
+    
+    def _send(self, status: int, body: bytes, content_type: str, headers: Dict[str, str]):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    def _error(self, status: int, message: str):
+        body = json.dumps({"error": message}).encode('utf-8')
+        self._send(status, body, 'application/json; charset=utf-8', {'Cache-Control': 'no-store'})
+    
+    def do_GET(self):
+        server: QueryServer = self.server.query_server
+        dataset = server.dataset   # 一次取引用，本请求内数据集不变
+        if dataset is None:
+            return self._error(503, "dataset not ready")
+        
+        url = urlparse(self.path)
+        if url.path not in ('/entries', '/stats'):
+            return self._error(404, f"not found: {url.path}")
+        cache_key = f"{url.path}?{url.query}"
+        response = dataset.cached(cache_key)
+        if response is None:
+            if url.path == '/stats':
+                body, content_type, deterministic = dataset.stats, 'application/json; charset=utf-8', True
+            else:
+                try:
+                    body, content_type, deterministic = server.query(dataset, parse_qs(url.query))
+                except QueryError as e:
+                    return self._error(400, str(e))
+            if not deterministic:
+                return self._send(200, body, content_type, {'Cache-Control': 'no-store'})
+            response = (body, content_type, '"%s"' % hashlib.blake2b(body, digest_size=12).hexdigest())
+            dataset.remember(cache_key, response)
+        
+        body, content_type, etag = response
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(dataset.generated.timestamp(), usegmt=True),
+            'Cache-Control': 'no-cache',
+        }
+        if etag in (tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')):
+            return self._send(304, b'', content_type, headers)
+        self._send(200, body, content_type, headers)
+    
+    do_HEAD = do_GET
+
+
+# ============================================================
+# 常驻模式
+# ============================================================
+
+class ProbeSchedule:
+    """
+    探测计划: 按到期时间排序的小顶堆
+    - 每个 key 只有最近一次 push 的到期时间有效，过期堆项在出堆时跳过（延迟删除）
+    - 失效堆项过多时重建堆
+    """
+    
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+    
+    def __len__(self) -> int:
+        return len(self._due)
+    
+    def push(self, key: int, due: float):
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._heap = [(when, k) for k, when in self._due.items()]
+            heapq.heapify(self._heap)
+    
+    def discard(self, key: int):
+        self._due.pop(key, None)
+    
+    def _skip_stale(self):
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+    
+    def next_due(self) -> Optional[float]:
+        self._skip_stale()
+        return self._heap[0][0] if self._heap else None
+    
+    def pop_due(self, now: float, limit: int) -> List[int]:
+        """按到期顺序取出最多 limit 个已到期的 key"""
+        keys = []
+        while len(keys) < limit:
+            self._skip_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            _, key = heapq.heappop(self._heap)
+            del self._due[key]
+            keys.append(key)
+        return keys
+
+
+class Daemon:
+    """
+    常驻模式: 条目集合常驻内存，持续刷新数据源、按优先级重新探测，有效集合变化时重新发布
+    - 每个数据源按自己的周期（refresh 字段，默认 DAEMON_SOURCE_INTERVAL）重新采集；
+      远程源走 HTTP 缓存的条件请求，本地文件仅在 mtime 变化时重新读取
+    - 地址不再被任何数据源列出时移出集合；远程源采集失败或为空时保留其上一轮的地址
+    - 重新探测间隔: 有效且快的端点最短，其余有效端点次之，失败端点按连续失败次数指数退避至 dead_interval，
+      均带 ±10% 抖动；到期条目按到期顺序送入 FairScheduler，令牌桶限制每秒探测数，探测负载平滑
+    - 每个端点保留最近 history 次探测结果，计算 p50 / 抖动 / 丢包率
+    - 变化达到阈值时在线程中导出条目副本（导出文件均为临时文件 + 原子替换），探测不受影响
+    - server 存在时用同一份副本构建 QueryIndex 并替换查询服务的数据集
+    """
+    
+    def __init__(
+        self,
+        output_dir: str,
+        validate: bool = True,
+        timeout: float = 3.0,
+        concurrency: int = 100,
+        cache: Optional[HTTPCache] = None,
+        probe_store: Optional[ProbeStore] = None,
+        adaptive: Optional[AdaptiveTimeout] = None,
+        scheduler: Optional[FairScheduler] = None,
+        metrics: Optional[Metrics] = None,
+        server: Optional[QueryServer] = None,
+        metrics_dir: Optional[str] = None
+    ):
+        self.output_dir = output_dir
+        self.validate = validate
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.cache = cache
+        self.probe_store = probe_store
+        self.adaptive = adaptive
+        self.queue = scheduler or FairScheduler()
+        self.metrics = metrics
+        self.metrics_dir = metrics_dir or output_dir
+        self.server = server
+        
+        self.fast_ms = DAEMON_FAST_MS
+        self.fast_interval = DAEMON_PROBE_FAST_INTERVAL
+        self.valid_interval = DAEMON_PROBE_VALID_INTERVAL
+        self.fail_interval = DAEMON_PROBE_FAIL_INTERVAL
+        self.dead_interval = DAEMON_PROBE_DEAD_INTERVAL
+        self.history = max(1, DAEMON_HISTORY)
+        self.publish_min_changes = DAEMON_PUBLISH_MIN_CHANGES
+        self.publish_change_ratio = DAEMON_PUBLISH_CHANGE_RATIO
+        self.publish_min_interval = DAEMON_PUBLISH_MIN_INTERVAL
+        self.publish_max_interval = DAEMON_PUBLISH_MAX_INTERVAL
+        
+        self.index = DedupIndex()
+        self.schedule = ProbeSchedule()
+        self.source_stats: Dict[str, int] = {}
+        self._source_keys: Dict[str, Set[int]] = {}      # 来源 → 上一轮列出的地址 key
+        self._owners: Dict[int, int] = {}                # 地址 key → 列出它的来源数
+        self._fails: Dict[int, int] = {}                 # 地址 key → 连续失败次数
+        self._samples: Dict[int, collections.deque] = {}
+        self._probing: Dict[int, int] = {}               # id(条目) → 地址 key（无端口条目探测后 key 会变）
+        self._wakeup: Optional[asyncio.Event] = None
+        
+        self.started = time.time()
+        self.last_publish = self.started
+        self.changes = 0      # 自上次发布以来有效集合的变化数
+        self.dirty = False    # 自上次发布以来有任何变化（成员 / 探测结果）
+        self.probes = 0       # 自上次发布以来的探测数
+    
+    # ----- 数据源 -----
+    
+    def ingest(self, rank: int, name: str, entries: List[IPEntry]):
+        """并入一个来源的本轮结果，移除该来源不再列出且其他来源也未列出的地址"""
+        keys: Set[int] = set()
+        for entry in entries:
+            key = entry.key
+            keys.add(key)
+            if self.index.add(entry, rank) is not None:
+                self._admit(key, entry)
+        
+        previous = self._source_keys.get(name, set())
+        for key in keys - previous:
+            self._owners[key] = self._owners.get(key, 0) + 1
+        for key in previous - keys:
+            remaining = self._owners[key] - 1
+            if remaining:
+                self._owners[key] = remaining
+            else:
+                del self._owners[key]
+                self._drop(key)
+        self._source_keys[name] = keys
+        
+        self.source_stats[name] = len(entries)
+        if self.metrics is not None:
+            self.metrics.raw_entries = sum(self.source_stats.values())
+            self.metrics.unique_entries = len(self.index)
+    
+    def _admit(self, key: int, entry: IPEntry):
+        self.dirty = True
+        if not self.validate:
+            self.changes += 1
+            return
+        now = time.time()
+        if self.probe_store is not None and self.probe_store.apply_recent(entry, now):
+            if entry.is_valid:
+                self.changes += 1
+            else:
+                self._fails[key] = 1
+            # 复用结果的年龄未知，在一个周期内随机安排，避免同时到期
+            self.schedule.push(key, now + self._interval(key, entry) * random.random())
+        else:
+            self.schedule.push(key, now)
+        self._wakeup.set()
+    
+    def _drop(self, key: int):
+        entry = self.index.discard(key)
+        self.schedule.discard(key)
+        self._fails.pop(key, None)
+        self._samples.pop(key, None)
+        self.dirty = True
+        if entry is not None and (entry.is_valid or not self.validate):
+            self.changes += 1
+    
+    def _source_metrics(self, name: str) -> Optional[SourceMetrics]:
+        return self.metrics.source(name) if self.metrics is not None else None
+    
+    async def _refresh_source(self, rank: int, source: Dict, session, local: bool):
+        """按周期重新采集一个数据源"""
+        name = source['name']
+        interval = source.get('refresh', DAEMON_SOURCE_INTERVAL)
+        mtime: Optional[float] = -1.0   # 首轮必定读取
+        while True:
+            entries = None
+            try:
+                if local:
+                    path = SCRIPT_DIR / source['file']
+                    current = path.stat().st_mtime if path.exists() else None
+                    if current != mtime:
+                        mtime = current
+                        entries = await asyncio.to_thread(process_local_source, source, self._source_metrics(name))
+                elif session is not None:
+                    entries = await process_remote_source_async(session, source, self.cache, self._source_metrics(name))
+                else:
+                    entries = await asyncio.to_thread(process_remote_source, source, self.cache, self._source_metrics(name))
+            except Exception as e:
+                logger.error(f"   ❌ Error: {name}: {e}")
+                if self.metrics is not None:
+                    self.metrics.source(name).status = "error"
+            # 本地文件删除或清空即表示不再列出；远程源为空多为采集失败，保留上一轮
+            if entries or (local and entries is not None):
+                self.ingest(rank, name, entries)
+            await asyncio.sleep(interval * random.uniform(0.9, 1.1))
+    
+    # ----- 探测 -----
+    
+    def _interval(self, key: int, entry: IPEntry) -> float:
+        """下次探测前的间隔（秒）"""
+        if entry.is_valid:
+            latency = entry.rank_latency
+            fast = latency is not None and latency <= self.fast_ms
+            base = self.fast_interval if fast else self.valid_interval
+        else:
+            streak = self._fails.get(key, 1)
+            base = min(self.fail_interval * 2 ** min(max(streak - 1, 0), 32), self.dead_interval)
+        return base * random.uniform(0.9, 1.1)
+    
+    async def _dispatch(self):
+        """到期条目送入验证队列；待探测数保持在并发数以内，使出队顺序贴近到期顺序"""
+        while True:
+            room = self.concurrency - self.queue.qsize()
+            if room > 0:
+                for key in self.schedule.pop_due(time.time(), room):
+                    entry = self.index.get(key)
+                    if entry is None:
+                        continue
+                    self._probing[id(entry)] = key
+                    self.queue.put_nowait(entry)
+            next_due = self.schedule.next_due()
+            if room <= 0 or next_due is None:
+                delay = 1.0
+            else:
+                delay = min(max(next_due - time.time(), 0.01), 1.0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def _consume(self):
+        while True:
+            entry = await self.queue.get()
+            key = self._probing.pop(id(entry))
+            before = (entry.is_valid, entry.latency_ms, entry.validation_error)
+            retry = False
+            try:
+                await self.queue.throttle()
+                timeout = self.adaptive.timeout_for(entry) if self.adaptive is not None else self.timeout
+                await validate_entry(entry, timeout)
+                retry = is_local_resource_error(entry.validation_error)
+            except Exception as e:
+                logger.debug(f"Validation error {entry.address}: {e}")
+                retry = True
+            finally:
+                self.queue.task_done(entry)
+                self._wakeup.set()
+            
+            if self.index.get(key) is not entry:
+                continue  # 探测期间已移出集合
+            if retry:
+                # 本机资源不足不算端点失败，恢复原结果稍后重试
+                entry.is_valid, entry.latency_ms, entry.validation_error = before
+                self.schedule.push(key, time.time() + 30 * random.uniform(0.5, 1.5))
+            else:
+                self._probed(key, entry, before[0])
+    
+    def _probed(self, key: int, entry: IPEntry, was_valid: Optional[bool]):
+        now = time.time()
+        self.probes += 1
+        self.dirty = True
+        if self.metrics is not None:
+            self.metrics.observe_probe(entry)
+        if self.adaptive is not None:
+            self.adaptive.observe(entry)
+        if self.probe_store is not None:
+            self.probe_store.record(key, entry, now)
+        
+        if entry.is_valid:
+            self._fails.pop(key, None)
+        else:
+            self._fails[key] = self._fails.get(key, 0) + 1
+        if entry.port:
+            samples = self._samples.get(key)
+            if samples is None:
+                samples = self._samples[key] = collections.deque(maxlen=self.history)
+            samples.append(entry.latency_ms if entry.is_valid else None)
+            if len(samples) >= 3:
+                entry.set_latency_samples(list(samples))
+        if bool(entry.is_valid) != bool(was_valid):
+            self.changes += 1
+        
+        self.schedule.push(key, now + self._interval(key, entry))
+    
+    # ----- 发布 -----
+    
+    def should_publish(self, now: float) -> bool:
+        since = now - self.last_publish
+        if not self.dirty or since < self.publish_min_interval:
+            return False
+        if since >= self.publish_max_interval:
+            return True
+        valid = sum(1 for entry in self.index.entries() if entry.is_valid) if self.validate else len(self.index)
+        return self.changes >= max(self.publish_min_changes, self.publish_change_ratio * valid)
+    
+    def _export(self, entries: List[IPEntry], source_stats: Dict[str, int]) -> EntryStats:
+        """在工作线程中执行: 导出条目副本"""
+        exporter = Exporter(
+            self.output_dir, incremental=INCREMENTAL_EXPORT, compact_json=JSON_COMPACT, ndjson=EXPORT_NDJSON,
+            snapshot=EXPORT_SNAPSHOT, state_path=EXPORT_STATE_FILE
+        )
+        for entry in entries:
+            exporter.add(entry)
+        stats = exporter.finish(source_stats)
+        if self.server is not None:
+            self.server.swap(QueryIndex(entries))
+        if self.cache is not None:
+            self.cache.evict()
+        return stats
+    
+    async def publish(self):
+        """导出当前集合的副本（导出期间探测继续修改原条目）"""
+        entries = [entry.copy() for entry in self.index.entries()]
+        changes, probes = self.changes, self.probes
+        self.changes, self.probes, self.dirty = 0, 0, False
+        self.last_publish = time.time()
+        
+        start = time.perf_counter()
+        stats = await asyncio.to_thread(self._export, entries, dict(self.source_stats))
+        elapsed = time.perf_counter() - start
+        if self.probe_store is not None:
+            self.probe_store.flush()
+        if self.metrics is not None:
+            self.metrics.phases['export'] = elapsed
+            self.metrics.phases['total'] = time.time() - self.started
+            self.metrics.write(self.metrics_dir)
+        
+        logger.info(
+            f"📤 Published {stats.total} entries, ✅ {stats.valid} valid "
+            f"({changes} changes, {probes} probes, {len(self.schedule)} scheduled, {elapsed:.1f}s)"
+        )
+    
+    async def run(self, stop: asyncio.Event):
+        """运行至 stop 被设置，退出前发布最终结果"""
+        self._wakeup = asyncio.Event()
+        session = new_http_session() if aiohttp is not None else None
+        if session is None:
+            logger.info("   aiohttp not installed, fetching remote sources in threads")
+        
+        tasks = [
+            asyncio.create_task(self._refresh_source(rank, source, session, local=False))
+            for rank, source in enumerate(REMOTE_SOURCES)
+        ]
+        tasks += [
+            asyncio.create_task(self._refresh_source(len(REMOTE_SOURCES) + rank, source, session, local=True))
+            for rank, source in enumerate(LOCAL_SOURCES)
+        ]
+        if self.validate:
+            tasks.append(asyncio.create_task(self._dispatch()))
+            tasks += [asyncio.create_task(self._consume()) for _ in range(self.concurrency)]
+        
+        try:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+                if self.should_publish(time.time()):
+                    await self.publish()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if session is not None:
+                await session.close()
+        
+        if self.dirty:
+            logger.info("\n🛑 Stopping, publishing final results")
+            await self.publish()
 
 
 # ============================================================
@@ -869,82 +4715,96 @@ def main():
     logger.info("=" * 60)
     logger.info(f"⚙️  Validation: {'SKIP' if SKIP_VALIDATION else 'ENABLED'}")
     if not SKIP_VALIDATION:
-        logger.info(f"⚙️  Timeout: {VALIDATION_TIMEOUT}s | Concurrency: {VALIDATION_CONCURRENCY}")
+        logger.info(
+            f"⚙️  Timeout: {VALIDATION_TIMEOUT}s | Concurrency: {VALIDATION_CONCURRENCY} | "
+            f"Workers: {VALIDATION_WORKERS} | Engine: {PROBE_ENGINE}"
+        )
+        if ADAPTIVE_TIMEOUT:
+            logger.info(f"⚙️  Adaptive timeout: {ADAPTIVE_TIMEOUT_FLOOR}s - {VALIDATION_TIMEOUT}s")
     logger.info(f"⚙️  Script dir: {SCRIPT_DIR}")
     logger.info("=" * 60)
     
-    # ===== 阶段 1: 数据采集 =====
-    logger.info("\n📡 PHASE 1: Data Collection")
+    # ===== 阶段 1-3: 采集 → 去重 → 验证（流式） =====
+    logger.info("\n📡 PHASE 1-3: Collection → Dedup → Validation (streaming)")
     logger.info("-" * 40)
     
-    all_entries: List[IPEntry] = []
-    source_stats: Dict[str, int] = {}
-    
-    # 远程源
-    logger.info("\n🌐 Remote sources:")
-    for source in REMOTE_SOURCES:
-        try:
-            entries = process_remote_source(source)
-            all_entries.extend(entries)
-            source_stats[source['name']] = len(entries)
-        except Exception as e:
-            logger.error(f"   ❌ Error: {source['name']}: {e}")
-            source_stats[source['name']] = 0
-    
-    # 本地源
-    logger.info("\n📂 Local sources:")
-    for source in LOCAL_SOURCES:
-        try:
-            entries = process_local_source(source)
-            all_entries.extend(entries)
-            source_stats[source['name']] = len(entries)
-        except Exception as e:
-            logger.error(f"   ❌ Error: {source['name']}: {e}")
-            source_stats[source['name']] = 0
-    
-    logger.info(f"\n📊 Raw total: {len(all_entries)} entries")
-    
-    # ===== 阶段 2: 去重排序 =====
-    logger.info("\n🔄 PHASE 2: Deduplication & Sorting")
-    logger.info("-" * 40)
+    exporter = Exporter(
+        OUTPUT_DIR, incremental=INCREMENTAL_EXPORT, compact_json=JSON_COMPACT, ndjson=EXPORT_NDJSON,
+        snapshot=EXPORT_SNAPSHOT, state_path=EXPORT_STATE_FILE
+    )
+    http_cache = HTTPCache(CACHE_DIR, HTTP_CACHE_TTL_DAYS, HTTP_CACHE_MAX_MB) if HTTP_CACHE_ENABLED else None
+    probe_store = None
+    if PROBE_STORE_ENABLED and not SKIP_VALIDATION:
+        probe_store = ProbeStore(PROBE_DB, PROBE_VALID_TTL_HOURS, PROBE_FAIL_BACKOFF_HOURS, PROBE_FAIL_MAX_HOURS)
+    auto_concurrency = None
+    if AUTO_CONCURRENCY and not SKIP_VALIDATION:
+        fd_limit = raise_fd_limit()
+        maximum = AUTO_CONCURRENCY_MAX
+        if fd_limit:
+            # 预留 256 个 fd；无端口条目并行探测时一个条目占用多个连接
+            per_probe = max(len(ports) for ports in DISCOVERY_PORTS.values())
+            maximum = min(maximum, max(10, (fd_limit - 256) // per_probe))
+        auto_concurrency = AIMDConcurrency(VALIDATION_CONCURRENCY, maximum=maximum)
+        logger.info(f"⚙️  Auto concurrency: start {VALIDATION_CONCURRENCY}, max {maximum} (fd limit {fd_limit or 'n/a'})")
+    adaptive = None
+    if ADAPTIVE_TIMEOUT and not SKIP_VALIDATION:
+        adaptive = AdaptiveTimeout(
+            ADAPTIVE_TIMEOUT_FLOOR,
+            VALIDATION_TIMEOUT,
+            ADAPTIVE_TIMEOUT_MULTIPLIER,
+            prior=probe_store.last_latency if probe_store else None
+        )
     
-    unique_entries = deduplicate_entries(all_entries)
-    unique_entries = sort_entries(unique_entries)
+    metrics = Metrics() if METRICS_ENABLED else None
+    profiler = Profiler.create(OUTPUT_DIR, PROFILE, PROFILE_TOP, PROFILE_SLOW_CALLBACK_MS)
+    if profiler is not None:
+        logger.info(f"🔬 Profiling: {', '.join(sorted(profiler.modes))}")
     
-    logger.info(f"📊 Unique entries: {len(unique_entries)}")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        pipeline = run_pipeline(
+            exporter,
+            validate=not SKIP_VALIDATION,
+            timeout=VALIDATION_TIMEOUT,
+            concurrency=VALIDATION_CONCURRENCY,
+            cache=http_cache,
+            probe_store=probe_store,
+            adaptive=adaptive,
+            shards=VALIDATION_WORKERS,
+            samples=LATENCY_SAMPLES,
+            sample_interval=LATENCY_SAMPLE_INTERVAL,
+            scheduler=FairScheduler(SUBNET_CONCURRENCY, PROVIDER_CONCURRENCY, PROBE_RATE),
+            auto_concurrency=auto_concurrency,
+            metrics=metrics,
+            profiler=profiler
+        )
+        if profiler is not None:
+            pipeline = profiler.watch_loop(pipeline)
+        with profiler.phase('pipeline') if profiler is not None else nullcontext():
+            source_stats = loop.run_until_complete(pipeline)
+    finally:
+        loop.close()
+        if probe_store is not None:
+            probe_store.close()
     
-    # ===== 阶段 3: 验证 =====
-    if not SKIP_VALIDATION and unique_entries:
-        logger.info("\n🔍 PHASE 3: Validation")
-        logger.info("-" * 40)
-        logger.info(f"   Testing {len(unique_entries)} addresses...")
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            loop.run_until_complete(
-                validate_entries_async(
-                    unique_entries,
-                    timeout=VALIDATION_TIMEOUT,
-                    concurrency=VALIDATION_CONCURRENCY
-                )
-            )
-        finally:
-            loop.close()
-        
-        valid_count = sum(1 for e in unique_entries if e.is_valid)
-        invalid_count = sum(1 for e in unique_entries if e.is_valid is False)
-        logger.info(f"\n📊 Results: ✅ {valid_count} valid | ❌ {invalid_count} invalid")
-    else:
-        logger.info("\n⏭️  PHASE 3: Validation SKIPPED")
+    if SKIP_VALIDATION:
+        logger.info("\n⏭️  Validation SKIPPED")
     
     # ===== 阶段 4: 导出 =====
     logger.info("\n💾 PHASE 4: Export")
     logger.info("-" * 40)
     
-    stats = {'sources': source_stats}
-    exporter = Exporter(OUTPUT_DIR)
-    exporter.export_all(unique_entries, stats)
+    with ExitStack() as stack:
+        if metrics is not None:
+            stack.enter_context(metrics.phase('export'))
+        if profiler is not None:
+            stack.enter_context(profiler.phase('export'))
+            stack.enter_context(profiler.section('export'))
+        stats = exporter.finish(source_stats)
+    
+    if not SKIP_VALIDATION:
+        logger.info(f"📊 Results: ✅ {stats.valid} valid | ❌ {stats.invalid} invalid")
     
     # ===== 完成 =====
     elapsed = time.time() - start_time
@@ -952,23 +4812,107 @@ def main():
     logger.info("\n" + "=" * 60)
     logger.info("✨ COMPLETED")
     logger.info("=" * 60)
-    logger.info(f"📊 Total: {len(unique_entries)} entries")
+    logger.info(f"📊 Total: {stats.total} entries")
     if not SKIP_VALIDATION:
-        valid = sum(1 for e in unique_entries if e.is_valid)
-        logger.info(f"✅ Valid: {valid}")
+        logger.info(f"✅ Valid: {stats.valid}")
+        latency = stats.latency_summary()
+        if latency:
+            logger.info(
+                f"⏱️  Latency: p50 {latency['median']:.0f}ms | p90 {latency['p90']:.0f}ms | "
+                f"p99 {latency['p99']:.0f}ms"
+            )
     logger.info(f"⏱️  Time: {elapsed:.1f}s")
     logger.info("=" * 60)
     
+    if metrics is not None:
+        metrics.phases['total'] = elapsed
+        metrics.write(METRICS_DIR)
+    if profiler is not None:
+        profiler.write()
+    
     # 输出文件列表
     logger.info("\n📁 Output files:")
-    for f in ["all.txt", "all.json", "all.csv", "valid_only.txt", "summary.md"]:
-        filepath = os.path.join(OUTPUT_DIR, f)
+    outputs = [os.path.join(OUTPUT_DIR, f) for f in (
+        "all.txt", "all.json", "all.ndjson", "all.bin", "all.csv", "valid_only.txt", "summary.md"
+    )] + [os.path.join(METRICS_DIR, f) for f in ("metrics.prom", "metrics.json", "metrics-history.ndjson")]
+    for filepath in outputs:
         if os.path.exists(filepath):
             size = os.path.getsize(filepath)
-            logger.info(f"   ✓ {OUTPUT_DIR}/{f} ({size:,} bytes)")
+            logger.info(f"   ✓ {filepath} ({size:,} bytes)")
     if os.path.exists("all.txt"):
         logger.info(f"   ✓ all.txt (root)")
 
 
+def daemon():
+    """常驻模式入口（DAEMON=true）: 持续采集与探测，结果变化时重新发布；SIGINT / SIGTERM 时发布最终结果后退出"""
+    logger.info("=" * 60)
+    logger.info("🚀 IP Aggregation System v5.0 (daemon)")
+    logger.info("=" * 60)
+    logger.info(f"⚙️  Validation: {'SKIP' if SKIP_VALIDATION else 'ENABLED'}")
+    logger.info(f"⚙️  Source refresh: {DAEMON_SOURCE_INTERVAL:.0f}s (per-source 'refresh' overrides)")
+    if not SKIP_VALIDATION:
+        logger.info(
+            f"⚙️  Re-probe: ≤{DAEMON_FAST_MS:.0f}ms every {DAEMON_PROBE_FAST_INTERVAL:.0f}s | "
+            f"valid every {DAEMON_PROBE_VALID_INTERVAL:.0f}s | failing {DAEMON_PROBE_FAIL_INTERVAL:.0f}s → "
+            f"{DAEMON_PROBE_DEAD_INTERVAL:.0f}s | {DAEMON_PROBE_RATE:g} probes/s"
+        )
+    logger.info(
+        f"⚙️  Publish: ≥{DAEMON_PUBLISH_MIN_CHANGES} changes or {DAEMON_PUBLISH_CHANGE_RATIO:.0%} of valid, "
+        f"every {DAEMON_PUBLISH_MIN_INTERVAL:.0f}s - {DAEMON_PUBLISH_MAX_INTERVAL:.0f}s"
+    )
+    logger.info("=" * 60)
+    
+    http_cache = HTTPCache(CACHE_DIR, HTTP_CACHE_TTL_DAYS, HTTP_CACHE_MAX_MB) if HTTP_CACHE_ENABLED else None
+    probe_store = None
+    if PROBE_STORE_ENABLED and not SKIP_VALIDATION:
+        probe_store = ProbeStore(PROBE_DB, PROBE_VALID_TTL_HOURS, PROBE_FAIL_BACKOFF_HOURS, PROBE_FAIL_MAX_HOURS)
+    adaptive = None
+    if ADAPTIVE_TIMEOUT and not SKIP_VALIDATION:
+        adaptive = AdaptiveTimeout(
+            ADAPTIVE_TIMEOUT_FLOOR,
+            VALIDATION_TIMEOUT,
+            ADAPTIVE_TIMEOUT_MULTIPLIER,
+            prior=probe_store.last_latency if probe_store else None
+        )
+    metrics = Metrics() if METRICS_ENABLED else None
+    server = QueryServer(API_HOST, API_PORT, API_MAX_LIMIT) if API_PORT else None
+    if server is not None:
+        server.start()
+    
+    async def serve():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows 无 add_signal_handler
+        await Daemon(
+            OUTPUT_DIR,
+            validate=not SKIP_VALIDATION,
+            timeout=VALIDATION_TIMEOUT,
+            concurrency=VALIDATION_CONCURRENCY,
+            cache=http_cache,
+            probe_store=probe_store,
+            adaptive=adaptive,
+            scheduler=FairScheduler(SUBNET_CONCURRENCY, PROVIDER_CONCURRENCY, DAEMON_PROBE_RATE),
+            metrics=metrics,
+            server=server,
+            metrics_dir=METRICS_DIR
+        ).run(stop)
+    
+    try:
+        asyncio.run(serve())
+    finally:
+        if server is not None:
+            server.close()
+        if probe_store is not None:
+            probe_store.close()
+    logger.info("✨ Daemon stopped")
+
+
 if __name__ == "__main__":
-    main()
+    if DAEMON_MODE:
+        daemon()
+    else:
+        main()
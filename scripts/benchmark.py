@@ -0,0 +1,1014 @@
+"""
+IP 聚合基准测试
+
+用法:
+    python scripts/benchmark.py            # 默认放大 30 倍（约 5 MB）
+    python scripts/benchmark.py --scale 100
+    python scripts/benchmark.py --suite-only --sizes 1000,10000,100000,1000000
+    python scripts/benchmark.py --suite-only --compare old-report.json
+
+对照基准（新旧实现对比）之后运行基准套件: 各输入格式的合成语料（固定种子）按 --sizes 行数
+解析、去重、排序、逐个导出方法计时，并对本地 listener / black-hole / rst 目标跑 validate_entries_async，
+结果（耗时、吞吐、峰值内存）写入 --report 指定的 JSON 报告
+对照基准中的性能目标（如 IPEntry 内存比例）未达标时以非零状态退出
+"""
+import argparse
+import asyncio
+import collections
+import gc
+import html
+import json
+import os
+import platform
+import random
+import re
+import selectors
+import socket
+import statistics
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import aggregate
+from aggregate import (
+    DedupIndex, EntryStats, Exporter, FairScheduler, HTMLAddressExtractor, IPEntry, LOCAL_SOURCES, PROBERS, SCRIPT_DIR, SnapshotReader,
+    deduplicate_entries,
+    parse_html_content, parse_html_content_soup, parse_remote_content, parse_simple_line, parse_text_content,
+    probe_protocol, read_local_file, sort_entries, validate_entries_async, validate_entry, write_snapshot
+)
+
+
+# 未达标的性能目标，main() 结束时以非零状态退出
+TARGET_FAILURES: List[str] = []
+
+
+def check_target(name: str, ok: bool, detail: str):
+    """检查性能目标（如提速倍数、内存比例），防止后续改动悄悄回退"""
+    print(f"   target       : {'ok' if ok else 'MISSED'} ({detail})")
+    if not ok:
+        TARGET_FAILURES.append(f"{name}: {detail}")
+
+
+def best_of(func: Callable, repeat: int = 7) -> float:
+    """多次运行取最短耗时（秒），计时期间关闭 GC（同 timeit）"""
+    best = float('inf')
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - start)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return best
+
+
+def load_local_corpus(scale: int) -> str:
+    """用本地数据源拼出测试语料"""
+    content = '\n'.join(read_local_file(SCRIPT_DIR / s['file']) for s in LOCAL_SOURCES)
+    return content * scale
+
+
+def parse_text_content_by_line(content: str, source_name: str, category: str, region_hint: str = "") -> List[IPEntry]:
+    """逐行三正则解析（单趟扫描之前的实现，作为对照）"""
+    entries = []
+    for line in content.split('\n'):
+        entries.extend(parse_simple_line(line, source_name, category, region_hint))
+    return entries
+
+
+def bench_parse(scale: int, min_speedup: float):
+    content = load_local_corpus(scale)
+    size_mb = len(content.encode('utf-8')) / 1e6
+
+    expected = [e.as_tuple() for e in parse_text_content_by_line(content, "bench", "bench", "hint")]
+    actual = [e.as_tuple() for e in parse_text_content(content, "bench", "bench", "hint")]
+    assert actual == expected, "single-pass scanner output differs from line-by-line parser"
+    count = len(actual)
+    del expected, actual
+
+    # 两者交替计时，提速倍数取每轮比值的中位数: 机器负载的阶段性波动同时影响同一轮的两次计时
+    legacy_times, scanner_times = [], []
+    for _ in range(9):
+        legacy_times.append(best_of(lambda: parse_text_content_by_line(content, "bench", "bench", "hint"), 1))
+        scanner_times.append(best_of(lambda: parse_text_content(content, "bench", "bench", "hint"), 1))
+    legacy, scanner = min(legacy_times), min(scanner_times)
+    speedup = statistics.median(a / b for a, b in zip(legacy_times, scanner_times))
+
+    print(f"parse: {size_mb:.1f} MB, {count} entries")
+    print(f"   line-by-line : {legacy * 1000:8.1f} ms ({size_mb / legacy:6.1f} MB/s)")
+    print(f"   single-pass  : {scanner * 1000:8.1f} ms ({size_mb / scanner:6.1f} MB/s)")
+    print(f"   speedup      : {speedup:.1f}x (median of paired runs)")
+    check_target("parse", speedup >= min_speedup, f"speedup {speedup:.2f}x >= {min_speedup:.2f}x")
+
+
+def generate_html_page(rows: int, seed: int = 0) -> str:
+    """生成类似 ipTop10 的表格页面（固定种子，可复现）"""
+    rng = random.Random(seed)
+    parts = ['<html><head><title>bench</title><style>td{color:red}</style>',
+             '<script>var x = "1.2.3.4:80";</script></head><body><table>']
+    for i in range(rows):
+        ip = '.'.join(str(rng.randint(1, 254)) for _ in range(4))
+        port = rng.choice([80, 443, 1080, 8080, rng.randint(1, 65535)])
+        style = i % 4
+        if style == 0:
+            parts.append(f'<tr><td>{ip}</td><td>{port}</td><td>CN</td></tr>')
+        elif style == 1:
+            parts.append(f'<tr><td><span>{ip}</span>:<b>{port}</b></td><td>US</td></tr>')
+        elif style == 2:
+            parts.append(f'<tr><td><code>{ip}:{port}</code></td><td>&nbsp;</td></tr>')
+        else:
+            parts.append(f'<tr><td><div>{ip}</div></td><td><a href="#">{port}</a></td></tr>')
+    parts.append('</table><pre>')
+    for _ in range(rows // 4):
+        parts.append('.'.join(str(rng.randint(1, 254)) for _ in range(4)) + f':{rng.randint(1, 65535)}\n')
+    parts.append('</pre></body></html>')
+    return ''.join(parts)
+
+
+def peak_memory(func: Callable) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+# ipTop10.html 风格的样本页面: 原始逗号分隔列表外加表格、嵌套 div / span / td、内联标签、script / style、
+# 字符实体和块级分隔等结构
+HTML_FIXTURE = SCRIPT_DIR / "fixtures" / "ipTop10.html"
+# 样本中只在相邻块级元素的文本粘连后才出现的地址: 旧实现（get_text(strip=True) 整段拼接）会输出，
+# 块级标签作为分隔后不再输出。依次来自 <div>IP</div><div>:PORT</div>、<p>IP</p><p>:PORT</p>、
+# 卡片内两个 div、<br> 两侧，以及整个容器拼成一行后失去行首 # 的注释行
+HTML_FIXTURE_GLUED = {
+    ("162.159.43.93", 2083), ("172.64.53.151", 8880), ("172.64.150.177", 2052), ("172.64.229.151", 2095),
+    ("104.19.0.1", 80)
+}
+# script / style 中的地址两种实现都不应输出
+HTML_FIXTURE_SKIPPED = {("198.41.200.1", 2053), ("172.67.0.9", 8443), ("104.16.0.1", 443)}
+_SKIPPED_ELEMENT_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_PATTERN = re.compile(r'<\s*/?\s*([a-zA-Z][a-zA-Z0-9]*)[^>]*>')
+
+
+def check_html_fixture(path: Path = HTML_FIXTURE):
+    """
+    样本页面上新旧提取器的地址集合只允许有文档说明的差异:
+    块级标签现在作为分隔，旧实现把相邻块的文本粘连成的地址（HTML_FIXTURE_GLUED）不再输出；流式提取器不得多出地址
+    """
+    content = path.read_text(encoding='utf-8')
+    soup = {(e.ip, e.port) for e in parse_html_content_soup(content, path.name, "cloudflare")}
+    stream = {(e.ip, e.port) for e in parse_html_content(content, path.name, "cloudflare")}
+    assert stream, f"{path.name}: no addresses extracted"
+    assert stream <= soup, f"{path.name}: streaming extractor added {sorted(stream - soup, key=str)[:5]}"
+    assert not (stream | soup) & HTML_FIXTURE_SKIPPED, f"{path.name}: addresses from script / style extracted"
+
+    # 块级标签换成换行、内联标签去掉后仍能解析出的地址，不属于粘连产生的地址
+    inline = HTMLAddressExtractor.INLINE_TAGS
+    separated = html.unescape(_TAG_PATTERN.sub(
+        lambda m: '' if m.group(1).lower() in inline else '\n', _SKIPPED_ELEMENT_PATTERN.sub('', content)
+    ))
+    unexplained = (soup - stream) & {(e.ip, e.port) for e in parse_text_content(separated, path.name, "cloudflare")}
+    assert not unexplained, f"{path.name}: streaming extractor lost {sorted(unexplained, key=str)[:5]}"
+    if path == HTML_FIXTURE:
+        assert soup - stream == HTML_FIXTURE_GLUED, \
+            f"{path.name}: dropped {sorted(soup - stream, key=str)}, expected {sorted(HTML_FIXTURE_GLUED, key=str)}"
+    print(f"html fixture: {path.name}, {len(stream)} addresses, "
+          f"{len(soup - stream)} dropped that only existed across block boundaries")
+
+
+def bench_html(rows: int):
+    check_html_fixture()
+    content = generate_html_page(rows)
+    size_mb = len(content.encode('utf-8')) / 1e6
+
+    expected = {(e.ip, e.port) for e in parse_html_content_soup(content, "bench", "bench")}
+    stream_entries = parse_html_content(content, "bench", "bench")
+    actual = [(e.ip, e.port) for e in stream_entries]
+    assert len(actual) == len(set(actual)), "streaming extractor emitted duplicates"
+    assert set(actual) == expected, "streaming extractor output differs from BeautifulSoup extractor"
+    del expected, stream_entries, actual
+
+    soup = best_of(lambda: parse_html_content_soup(content, "bench", "bench"), repeat=3)
+    stream = best_of(lambda: parse_html_content(content, "bench", "bench"), repeat=3)
+    soup_peak = peak_memory(lambda: parse_html_content_soup(content, "bench", "bench"))
+    stream_peak = peak_memory(lambda: parse_html_content(content, "bench", "bench"))
+
+    print(f"html: {size_mb:.1f} MB, {rows} rows")
+    print(f"   soup (3 pass): {soup * 1000:8.1f} ms, peak {soup_peak / 1e6:6.1f} MB")
+    print(f"   streaming    : {stream * 1000:8.1f} ms, peak {stream_peak / 1e6:6.1f} MB")
+    print(f"   speedup      : {soup / stream:.1f}x")
+
+    # 同一页面重复四次: 地址集合不变而页面变为 4 倍，流式提取的峰值内存只随不同地址数增长，应基本持平
+    repeated = content * 4
+    repeated_peak = peak_memory(lambda: parse_html_content(repeated, "bench", "bench"))
+    print(f"   streaming x4 : peak {repeated_peak / 1e6:6.1f} MB ({len(repeated.encode('utf-8')) / 1e6:.1f} MB page)")
+    check_target("html memory", repeated_peak <= stream_peak * 1.25,
+                 f"4x page peak {repeated_peak / 1e6:.1f} MB <= 1.25 x {stream_peak / 1e6:.1f} MB")
+
+
+@dataclass
+class LegacyIPEntry:
+    """紧凑存储之前的 IPEntry（普通 dataclass，作为内存对照）"""
+    ip: str
+    port: Optional[int] = None
+    source: str = ""
+    category: str = ""
+    country: str = ""
+    region: str = ""
+    city: str = ""
+    isp: str = ""
+    net_type: str = ""
+    is_valid: Optional[bool] = None
+    latency_ms: Optional[float] = None
+    validation_error: str = ""
+
+
+def bench_memory(count: int, max_ratio: float):
+    rng = random.Random(0)
+    countries = ['CN', 'US', 'JP', 'SG', 'DE', 'HK']
+    rows = [('.'.join(str(rng.randint(1, 254)) for _ in range(4)), rng.randint(1, 65535),
+             rng.choice(countries), rng.choice(['机房', '家宽', ''])) for _ in range(count)]
+
+    def build(cls):
+        # 模拟逐条解析：字符串来自独立的解码结果，而不是共享的字面量
+        return [cls(ip.encode().decode(), port, f"source-{i % 7}", "proxy", country.lower(),
+                    net_type=net_type.encode().decode())
+                for i, (ip, port, country, net_type) in enumerate(rows)]
+
+    legacy = peak_memory(lambda: build(LegacyIPEntry))
+    compact = peak_memory(lambda: build(IPEntry))
+
+    print(f"memory: {count} entries")
+    print(f"   dataclass    : {legacy / 1e6:8.1f} MB ({legacy / count:5.0f} B/entry)")
+    print(f"   compact      : {compact / 1e6:8.1f} MB ({compact / count:5.0f} B/entry)")
+    print(f"   ratio        : {compact / legacy:.2f}")
+    check_target("memory", compact / legacy <= max_ratio, f"ratio {compact / legacy:.2f} <= {max_ratio:.2f}")
+
+
+def deduplicate_entries_by_address(entries: List[IPEntry]) -> List[IPEntry]:
+    """以 address 字符串为键去重（整数键之前的实现，作为对照）"""
+    seen = {}
+    for entry in entries:
+        key = entry.address
+        existing = seen.get(key)
+        if existing is None:
+            seen[key] = entry
+        elif entry.country and not existing.country:
+            seen[key] = entry
+        elif entry.net_type and not existing.net_type:
+            existing.net_type = entry.net_type
+            existing.country = entry.country or existing.country
+            existing.region = entry.region or existing.region
+            existing.city = entry.city or existing.city
+            existing.isp = entry.isp or existing.isp
+    return list(seen.values())
+
+
+def sort_entries_by_octets(entries: List[IPEntry]) -> List[IPEntry]:
+    """按拆分后的 IP 段排序（整数键之前的实现，作为对照）"""
+    def sort_key(entry: IPEntry):
+        try:
+            octets = [int(x) for x in entry.ip.split('.')]
+            return (0, octets, entry.port or 0)
+        except ValueError:
+            return (1, [0, 0, 0, 0], 0)
+    return sorted(entries, key=sort_key)
+
+
+def generate_raw_entries(count: int, seed: int = 0) -> List[IPEntry]:
+    """生成带重复地址的原始条目（约一半重复，部分带地理信息）"""
+    rng = random.Random(seed)
+    pool = [(rng.randint(1 << 24, (223 << 24) - 1), rng.choice([None, 80, 443, 1080, rng.randint(1, 65535)]))
+            for _ in range(max(1, count // 2))]
+    entries = []
+    for i in range(count):
+        ip_int, port = rng.choice(pool)
+        geo = rng.random() < 0.3
+        entries.append(IPEntry(ip_int, port, f"source-{i % 5}", "proxy",
+                               country="CN" if geo else "", net_type=rng.choice(["", "机房", "家宽"])))
+    return entries
+
+
+def merge_in_order(entries: List[IPEntry], ranks: List[int]) -> List[tuple]:
+    index = DedupIndex()
+    for entry, rank in zip(entries, ranks):
+        index.add(entry.copy(), rank)
+    return [e.as_tuple() for e in sort_entries(index.entries())]
+
+
+def check_merge(count: int = 20000):
+    """重复地址按字段合并，数据源到达顺序不影响合并结果"""
+    # 复审用例: 低 rank 来源只有国家为空的条目，晚到也不能覆盖高 rank 条目的网络类型 / ISP
+    rich = IPEntry("1.2.3.4", None, "source-0", "ip", isp="Cloudflare", net_type="机房")
+    plain = IPEntry("1.2.3.4", None, "source-1", "ip")
+    for order in ([(rich, 0), (plain, 1)], [(plain, 1), (rich, 0)]):
+        merged, = merge_in_order([e for e, _ in order], [r for _, r in order])
+        assert merged == rich.as_tuple(), f"merge depends on arrival order: {merged}"
+
+    rng = random.Random(7)
+    entries, ranks = [], []
+    for _ in range(count):
+        e = IPEntry(rng.randint(1, 300), rng.choice([None, 80]), f"source-{rng.randint(0, 3)}", rng.choice(["ip", "proxy"]),
+                    country=rng.choice(["", "", "CN", "US"]), region=rng.choice(["", "广东"]), city=rng.choice(["", "深圳"]),
+                    isp=rng.choice(["", "", "电信", "联通"]), net_type=rng.choice(["", "", "机房", "家宽"]),
+                    protocol=rng.choice(["", "", "socks5", "http"]))
+        entries.append(e)
+        ranks.append(int(e.source[-1]))
+    # 同一数据源内部顺序固定，只打乱数据源之间的交错
+    expected = merge_in_order(*zip(*sorted(zip(entries, ranks), key=lambda pair: pair[1])))
+    for _ in range(3):
+        pending = {rank: [i for i in range(count) if ranks[i] == rank][::-1] for rank in set(ranks)}
+        order = []
+        while pending:
+            rank = rng.choice(list(pending))
+            order.append(pending[rank].pop())
+            if not pending[rank]:
+                del pending[rank]
+        actual = merge_in_order([entries[i] for i in order], [ranks[i] for i in order])
+        assert actual == expected, "merged entries depend on arrival order"
+    print(f"merge: {count} entries, {len(expected)} addresses, order-independent")
+
+
+def bench_dedup(count: int):
+    expected = sort_entries_by_octets(deduplicate_entries_by_address(generate_raw_entries(count)))
+    actual = sort_entries(deduplicate_entries(generate_raw_entries(count)))
+    assert [e.key for e in actual] == [e.key for e in expected], "integer-keyed dedup/sort differs"
+    # 旧做法整条替换，按字段合并后每个字段至少与旧结果一样完整
+    assert all(not value or new_value for e, old in zip(actual, expected)
+               for value, new_value in zip(old.as_tuple(), e.as_tuple())), "field-wise merge lost information"
+    unique = len(actual)
+    del expected, actual
+
+    raw = generate_raw_entries(count)
+    legacy_dedup = best_of(lambda: deduplicate_entries_by_address(raw), repeat=3)
+    packed_dedup = best_of(lambda: deduplicate_entries(raw), repeat=3)
+    entries = deduplicate_entries(raw)
+    legacy_sort = best_of(lambda: sort_entries_by_octets(entries), repeat=3)
+    packed_sort = best_of(lambda: sort_entries(entries), repeat=3)
+
+    print(f"dedup/sort: {count} raw entries, {unique} unique")
+    print(f"   dedup address: {legacy_dedup * 1000:8.1f} ms")
+    print(f"   dedup packed : {packed_dedup * 1000:8.1f} ms ({legacy_dedup / packed_dedup:.1f}x)")
+    print(f"   sort octets  : {legacy_sort * 1000:8.1f} ms")
+    print(f"   sort packed  : {packed_sort * 1000:8.1f} ms ({legacy_sort / packed_sort:.1f}x)")
+
+
+def export_legacy(entries: List[IPEntry], output_dir: str):
+    """流式导出之前的做法: 先物化全部 dict，再整体 json.dump"""
+    data = [e.to_dict() for e in entries]
+    with open(os.path.join(output_dir, "all.json"), 'w', encoding='utf-8') as f:
+        json.dump({"data": data}, f, indent=2, ensure_ascii=False)
+
+
+def bench_export(count: int):
+    """导出峰值内存: 条目数翻倍时流式导出应基本持平"""
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # _export_root_txt 写在当前目录，避免覆盖仓库里的 all.txt
+        os.chdir(tmp)
+        try:
+            print("export: peak memory while exporting (entries already in memory)")
+            for n in (count // 4, count):
+                entries = sort_entries(deduplicate_entries(generate_raw_entries(n)))
+                exporter = Exporter(os.path.join(tmp, "output"), incremental=False)
+                streaming = peak_memory(lambda: exporter.export_all(entries))
+                legacy = peak_memory(lambda: export_legacy(entries, tmp))
+                elapsed = best_of(lambda: exporter.export_all(entries), repeat=3)
+                print(f"   {len(entries):>8} entries: streaming {streaming / 1e6:6.1f} MB, "
+                      f"materialized json {legacy / 1e6:6.1f} MB, export_all {elapsed * 1000:7.1f} ms")
+        finally:
+            os.chdir(cwd)
+
+
+class ListenerFleet:
+    """本地监听 socket，后台线程接受并立即关闭连接"""
+
+    def __init__(self, count: int = 4):
+        self.sockets = [socket.create_server(('127.0.0.1', 0), backlog=4096) for _ in range(count)]
+        self.ports = [s.getsockname()[1] for s in self.sockets]
+        self._selector = selectors.DefaultSelector()
+        for sock in self.sockets:
+            sock.setblocking(False)
+            self._selector.register(sock, selectors.EVENT_READ)
+        self._stop = False
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop:
+            for key, _ in self._selector.select(timeout=0.1):
+                try:
+                    while True:
+                        conn, _ = key.fileobj.accept()
+                        conn.close()
+                except (BlockingIOError, ConnectionError):
+                    pass
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        for sock in self.sockets:
+            sock.close()
+
+
+async def run_probes(tcp_ping, ports: List[int], count: int, concurrency: int) -> int:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> bool:
+        async with semaphore:
+            success, _, _ = await tcp_ping('127.0.0.1', ports[i % len(ports)], 2.0)
+            return success
+
+    return sum(await asyncio.gather(*(one(i) for i in range(count))))
+
+
+def bench_probe(count: int, concurrency: int):
+    fleet = ListenerFleet()
+    try:
+        print(f"probe: {count} connects to local listeners, concurrency {concurrency}")
+        for name, tcp_ping in PROBERS.items():
+            successes = 0
+
+            def run():
+                nonlocal successes
+                successes = asyncio.run(run_probes(tcp_ping, fleet.ports, count, concurrency))
+
+            elapsed = best_of(run, repeat=3)
+            print(f"   {name:<13}: {elapsed * 1000:8.1f} ms ({count / elapsed:8.0f} probes/s, {successes} ok)")
+    finally:
+        fleet.close()
+
+
+# SOCKS5 替身收到的 CONNECT 目标 (ATYP, 地址, 端口)
+SOCKS5_TARGETS: List[Tuple[int, bytes, int]] = []
+
+
+async def socks5_standin(reader, writer, credentials: bytes = b'user:pass'):
+    """SOCKS5 替身: 要求用户名密码认证，CONNECT 一律成功（不真正转发），记录请求的目标"""
+    try:
+        _, count = await reader.readexactly(2)
+        methods = await reader.readexactly(count)
+        if 0x02 not in methods:
+            writer.write(b'\x05\xff')
+            return
+        writer.write(b'\x05\x02')
+        _, ulen = await reader.readexactly(2)
+        user = await reader.readexactly(ulen)
+        pwd = await reader.readexactly((await reader.readexactly(1))[0])
+        if user + b':' + pwd != credentials:
+            writer.write(b'\x01\x01')
+            return
+        writer.write(b'\x01\x00')
+        _, _, _, atyp = await reader.readexactly(4)
+        size = {0x01: 4, 0x04: 16}.get(atyp) or (await reader.readexactly(1))[0]
+        address = await reader.readexactly(size)
+        SOCKS5_TARGETS.append((atyp, address, int.from_bytes(await reader.readexactly(2), 'big')))
+        writer.write(b'\x05\x00\x00\x01' + bytes(4) + bytes(2))
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def http_proxy_standin(reader, writer):
+    """HTTP 代理替身: 只接受 CONNECT"""
+    try:
+        request = await reader.readuntil(b'\r\n\r\n')
+        status = b'200 Connection established' if request.startswith(b'CONNECT ') else b'405 Method Not Allowed'
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n\r\n')
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def tls_standin(reader, writer):
+    """TLS 替身: 收到 ClientHello 后回复 ServerHello 记录头"""
+    try:
+        header = await reader.readexactly(5)
+        await reader.readexactly(int.from_bytes(header[3:5], 'big'))
+        writer.write(b'\x16\x03\x03\x00\x04\x02\x00\x00\x00')
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def echo_standin(reader, writer):
+    """非代理服务: 回显后关闭"""
+    try:
+        writer.write(await reader.read(64))
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def run_protocol_checks() -> List[str]:
+    servers = {}
+    for name, handler in [('socks5', socks5_standin), ('http', http_proxy_standin),
+                          ('tls', tls_standin), ('echo', echo_standin)]:
+        servers[name] = await asyncio.start_server(handler, '127.0.0.1', 0)
+    port = {name: server.sockets[0].getsockname()[1] for name, server in servers.items()}
+
+    cases = [
+        # (条目, 预期是否通过)
+        (IPEntry('127.0.0.1', port['socks5'], category='socks5', protocol='socks5', proxy_auth='user:pass'), True),
+        (IPEntry('127.0.0.1', port['socks5'], category='socks5', protocol='socks5', proxy_auth='user:wrong'), False),
+        (IPEntry('127.0.0.1', port['socks5'], category='socks5'), False),
+        # 超过 255 字节的凭据无法按 RFC 1929 发送，只做无认证问候
+        (IPEntry('127.0.0.1', port['socks5'], category='socks5', protocol='socks5', proxy_auth='u' * 300 + ':pass'), False),
+        (IPEntry('127.0.0.1', port['http'], category='proxy', protocol='http'), True),
+        (IPEntry('127.0.0.1', port['tls'], category='cloudflare', protocol='tls'), True),
+        (IPEntry('127.0.0.1', port['echo'], category='socks5'), False),
+        (IPEntry('127.0.0.1', port['echo'], category='cloudflare', protocol='tls'), False),
+        # 分类推断的 TLS 只用于 Cloudflare TLS 端口，其他端口（含明文 HTTP 端口）只做 TCP 检测
+        (IPEntry('127.0.0.1', port['echo'], category='cloudflare'), True),
+        # 没有握手实现的协议不按分类推断
+        (IPEntry('127.0.0.1', port['echo'], category='socks5', protocol='socks4'), True),
+        (IPEntry('127.0.0.1', port['echo'], category='local'), True),
+    ]
+    failures = []
+    target = aggregate.PROTOCOL_CHECK_TARGET
+    try:
+        for entry, expected in cases:
+            await validate_entry(entry, 2.0)
+            if entry.is_valid != expected:
+                failures.append(f"{entry.category}/{entry.protocol or '-'} {entry.address}: {entry.validation_error}")
+            elif expected and probe_protocol(entry) and entry.handshake_ms is None:
+                failures.append(f"{entry.category}/{entry.protocol}: handshake latency not recorded")
+            elif len(entry.proxy_auth) > 255 and entry.validation_error != "No auth method":
+                failures.append(f"socks5 with oversized credentials: {entry.validation_error}")
+
+        # 测试目标为 IPv4 字面量时用 ATYP 0x01，主机名用 ATYP 0x03
+        for configured, expected_target in [("1.1.1.1:80", (0x01, bytes([1, 1, 1, 1]), 80)),
+                                            ("check.example:8080", (0x03, b'check.example', 8080))]:
+            aggregate.PROTOCOL_CHECK_TARGET = configured
+            SOCKS5_TARGETS.clear()
+            entry = IPEntry('127.0.0.1', port['socks5'], category='socks5', protocol='socks5', proxy_auth='user:pass')
+            await validate_entry(entry, 2.0)
+            if not entry.is_valid or SOCKS5_TARGETS != [expected_target]:
+                failures.append(f"socks5 target {configured}: {entry.validation_error or SOCKS5_TARGETS}")
+    finally:
+        aggregate.PROTOCOL_CHECK_TARGET = target
+        for server in servers.values():
+            server.close()
+            await server.wait_closed()
+    return failures
+
+
+def check_protocols():
+    failures = asyncio.run(run_protocol_checks())
+    assert not failures, "protocol validators disagree with stand-in servers:\n" + "\n".join(failures)
+    print("protocols: SOCKS5 / HTTP CONNECT / TLS stand-in checks passed")
+
+
+async def run_scheduler_checks() -> List[str]:
+    """一次释放同时放开网段上限和运营商上限时，两个等待者都应拿到条目"""
+    failures = []
+    queue = FairScheduler(subnet_cap=1, provider_cap=2)
+    first, same_subnet, other, third = (
+        IPEntry(ip, 80, isp=isp) for ip, isp in
+        (("1.1.1.1", "P"), ("1.1.1.2", "Q"), ("2.2.2.1", "P"), ("3.3.3.1", "P"))
+    )
+    for entry in (first, same_subnet, other, third):
+        queue.put_nowait(entry)
+    taken = [await queue.get(), await queue.get()]
+    if taken != [first, other]:
+        failures.append(f"unexpected dequeue order: {[e.address for e in taken]}")
+    waiters = [asyncio.create_task(queue.get()) for _ in range(3)]
+    await asyncio.sleep(0)
+    queue.task_done(first)
+    await asyncio.sleep(0)
+    woken = {t.result().address for t in waiters if t.done()}
+    if woken != {same_subnet.address, third.address}:
+        failures.append(f"release woke {sorted(woken)}, expected both unblocked entries")
+    for t in waiters:
+        t.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    return failures
+
+
+def check_scheduler():
+    failures = asyncio.run(run_scheduler_checks())
+    assert not failures, "FairScheduler hand-off:\n" + "\n".join(failures)
+    print("scheduler: waiters unblocked by one release all received entries")
+
+
+def generate_snapshot_entries(count: int, seed: int = 0) -> List[IPEntry]:
+    """带地理 / 验证 / 延迟 / 多次采样信息的去重条目"""
+    rng = random.Random(seed)
+    entries = deduplicate_entries(generate_raw_entries(count, seed))
+    for e in entries:
+        e.is_valid = rng.choice([None, True, False])
+        e.isp = rng.choice(["", "Cloudflare", "阿里云", f"AS{rng.randint(1, 5000)} Hosting"])
+        e.protocol = rng.choice(["", "socks5", "http", "tls"])
+        if e.is_valid:
+            if rng.random() < 0.3:
+                e.set_latency_samples([rng.uniform(1, 900) if rng.random() > 0.2 else None for _ in range(5)])
+            else:
+                e.latency_ms = round(rng.uniform(1, 900), 2)
+    return entries
+
+
+def check_snapshot(count: int = 20000):
+    entries = sort_entries(generate_snapshot_entries(count))
+    f32 = struct.Struct('<f')
+
+    def expected_latency(e: IPEntry) -> Optional[float]:
+        rank = e.rank_latency
+        return None if rank is None else round(f32.unpack(f32.pack(rank))[0], 2)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "all.bin")
+        with open(path, 'wb') as f:
+            size = write_snapshot(f, entries)
+        assert size == os.path.getsize(path), "write_snapshot reported a wrong size"
+
+        with SnapshotReader(path) as reader:
+            assert len(reader) == len(entries)
+            for e, record in zip(entries, reader):
+                expected = (e.ip, e.port, e.is_valid, e.net_type, expected_latency(e),
+                            e.country, e.source, e.isp, e.category, e.protocol)
+                assert tuple(record) == expected, f"snapshot record differs: {record} != {expected}"
+
+            rng = random.Random(1)
+            for e in rng.sample(entries, min(1000, len(entries))):
+                assert [(r.ip, r.port) for r in reader.find(e.ip, e.port)] == [(e.ip, e.port)]
+                same_ip = [(x.ip, x.port) for x in entries if x.ip_int == e.ip_int]
+                assert [(r.ip, r.port) for r in reader.find(e.ip)] == same_ip
+            assert reader.find("0.0.0.1", 1) == []
+
+            ranked = sorted((e for e in entries if e.rank_latency is not None), key=expected_latency)
+            assert [r.latency_ms for r in reader.fastest(len(ranked) + 5)] == [expected_latency(e) for e in ranked]
+            within = reader.within_latency(100.0)
+            assert within and all(r.latency_ms <= 100.0 for r in within)
+            assert len(within) == sum(1 for e in ranked if expected_latency(e) <= 100.0)
+
+        json_size = sum(len(json.dumps(e.to_dict(), ensure_ascii=False).encode('utf-8')) for e in entries)
+    print(f"snapshot: {len(entries)} records round-trip OK, {size:,} bytes (ndjson {json_size:,} bytes)")
+
+
+# ============================================================
+# 基准套件: 合成语料 + 机器可读报告
+# ============================================================
+
+class Report:
+    """
+    机器可读基准报告（JSON）
+    每项结果: name / size / unit / items / seconds / per_second / peak_bytes，可用 --compare 与旧报告对比
+    size 为语料规模（行数），(name, size) 唯一确定一项；items 为实际处理的条目数（吞吐按它计算）
+    """
+
+    SCHEMA = 1
+
+    def __init__(self):
+        self.results: List[Dict[str, Any]] = []
+
+    def add(self, name: str, size: int, seconds: float, unit: str = "items",
+            peak_bytes: Optional[int] = None, items: Optional[int] = None, **extra):
+        items = size if items is None else items
+        self.results.append({
+            "name": name,
+            "size": size,
+            "unit": unit,
+            "items": items,
+            "seconds": round(seconds, 6),
+            "per_second": round(items / seconds, 1) if seconds > 0 else None,
+            "peak_bytes": peak_bytes,
+            **extra
+        })
+
+    def measure(self, name: str, size: int, func: Callable, unit: str = "items",
+                items: Optional[int] = None, repeat: Optional[int] = None):
+        """计时（best of repeat，小规模时多跑几次以压低噪声）并单独跑一次统计峰值内存"""
+        items = size if items is None else items
+        if repeat is None:
+            repeat = max(3, min(15, 100000 // max(items, 1)))
+        seconds = best_of(func, repeat=repeat)
+        peak = peak_memory(func)
+        self.add(name, size, seconds, unit, peak, items)
+        print(f"   {name:<28} {items:>9} {unit:<7} {seconds * 1000:10.1f} ms "
+              f"{items / seconds:12.0f}/s  peak {peak / 1e6:8.1f} MB")
+
+    def write(self, path: str):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                capture_output=True, text=True, timeout=10
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        report = {
+            "schema": self.SCHEMA,
+            "generated_at": datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            "git_commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "parser_version": aggregate.PARSER_VERSION,
+            "results": self.results
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"report: {len(self.results)} results written to {path}")
+
+    def compare(self, path: str, threshold: float = 0.10):
+        """与旧报告逐项对比耗时与峰值内存，超过阈值的标记为回退"""
+        with open(path, 'r', encoding='utf-8') as f:
+            previous = {(r['name'], r['size']): r for r in json.load(f)['results']}
+        print(f"compare: against {path} (regression threshold {threshold:.0%})")
+        regressions = 0
+        for result in self.results:
+            old = previous.get((result['name'], result['size']))
+            if not old or not old['seconds']:
+                continue
+            time_ratio = result['seconds'] / old['seconds']
+            peak_ratio = None
+            if result['peak_bytes'] and old.get('peak_bytes'):
+                peak_ratio = result['peak_bytes'] / old['peak_bytes']
+            regressed = time_ratio > 1 + threshold or (peak_ratio is not None and peak_ratio > 1 + threshold)
+            regressions += regressed
+            peak_text = f"peak x{peak_ratio:.2f}" if peak_ratio is not None else ""
+            print(f"   {'REGRESSION' if regressed else 'ok':<10} {result['name']:<28} {result['size']:>9} "
+                  f"time x{time_ratio:.2f} {peak_text}")
+        print(f"   {regressions} regression(s)")
+
+
+BENCH_LOCATIONS = [
+    ("中国", "广东", "深圳"), ("中国", "江苏", "苏州"), ("美国", "加利福尼亚", "洛杉矶"),
+    ("日本", "东京", ""), ("新加坡", "", ""), ("德国", "黑森", "法兰克福")
+]
+BENCH_RESULT_LOCATIONS = [
+    "China-Jiangxi Nanchang", "China-Fujian Fuqing", "United States-California Los Angeles",
+    "Japan-Tokyo", "Spain-Madrid", "Vietnam-Hanoi"
+]
+BENCH_ISPS = ["阿里云", "腾讯云", "中国电信", "Cloudflare", "Amazon.com", "DigitalOcean, LLC"]
+
+
+def address_pool(lines: int, rng: random.Random, ports: List[int]) -> List[Tuple[str, int]]:
+    """地址池约为行数的 80%，随机抽取时产生约两成重复地址（供去重基准）"""
+    return [('.'.join(str(rng.randint(1, 254)) for _ in range(4)), rng.choice(ports))
+            for _ in range(max(1, lines * 4 // 5))]
+
+
+def generate_socks5_rich(lines: int, seed: int = 0) -> str:
+    """socks5://IP:PORT [[类型] 国家 省 城市 [ISP]] 格式，夹杂注释与无附加信息的行"""
+    rng = random.Random(seed)
+    pool = address_pool(lines, rng, [1080, 1081, 7890, 10808, 443])
+    out = []
+    for i in range(lines):
+        ip, port = rng.choice(pool)
+        if i % 50 == 0:
+            out.append(f"# socks5 list page {i // 50}")
+        elif rng.random() < 0.1:
+            out.append(f"socks5://{ip}:{port}")
+        else:
+            location = ' '.join(part for part in rng.choice(BENCH_LOCATIONS) if part)
+            net_type = rng.choice(["机房", "家宽"])
+            out.append(f"socks5://{ip}:{port} [[{net_type}] {location} [{rng.choice(BENCH_ISPS)}]]")
+    return '\n'.join(out) + '\n'
+
+
+def generate_results_file(lines: int, seed: int = 0) -> str:
+    """ip:port[:scheme] | user:pass | In/Out: 地区[住宅IP] | Dc: … | Status: 格式（本地 results 文件）"""
+    rng = random.Random(seed)
+    pool = address_pool(lines, rng, [443, 1080, 7198, 8080, 8443])
+    out = []
+    for _ in range(lines):
+        ip, port = rng.choice(pool)
+        scheme = rng.choice(["", "", ":https", ":socks5", ":http"])
+        credentials = rng.choice([":", "admin:admin", "1:1", "user:pass"])
+        kind = rng.choice(["住宅IP", "机房IP"])
+        status = rng.choice(["✅", "✅", "❌"])
+        out.append(
+            f"{ip}:{port}{scheme} | {credentials} | In/Out: {rng.choice(BENCH_RESULT_LOCATIONS)}[{kind}] | "
+            f"Dc: {rng.choice(['LAX', 'HKG', 'NRT', 'FRA', 'SIN'])} | Status: {status}"
+        )
+    return '\n'.join(out) + '\n'
+
+
+def generate_plain_list(lines: int, seed: int = 0) -> str:
+    """纯 IP / IP:PORT / IP#PORT 列表，夹杂注释和空行"""
+    rng = random.Random(seed)
+    pool = address_pool(lines, rng, [80, 443, 2053, 8080, 8443])
+    out = []
+    for i in range(lines):
+        ip, port = rng.choice(pool)
+        style = rng.random()
+        if i % 100 == 0:
+            out.append("# updated hourly")
+        elif style < 0.4:
+            out.append(ip)
+        elif style < 0.8:
+            out.append(f"{ip}:{port}")
+        elif style < 0.95:
+            out.append(f"{ip}#{port}")
+        else:
+            out.append("")
+    return '\n'.join(out) + '\n'
+
+
+# 格式名 -> (生成器, 对应的数据源定义)
+BENCH_FORMATS = {
+    "socks5_rich": (generate_socks5_rich, {"name": "bench-socks5", "type": "socks5_rich", "category": "socks5"}),
+    "results": (generate_results_file, {"name": "bench-results", "type": "text", "category": "local-CN"}),
+    "html": (generate_html_page, {"name": "bench-html", "type": "html", "category": "cloudflare"}),
+    "plain": (generate_plain_list, {"name": "bench-plain", "type": "text", "category": "proxy"}),
+}
+
+
+def annotate_validation(entries: List[IPEntry], seed: int = 0):
+    """给条目填上验证结果与延迟，使导出基准覆盖 valid_only / 最快列表等分支"""
+    rng = random.Random(seed)
+    for e in entries:
+        e.is_valid = rng.random() < 0.6
+        if e.is_valid:
+            e.latency_ms = round(rng.uniform(5, 900), 2)
+        else:
+            e.validation_error = "Timeout"
+
+
+def suite_parse(report: Report, size: int, name: str, generate: Callable, source: Dict) -> List[IPEntry]:
+    """单个输入格式的解析计时；语料只在本函数内存活"""
+    content = generate(size, seed=size)
+    report.measure(f"parse/{name}", size, lambda: parse_remote_content(content, source), unit="lines")
+    return parse_remote_content(content, source)
+
+
+def suite_dedup(report: Report, size: int, entries: List[IPEntry]) -> List[IPEntry]:
+    """合并去重计时；原始条目只在本函数内存活"""
+    report.measure("deduplicate_entries", size, lambda: deduplicate_entries(entries), "entries", len(entries))
+    return deduplicate_entries(entries)
+
+
+def suite_parse_and_dedup(report: Report, size: int) -> List[IPEntry]:
+    """各输入格式解析、合并去重、排序；返回排序后的唯一条目供导出基准使用"""
+    unique = suite_dedup(report, size, [
+        entry
+        for name, (generate, source) in BENCH_FORMATS.items()
+        for entry in suite_parse(report, size, name, generate, source)
+    ])
+    rng = random.Random(size)
+    rng.shuffle(unique)
+    report.measure("sort_entries", size, lambda: sort_entries(unique), "entries", len(unique))
+    return sort_entries(unique)
+
+
+def suite_export(report: Report, size: int, entries: List[IPEntry]):
+    """Exporter 各导出方法分别计时（在临时目录中运行，根目录 all.txt 不受影响）"""
+    annotate_validation(entries)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            exporter = Exporter(os.path.join(tmp, "output"), incremental=False)
+            report.measure("EntryStats.collect", size, lambda: EntryStats.collect(entries), "entries", len(entries))
+            stats = EntryStats.collect(entries)
+            methods = [
+                ("_export_txt", lambda: exporter._export_txt(entries, stats)),
+                ("_export_records", lambda: exporter._export_records(entries, stats)),
+                ("_export_snapshot", lambda: exporter._export_snapshot(entries)),
+                ("_export_valid_only", lambda: exporter._export_valid_only(entries)),
+                ("_export_summary", lambda: exporter._export_summary(entries, stats)),
+                ("_export_root_txt", lambda: exporter._export_root_txt(entries)),
+            ]
+            for name, func in methods:
+                report.measure(f"Exporter.{name}", size, func, "entries", len(entries))
+        finally:
+            os.chdir(cwd)
+
+
+class ProbeTargetFleet:
+    """
+    本地探测目标
+    - listener: ListenerFleet，接受后立即关闭
+    - black-hole: listen(0) 且永不 accept，预先占满队列后新的 SYN 被丢弃，连接超时
+    - rst: 只 bind 不 listen 的端口，连接立即被 RST 拒绝
+    """
+
+    def __init__(self, listeners: int = 4, black_holes: int = 2, resets: int = 2):
+        self.listeners = ListenerFleet(listeners)
+        self.black_holes = []
+        self._fillers = []
+        for _ in range(black_holes):
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            sock.listen(0)
+            filler = socket.create_connection(sock.getsockname(), timeout=1)
+            self.black_holes.append(sock)
+            self._fillers.append(filler)
+        self.resets = []
+        for _ in range(resets):
+            sock = socket.socket()
+            sock.bind(('127.0.0.1', 0))
+            self.resets.append(sock)
+
+    def targets(self) -> Dict[str, List[int]]:
+        return {
+            "listener": self.listeners.ports,
+            "black-hole": [s.getsockname()[1] for s in self.black_holes],
+            "rst": [s.getsockname()[1] for s in self.resets],
+        }
+
+    def close(self):
+        self.listeners.close()
+        for sock in self._fillers + self.black_holes + self.resets:
+            sock.close()
+
+
+def suite_validate(report: Report, count: int, timeout: float, concurrency: int):
+    """validate_entries_async 对本地 listener / black-hole / rst 混合目标（6:2:2），每种探测引擎各跑一次"""
+    fleet = ProbeTargetFleet()
+    targets = fleet.targets()
+    mix = ["listener"] * 6 + ["black-hole"] * 2 + ["rst"] * 2
+    engine = aggregate.PROBE_ENGINE
+    try:
+        for name in PROBERS:
+            aggregate.PROBE_ENGINE = name
+            entries = []
+            for i in range(count):
+                kind = mix[i % len(mix)]
+                ports = targets[kind]
+                entries.append(IPEntry('127.0.0.1', ports[i % len(ports)], category=kind))
+            start = time.perf_counter()
+            asyncio.run(validate_entries_async(entries, timeout, concurrency))
+            elapsed = time.perf_counter() - start
+
+            outcomes = collections.Counter(
+                (e.category, 'ok' if e.is_valid else (e.validation_error or 'failed')) for e in entries
+            )
+            wrong = sum(n for (kind, outcome), n in outcomes.items() if (kind == "listener") != (outcome == 'ok'))
+            report.add(f"validate/{name}", count, elapsed, unit="probes",
+                       timeout=timeout, concurrency=concurrency,
+                       outcomes={f"{kind}:{outcome}": n for (kind, outcome), n in sorted(outcomes.items())})
+            print(f"   {'validate/' + name:<28} {count:>9} {'probes':<7} {elapsed * 1000:10.1f} ms "
+                  f"{count / elapsed:12.0f}/s  {wrong} misclassified")
+            assert not wrong, f"{name} engine misclassified local targets: {dict(outcomes)}"
+    finally:
+        aggregate.PROBE_ENGINE = engine
+        fleet.close()
+
+
+def run_suite(report: Report, sizes: List[int], probes: int, timeout: float, concurrency: int):
+    print("suite: synthetic corpora")
+    for size in sizes:
+        entries = suite_parse_and_dedup(report, size)
+        suite_export(report, size, entries)
+        del entries
+    suite_validate(report, probes, timeout, concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IP aggregation benchmarks")
+    parser.add_argument('--scale', type=int, default=30, help="corpus multiplier for local sources")
+    parser.add_argument('--entries', type=int, default=200000, help="entries built for the memory benchmark")
+    parser.add_argument('--min-parse-speedup', type=float, default=5.0,
+                        help="single-pass scanner must stay at least this much faster than line-by-line")
+    parser.add_argument('--max-memory-ratio', type=float, default=1 / 3,
+                        help="compact IPEntry memory must stay within this fraction of the dataclass (a third)")
+    parser.add_argument('--raw-entries', type=int, default=500000, help="raw entries for the dedup/sort benchmark")
+    parser.add_argument('--export-entries', type=int, default=200000, help="raw entries for the export benchmark")
+    parser.add_argument('--probes', type=int, default=5000, help="connects for the probe engine benchmark")
+    parser.add_argument('--probe-concurrency', type=int, default=500, help="in-flight connects for the probe benchmark")
+    parser.add_argument('--html-rows', type=int, default=20000, help="rows in the generated HTML page")
+    parser.add_argument('--suite-only', action='store_true', help="skip the old-vs-new comparisons, run checks + suite")
+    parser.add_argument('--sizes', default="1000,10000,100000", help="comma-separated line counts for the suite")
+    parser.add_argument('--validate-entries', type=int, default=3000, help="entries for the validate_entries_async suite")
+    parser.add_argument('--validate-timeout', type=float, default=0.5, help="probe timeout for the validate suite")
+    parser.add_argument('--report', default="benchmark-report.json", help="machine-readable report path")
+    parser.add_argument('--compare', help="previous report to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    aggregate.logger.setLevel('WARNING')
+    check_protocols()
+    check_scheduler()
+    check_merge()
+    check_snapshot()
+    if not args.suite_only:
+        bench_parse(args.scale, args.min_parse_speedup)
+        bench_html(args.html_rows)
+        bench_memory(args.entries, args.max_memory_ratio)
+        bench_dedup(args.raw_entries)
+        bench_export(args.export_entries)
+        bench_probe(args.probes, args.probe_concurrency)
+
+    report = Report()
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    run_suite(report, sizes, args.validate_entries, args.validate_timeout, args.probe_concurrency)
+    report.write(args.report)
+    if args.compare:
+        report.compare(args.compare, args.threshold)
+    if TARGET_FAILURES:
+        raise SystemExit("performance targets missed:\n  " + "\n  ".join(TARGET_FAILURES))
+
+
+if __name__ == "__main__":
+    main()